@@ -27,6 +27,16 @@ urlpatterns = [
     ),
     # Order Management
     path("orders/", admin_views.admin_orders_list, name="admin_orders_list"),
+    path(
+        "orders/bulk-cancel/",
+        admin_views.admin_bulk_cancel_orders,
+        name="admin_bulk_cancel_orders",
+    ),
+    path(
+        "orders/bulk-status/",
+        admin_views.admin_bulk_update_order_status,
+        name="admin_bulk_update_order_status",
+    ),
     path(
         "orders/<str:order_id>/",
         admin_views.admin_order_detail,
@@ -1,15 +1,13 @@
-from .models import Cart
+from .utils import get_cart_item_count, read_guest_cart
 
 
 def cart_count(request):
-    """Add cart count to all templates"""
+    """Add cart count to all templates (from the cache, db only on a miss)"""
     cart_item_count = 0
 
     if request.user.is_authenticated:
-        try:
-            cart = Cart.objects.get(user=request.user, status="active")
-            cart_item_count = cart.get_item_count()
-        except Cart.DoesNotExist:
-            cart_item_count = 0
+        cart_item_count = get_cart_item_count(request.user)
+    else:
+        cart_item_count = sum(read_guest_cart(request).values())
 
     return {"cart_item_count": cart_item_count}
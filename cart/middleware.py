@@ -0,0 +1,16 @@
+from .utils import GUEST_CART_COOKIE
+
+
+class GuestCartMiddleware:
+    """Drop the guest cart cookie once it was merged on login (cart/signals.py)"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+
+        if getattr(request, "guest_cart_merged", False):
+            response.delete_cookie(GUEST_CART_COOKIE)
+
+        return response
@@ -2,7 +2,6 @@ from django.db import models
 from django.core.validators import MinValueValidator
 from accounts.models import Account
 from products.models import Product, Product_varients
-from offers.utils import apply_offer_to_variant
 
 # Create your models here.
 
@@ -13,6 +12,9 @@ class Cart(models.Model):
     user = models.OneToOneField(Account, on_delete=models.CASCADE, related_name="cart")
     total = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
     status = models.CharField(max_length=20, default="active")
+    # bumped on every item change, the cart page sends it back with batch
+    # updates so changes made elsewhere are not overwritten (cart_batch_update)
+    version = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -20,17 +22,14 @@ class Cart(models.Model):
         return f"Cart for {self.user.email}"
 
     def calculate_total(self):
-        """calculate and update cart total"""
-        total = sum(
-            item.get_subtotal() for item in self.items.all()
-        )  # from the related foreignkey model(cartitem)
-        self.total = total
-        self.save()
-        return total
+        """calculate cart total, written only when it changed (see CartPricer)"""
+        from .utils import CartPricer
+
+        return CartPricer(self).quote().subtotal
 
     def get_item_count(self):
         """Get total number of items in cart"""
-        return sum(item.quantity for item in self.items.all())
+        return self.items.aggregate(count=models.Sum("quantity"))["count"] or 0
 
 
 class CartItem(models.Model):
@@ -58,9 +57,12 @@ class CartItem(models.Model):
     #     """Calculate subtotal for this cart item"""
     #     return self.price * self.quantity
 
-    def get_subtotal(self):
-        """Always compute subtotal using the highest offer (product/category)."""
-        offer_data = apply_offer_to_variant(self.variant)
+    def get_subtotal(self, offer_data=None):
+        """Subtotal at the stored price, kept current by cart.utils.reprice_carts.
+        Pass offer_data from apply_offers_to_variants to price it live instead.
+        """
+        if offer_data is None:
+            return self.price * self.quantity
         final_price = offer_data["final_price"]
         return final_price * self.quantity
 
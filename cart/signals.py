@@ -0,0 +1,30 @@
+from django.contrib.auth.signals import user_logged_in
+from django.db import transaction
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from products.models import Product_varients
+from .utils import merge_guest_cart, read_guest_cart, reprice_carts
+
+
+# variant price changed (or may have), rewrite stored prices of carts holding it
+
+
+@receiver(post_save, sender=Product_varients)
+def variant_saved(sender, instance, created, **kwargs):
+    if created:
+        return
+    transaction.on_commit(lambda: reprice_carts(variant_ids=[instance.id]))
+
+
+# guest cart cookie goes into the user's cart, GuestCartMiddleware deletes it
+
+
+@receiver(user_logged_in)
+def merge_guest_cart_on_login(sender, request, user, **kwargs):
+    if request is None:
+        return
+    entries = read_guest_cart(request)
+    if entries:
+        merge_guest_cart(user, entries)
+        request.guest_cart_merged = True
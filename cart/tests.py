@@ -1,3 +1,102 @@
+import json
+from decimal import Decimal
+
 from django.test import TestCase
+from django.urls import reverse
+
+from orders.tests import OrderTestData
+from .models import Cart, CartItem
+from .utils import apply_cart_operations, bump_cart_version, get_or_create_cart
+
+
+class CartBatchUpdateTests(OrderTestData, TestCase):
+    def setUp(self):
+        self.cart = get_or_create_cart(self.user)
+        first, second, _ = self.variants
+        self.first, self.second = [
+            CartItem.objects.create(
+                cart=self.cart,
+                product=self.product,
+                variant=variant,
+                quantity=1,
+                price=Decimal("1000"),
+            )
+            for variant in (first, second)
+        ]
+
+    def quantities(self):
+        return dict(self.cart.items.values_list("id", "quantity"))
+
+    def version(self):
+        return Cart.objects.get(pk=self.cart.pk).version
+
+    def test_batch_is_applied_and_bumps_the_version(self):
+        result, _ = apply_cart_operations(
+            self.cart,
+            0,
+            [
+                {"op": "set", "item": self.first.id, "quantity": 3},
+                {"op": "remove", "item": self.second.id},
+            ],
+        )
+
+        self.assertEqual(result, "ok")
+        self.assertEqual(self.quantities(), {self.first.id: 3})
+        self.assertEqual((self.version(), self.cart.version), (1, 1))
+
+    def test_stale_batch_is_rejected(self):
+        # another tab changed the cart after this page was rendered
+        bump_cart_version(self.cart)
+
+        result, _ = apply_cart_operations(
+            self.cart, 0, [{"op": "set", "item": self.first.id, "quantity": 3}]
+        )
+
+        self.assertEqual(result, "stale")
+        self.assertEqual(self.quantities(), {self.first.id: 1, self.second.id: 1})
+        self.assertEqual(self.version(), 1)
+
+    def test_second_batch_from_the_same_version_is_rejected(self):
+        operations = [{"op": "set", "item": self.first.id, "quantity": 2}]
+        self.assertEqual(apply_cart_operations(self.cart, 0, operations)[0], "ok")
+
+        self.assertEqual(apply_cart_operations(self.cart, 0, operations)[0], "stale")
+        self.assertEqual(self.version(), 1)
+
+    def test_rejected_operation_rolls_the_batch_back(self):
+        result, message = apply_cart_operations(
+            self.cart,
+            0,
+            [
+                {"op": "remove", "item": self.second.id},
+                {"op": "set", "item": self.first.id, "quantity": 6},
+            ],
+        )
+
+        self.assertEqual(result, "invalid")
+        self.assertIn("Maximum", message)
+        self.assertEqual(self.quantities(), {self.first.id: 1, self.second.id: 1})
+        self.assertEqual(self.version(), 0)
+
+    def test_view_answers_a_stale_batch_with_the_current_cart(self):
+        bump_cart_version(self.cart)
+        self.user.is_active = self.user.is_verified = True
+        self.user.save()
+        self.client.force_login(self.user)
+
+        response = self.client.post(
+            reverse("cart_batch_update"),
+            json.dumps(
+                {
+                    "version": 0,
+                    "operations": [{"op": "remove", "item": self.first.id}],
+                }
+            ),
+            content_type="application/json",
+        )
 
-# Create your tests here.
+        self.assertEqual(response.status_code, 409)
+        state = response.json()
+        self.assertTrue(state["stale"])
+        self.assertEqual(state["version"], 1)
+        self.assertEqual(len(state["items"]), 2)
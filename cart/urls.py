@@ -17,6 +17,7 @@ urlpatterns = [
     ),
     path("ajax/remove/", views.remove_from_cart_ajax, name="remove_from_cart_ajax"),
     path("ajax/clear/", views.clear_cart_ajax, name="clear_cart_ajax"),
+    path("ajax/batch/", views.cart_batch_update, name="cart_batch_update"),
     # path('add/<int:product_id>/', views.add_to_cart, name='add_to_cart'),
     # path('remove/<int:product_id>/', views.remove_from_cart, name='remove_from_cart'),
 ]
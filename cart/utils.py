@@ -1,7 +1,17 @@
 from decimal import Decimal
-from django.db.models import Q
+from typing import NamedTuple
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import DecimalField, F, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from .models import Cart, CartItem
-from offers.utils import get_best_offer_for_product, calculate_discounted_price
+from offers.utils import (
+    apply_offers_to_variants,
+    get_active_offer_index,
+    get_best_offer_for_product,
+    calculate_discounted_price,
+)
 
 
 def get_or_create_cart(user):
@@ -12,6 +22,539 @@ def get_or_create_cart(user):
     return cart
 
 
+# navbar badge: total quantity in the active cart, per user in the cache.
+# Written by Cart.calculate_total and order placement, read by the
+# cart_count context processor; the database is only hit on a miss.
+# The timeout is a safety net for rows removed by cascades.
+CART_COUNT_TIMEOUT = 60 * 60
+
+
+def _cart_count_key(user_id):
+    return f"cart_count:{user_id}"
+
+
+def get_cart_item_count(user):
+    """Total quantity in the user's active cart (cached)"""
+    key = _cart_count_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = (
+            CartItem.objects.filter(cart__user=user, cart__status="active").aggregate(
+                count=Sum("quantity")
+            )["count"]
+            or 0
+        )
+        cache.set(key, count, CART_COUNT_TIMEOUT)
+    return count
+
+
+def set_cart_item_count(user_id, count):
+    """Store the badge count once the current transaction commits"""
+    transaction.on_commit(
+        lambda: cache.set(_cart_count_key(user_id), count, CART_COUNT_TIMEOUT)
+    )
+
+
+class CartLine(NamedTuple):
+    """One priced cart item of a CartQuote"""
+
+    item: CartItem
+    original_price: Decimal
+    final_price: Decimal
+    discount_amount: Decimal
+    discount_percentage: Decimal
+    offer_name: object
+    has_offer: bool
+    is_available: bool  # product, category and variant listed
+    in_stock: bool
+
+    @property
+    def quantity(self):
+        return self.item.quantity
+
+    @property
+    def stock(self):
+        return int(self.item.variant.stock or 0) if self.item.variant else 0
+
+    @property
+    def unavailable(self):
+        return not self.is_available or not self.in_stock
+
+    @property
+    def line_total(self):
+        return self.final_price * self.quantity
+
+    @property
+    def line_original_total(self):
+        return self.original_price * self.quantity
+
+    @property
+    def line_savings(self):
+        return self.discount_amount * self.quantity
+
+    @property
+    def error(self):
+        """checkout error for this line, same messages as before, or None"""
+        name = self.item.product.product_name
+        if not self.is_available:
+            return f"{name} is no longer available."
+        if not self.in_stock:
+            return f"{name} is out of stock."
+        if self.quantity > self.stock:
+            return (
+                f"{name} – Only {self.stock} items available, "
+                f"but you have {self.quantity} in cart."
+            )
+        return None
+
+
+class CartQuote(NamedTuple):
+    """Priced snapshot of a cart from CartPricer, read only"""
+
+    cart: Cart
+    lines: tuple
+    subtotal: Decimal  # what Cart.total holds
+    mrp_total: Decimal
+    savings: Decimal
+    item_count: int
+
+    @property
+    def errors(self):
+        if not self.lines:
+            return ["Your cart is empty."]
+        return [line.error for line in self.lines if line.error]
+
+    @property
+    def is_valid(self):
+        return not self.errors
+
+    def line_for(self, item_id):
+        return next(
+            (line for line in self.lines if str(line.item.id) == str(item_id)), None
+        )
+
+
+class CartPricer:
+    """Prices a cart in a fixed number of queries.
+
+    Items come with product, category and variant in one query and the
+    variant images in a second (the cart template shows them); offers come
+    from the in-memory offer index. quote() returns a CartQuote and only
+    writes when something changed: drifted item prices and Cart.total.
+    Guest carts pass their unsaved items and quote with save=False.
+    """
+
+    def __init__(self, cart, items=None):
+        self.cart = cart
+        self.items = items  # unsaved items of a guest cart, see load_guest_cart
+
+    def load_items(self):
+        if self.items is not None:
+            return list(self.items)
+        items = list(
+            self.cart.items.select_related("product__category", "variant")
+            .prefetch_related("variant__images")
+            .order_by("id")
+        )
+        for item in items:
+            if item.variant is not None:
+                item.variant.product = item.product  # no query on variant.product
+        return items
+
+    def quote(self, save=True):
+        items = self.load_items()
+        pricing = apply_offers_to_variants(item.variant for item in items)
+
+        lines = []
+        for item in items:
+            offer_data = pricing.get(item.variant_id)
+            product = item.product
+            if offer_data is None:
+                # no variant, keep the stored price
+                lines.append(
+                    CartLine(
+                        item, item.price, item.price, Decimal("0.00"), Decimal("0"),
+                        None, False, False, False,
+                    )
+                )
+                continue
+
+            lines.append(
+                CartLine(
+                    item=item,
+                    original_price=offer_data["original_price"],
+                    final_price=offer_data["final_price"],
+                    discount_amount=offer_data["discount_amount"],
+                    discount_percentage=offer_data["discount_percentage"],
+                    offer_name=offer_data["offer_name"],
+                    has_offer=offer_data["has_offer"],
+                    is_available=(
+                        product.is_listed
+                        and (product.category is None or product.category.is_listed)
+                        and item.variant.is_listed
+                    ),
+                    in_stock=(item.variant.stock or 0) > 0,
+                )
+            )
+
+        quote = CartQuote(
+            cart=self.cart,
+            lines=tuple(lines),
+            subtotal=sum((line.line_total for line in lines), Decimal("0.00")),
+            mrp_total=sum((line.line_original_total for line in lines), Decimal("0.00")),
+            savings=sum((line.line_savings for line in lines), Decimal("0.00")),
+            item_count=sum(item.quantity for item in items),
+        )
+        if save:
+            self.save(quote)
+        return quote
+
+    def save(self, quote):
+        """store drifted item prices and the total, only when they changed"""
+        now = timezone.now()
+        stale = []
+        for line in quote.lines:
+            if line.item.variant_id and line.item.price != line.final_price:
+                line.item.price = line.final_price
+                line.item.updated_at = now
+                stale.append(line.item)
+        if stale:
+            CartItem.objects.bulk_update(stale, ["price", "updated_at"])
+
+        if self.cart.total != quote.subtotal:
+            Cart.objects.filter(pk=self.cart.pk).update(
+                total=quote.subtotal, updated_at=now
+            )
+            self.cart.total = quote.subtotal
+
+        # items are loaded anyway, refresh the navbar badge count for free
+        set_cart_item_count(self.cart.user_id, quote.item_count)
+
+
+def get_cart_quote(request, refresh=False):
+    """CartQuote of the user's cart, priced once per request (refresh after changes)"""
+    quote = getattr(request, "_cart_quote", None)
+    if quote is None or refresh:
+        quote = CartPricer(get_or_create_cart(request.user)).quote()
+        request._cart_quote = quote
+    return quote
+
+
+def bump_cart_version(cart):
+    """Mark the cart as changed for pages holding an older version"""
+    Cart.objects.filter(pk=cart.pk).update(version=F("version") + 1)
+
+
+class _RejectedOperation(Exception):
+    """rolls the whole batch back, message goes to the user"""
+
+
+def _set_quantity_error(cart, item_id, quantity):
+    item = (
+        CartItem.objects.filter(cart=cart, pk=item_id)
+        .select_related("product", "variant")
+        .first()
+    )
+    if item is None or item.variant is None:
+        return "This item is no longer in your cart."
+    if not item.product.is_listed or not item.variant.is_listed:
+        return f"{item.product.product_name} is no longer available."
+    return f"Cannot update {item.product.product_name}. Only {item.variant.stock} items available."
+
+
+def apply_cart_operations(cart, version, operations):
+    """Apply a batch of cart changes sent by the cart page, all or nothing.
+
+    operations: [{"op": "set", "item": id, "quantity": n}, {"op": "remove",
+    "item": id}, {"op": "clear"}]. version must be the cart version the page
+    was rendered with; it is compared and bumped in one UPDATE, which also
+    locks the cart row until the batch commits. Quantities are written with
+    conditional UPDATEs (stock and listing checked in the WHERE clause).
+
+    Returns (result, message): "ok", "stale" (the cart changed since, nothing
+    applied) or "invalid" (an operation was rejected, nothing applied).
+    """
+
+    try:
+        with transaction.atomic():
+            bumped = Cart.objects.filter(pk=cart.pk, version=version).update(
+                version=F("version") + 1, updated_at=timezone.now()
+            )
+            if not bumped:
+                return "stale", "Your cart was changed elsewhere and has been refreshed."
+
+            items = CartItem.objects.filter(cart=cart)
+            for operation in operations:
+                action = operation.get("op")
+
+                if action == "clear":
+                    items.delete()
+                    continue
+
+                try:
+                    item_id = int(operation["item"])
+                    quantity = int(operation.get("quantity", 0))
+                except (KeyError, TypeError, ValueError):
+                    raise _RejectedOperation("Invalid cart update.")
+
+                if action == "remove" or (action == "set" and quantity <= 0):
+                    # already gone is fine, the page just catches up
+                    items.filter(pk=item_id).delete()
+                elif action == "set":
+                    if quantity > CartItem.MAX_QUANTITY_PER_PRODUCT:
+                        raise _RejectedOperation(
+                            f"Maximum {CartItem.MAX_QUANTITY_PER_PRODUCT} items allowed per product."
+                        )
+                    updated = items.filter(
+                        pk=item_id,
+                        variant__stock__gte=quantity,
+                        variant__is_listed=True,
+                        product__is_listed=True,
+                    ).update(quantity=quantity, updated_at=timezone.now())
+                    if not updated:
+                        raise _RejectedOperation(
+                            _set_quantity_error(cart, item_id, quantity)
+                        )
+                else:
+                    raise _RejectedOperation("Invalid cart update.")
+    except _RejectedOperation as error:
+        return "invalid", str(error)
+
+    cart.version = version + 1
+    return "ok", "Cart updated."
+
+
+# ---- guest cart ----
+
+# anonymous visitors keep their cart in a signed cookie, "variant:qty,..."
+# (no session or database rows while browsing); merged into Cart/CartItem
+# on login by cart/signals.py, cart.middleware then drops the cookie
+GUEST_CART_COOKIE = "guest_cart"
+GUEST_CART_SALT = "cart.guest"
+GUEST_CART_MAX_AGE = 60 * 60 * 24 * 30
+GUEST_CART_MAX_LINES = 30  # keeps the cookie well under 4KB
+
+
+def read_guest_cart(request):
+    """{variant_id: quantity} from the guest cart cookie, {} if missing or tampered"""
+    raw = request.get_signed_cookie(
+        GUEST_CART_COOKIE, default="", salt=GUEST_CART_SALT, max_age=GUEST_CART_MAX_AGE
+    )
+    entries = {}
+    for part in raw.split(","):
+        variant_id, _, quantity = part.partition(":")
+        if variant_id.isdigit() and quantity.isdigit() and int(quantity) > 0:
+            entries[int(variant_id)] = min(
+                int(quantity), CartItem.MAX_QUANTITY_PER_PRODUCT
+            )
+    return dict(list(entries.items())[:GUEST_CART_MAX_LINES])
+
+
+def write_guest_cart(response, entries):
+    if not entries:
+        response.delete_cookie(GUEST_CART_COOKIE)
+        return
+    value = ",".join(
+        f"{variant_id}:{quantity}"
+        for variant_id, quantity in list(entries.items())[:GUEST_CART_MAX_LINES]
+    )
+    response.set_signed_cookie(
+        GUEST_CART_COOKIE,
+        value,
+        salt=GUEST_CART_SALT,
+        max_age=GUEST_CART_MAX_AGE,
+        httponly=True,
+        samesite="Lax",
+    )
+
+
+def load_guest_cart(entries):
+    """Unsaved CartItems for the guest cart entries, one query for variants
+    (+ images). Item id is the variant id so the cart page can address them.
+    """
+    from products.models import Product_varients
+
+    variants = (
+        Product_varients.objects.filter(id__in=entries)
+        .select_related("product__category")
+        .prefetch_related("images")
+        .order_by("id")
+    )
+    return [
+        CartItem(
+            id=variant.id,
+            product=variant.product,
+            variant=variant,
+            quantity=entries[variant.id],
+            price=variant.price,
+        )
+        for variant in variants
+    ]
+
+
+def get_guest_cart_quote(request):
+    """CartQuote of the guest cart, nothing written"""
+    items = load_guest_cart(read_guest_cart(request))
+    return CartPricer(Cart(total=Decimal("0.00")), items).quote(save=False)
+
+
+def merge_guest_cart(user, entries):
+    """Move a guest cart into the user's cart with one bulk upsert.
+
+    Quantities add up with what is already in the cart, capped at
+    MAX_QUANTITY_PER_PRODUCT and the variant stock; unavailable variants
+    are dropped. Returns the number of lines merged.
+    """
+    from products.models import Product_varients
+
+    if not entries:
+        return 0
+
+    variants = [
+        variant
+        for variant in Product_varients.objects.filter(
+            id__in=entries, is_listed=True, product__is_listed=True
+        ).select_related("product__category")
+        if variant.product.category is None or variant.product.category.is_listed
+    ]
+    if not variants:
+        return 0
+
+    cart = get_or_create_cart(user)
+    in_cart = dict(
+        CartItem.objects.filter(cart=cart, variant__in=variants).values_list(
+            "variant_id", "quantity"
+        )
+    )
+    pricing = apply_offers_to_variants(variants)
+
+    rows = []
+    for variant in variants:
+        current = in_cart.get(variant.id, 0)
+        quantity = min(
+            current + entries[variant.id],
+            CartItem.MAX_QUANTITY_PER_PRODUCT,
+            int(variant.stock or 0),
+        )
+        if quantity <= current:
+            continue
+        rows.append(
+            CartItem(
+                cart=cart,
+                product=variant.product,
+                variant=variant,
+                quantity=quantity,
+                price=pricing[variant.id]["final_price"],
+            )
+        )
+
+    if rows:
+        with transaction.atomic():
+            CartItem.objects.bulk_create(
+                rows,
+                update_conflicts=True,
+                unique_fields=["cart", "product", "variant"],
+                update_fields=["quantity", "price", "updated_at"],
+            )
+            bump_cart_version(cart)
+            CartPricer(cart).quote()  # total and badge count
+    return len(rows)
+
+
+# stored CartItem.price / Cart.total follow offer and variant price changes
+# (cart/signals.py, offer scheduler) so cart reads can use them as they are
+REPRICE_CHUNK_SIZE = 500
+
+
+def _priced(variant_price, offer_info):
+    """same rounding as get_discounted_price"""
+    if not offer_info:
+        return Decimal(str(variant_price)).quantize(Decimal("0.01"))
+    return calculate_discounted_price(variant_price, offer_info["discount_percentage"])
+
+
+def update_cart_totals(cart_ids, chunk_size=REPRICE_CHUNK_SIZE):
+    """Cart.total = sum of stored item price * quantity, one UPDATE per chunk"""
+    cart_ids = list(cart_ids)
+    line_totals = (
+        CartItem.objects.filter(cart=OuterRef("pk"))
+        .order_by()
+        .values("cart")
+        .annotate(total=Sum(F("price") * F("quantity")))
+        .values("total")
+    )
+    money = DecimalField(max_digits=10, decimal_places=2)
+    for start in range(0, len(cart_ids), chunk_size):
+        Cart.objects.filter(id__in=cart_ids[start : start + chunk_size]).update(
+            total=Coalesce(
+                Subquery(line_totals, output_field=money), Value(0), output_field=money
+            ),
+            # prices changed: open cart pages and checkout quotes are stale
+            version=F("version") + 1,
+            updated_at=timezone.now(),
+        )
+
+
+def reprice_carts(
+    product_ids=(), category_ids=(), variant_ids=(), chunk_size=REPRICE_CHUNK_SIZE
+):
+    """Rewrite stored prices of active cart items touched by a price change.
+
+    Items of the given products / product categories / variants (every active
+    cart when nothing is given) are read chunk_size rows at a time with one
+    joined query, priced from the in-memory offer index and the changed ones
+    saved with bulk_update, then the totals of those carts are recomputed in
+    SQL. Returns the number of carts updated.
+    """
+
+    condition = Q()
+    if product_ids:
+        condition |= Q(product_id__in=product_ids)
+    if category_ids:
+        condition |= Q(product__category_id__in=category_ids)
+    if variant_ids:
+        condition |= Q(variant_id__in=variant_ids)
+
+    items = CartItem.objects.filter(
+        condition, cart__status="active", variant__isnull=False
+    ).order_by("id")
+
+    index = get_active_offer_index()
+    changed_carts = set()
+    last_id = 0
+
+    while True:
+        rows = list(
+            items.filter(id__gt=last_id).values_list(
+                "id",
+                "cart_id",
+                "product_id",
+                "product__category_id",
+                "variant__price",
+                "price",
+            )[:chunk_size]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        now = timezone.now()
+        changed = []
+        for item_id, cart_id, product_id, category_id, variant_price, price in rows:
+            new_price = _priced(variant_price, index.best_offer(product_id, category_id))
+            if new_price != price:
+                changed.append(CartItem(id=item_id, price=new_price, updated_at=now))
+                changed_carts.add(cart_id)
+        if changed:
+            CartItem.objects.bulk_update(changed, ["price", "updated_at"])
+
+        if len(rows) < chunk_size:
+            break
+
+    update_cart_totals(changed_carts, chunk_size)
+    return len(changed_carts)
+
+
 def is_product_addable_to_cart(product, variant=None):
     """
     Check if product can be added to cart
@@ -69,6 +612,10 @@ def remove_from_wishlist_if_exists(user, product, variant=None):
             filters["variant"] = variant
 
         delete_count, _ = WishlistItem.objects.filter(**filters).delete()
+        if delete_count:
+            from wishlist.utils import change_wishlist_count
+
+            change_wishlist_count(user.id, -delete_count)
         return delete_count > 0
     except Exception as e:
         # Wishlist app might exists or other error
@@ -81,42 +628,20 @@ def clean_cart_invalid_items(cart):
     Returns: List of removed item names
     """
 
-    removed_items = []
-
-    for item in cart.items.all():
-        if not item.is_product_available() or not item.is_in_stock():
-            removed_items.append(str(item))
-            item.delete()
-
-    if removed_items:
+    quote = CartPricer(cart).quote(save=False)
+    removed = [line.item for line in quote.lines if line.unavailable]
+    if removed:
+        CartItem.objects.filter(id__in=[item.id for item in removed]).delete()
         cart.calculate_total()
 
-    return removed_items
+    return [str(item) for item in removed]
 
 
-def validate_cart_for_checkout(cart):
+def validate_cart_for_checkout(cart, quote=None):
     """
     Validate all cart items before checkout
     Returns: (bool, list) - (is_valid, error_messages)
     """
-    errors = []
-
-    if not cart.items.exists():
-        errors.append("Your cart is empty.")
-        return False, errors
-
-    for item in cart.items.all():
-        # check if product/ variant is available
-        if not item.is_product_available():
-            errors.append(f"{item.product.product_name} is no longer available.")
-
-        # check stock
-        elif not item.is_in_stock():
-            errors.append(f"{item.product.product_name} is out of stock.")
-
-        # Check if quantity exceeds stock
-        elif item.quantity > item.get_available_stock():
-            errors.append(
-                f"{item.product.product_name} – Only {item.get_available_stock()} items available, but you have {item.quantity} in cart."
-            )
+    quote = quote or CartPricer(cart).quote()
+    errors = quote.errors
     return len(errors) == 0, errors
@@ -1,3 +1,5 @@
+import json
+
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -12,20 +14,52 @@ import logging
 from .models import Cart, CartItem
 from products.models import Product, Product_varients
 from .utils import (
+    GUEST_CART_MAX_LINES,
+    CartPricer,
+    get_guest_cart_quote,
+    load_guest_cart,
+    read_guest_cart,
+    write_guest_cart,
+    apply_cart_operations,
+    bump_cart_version,
+    get_cart_quote,
     get_or_create_cart,
+    get_cart_item_count,
+    set_cart_item_count,
     is_product_addable_to_cart,
     get_discounted_price,
     remove_from_wishlist_if_exists,
     clean_cart_invalid_items,
-    validate_cart_for_checkout,
 )
 
-from offers.utils import apply_offer_to_variant
 
 
 logger = logging.getLogger("project_logger")
 
 
+def _cart_summary(quote):
+    """cart totals part of the AJAX responses"""
+    return {
+        "cart_total": str(quote.subtotal),
+        "cart_count": quote.item_count,
+        "cart_savings": str(quote.savings),
+        "subtotal_before_discount": str(quote.mrp_total),
+    }
+
+
+def _line_summary(line):
+    """one cart item part of the AJAX responses"""
+    return {
+        "original_price": str(line.original_price),
+        "discount_amount": str(line.discount_amount),
+        "final_price": str(line.final_price),
+        "discount_percentage": str(line.discount_percentage),
+        "item_subtotal": str(line.line_total),
+        "line_discount": str(line.discount_amount),
+        "item_savings": str(line.line_savings),
+    }
+
+
 # AJAX: update quantity
 @login_required(login_url="login")
 @require_POST
@@ -77,23 +111,9 @@ def update_cart_quantity_ajax(request):
 
             cart_item.quantity += 1
             cart_item.save()
-            cart_item.cart.calculate_total()
-
-            offer_data = apply_offer_to_variant(cart_item.variant)
-
-            total_savings = Decimal("0")
-            subtotal_before_discount = Decimal("0")
-            for it in cart_item.cart.items.all():
-                offer = apply_offer_to_variant(it.variant)
-                total_savings += (
-                    offer["original_price"] - offer["final_price"]
-                ) * it.quantity
-                subtotal_before_discount += offer["original_price"] * it.quantity
-
-            # subtotal_before_discount = sum(
-            #     item.original_price * item.quantity
-            #     for item in cart_item.cart.items.all()
-            # )
+            bump_cart_version(cart_item.cart)
+            quote = CartPricer(cart_item.cart).quote()
+            line = quote.line_for(cart_item.id)
 
             return JsonResponse(
                 {
@@ -101,22 +121,8 @@ def update_cart_quantity_ajax(request):
                     "message": f"Quantity updated to {cart_item.quantity}.",
                     "cart_item_id": cart_item_id,
                     "new_quantity": cart_item.quantity,
-                    "original_price": str(offer_data["original_price"]),
-                    "discount_amount": str(offer_data["discount_amount"]),
-                    "final_price": str(offer_data["final_price"]),
-                    "discount_percentage": str(offer_data["discount_percentage"]),
-                    "item_subtotal": str(cart_item.get_subtotal()),
-                    "cart_total": str(cart_item.cart.total),
-                    "cart_count": cart_item.cart.get_item_count(),
-                    "line_discount": str(
-                        offer_data["original_price"] - offer_data["final_price"]
-                    ),
-                    "item_savings": str(
-                        (offer_data["original_price"] - offer_data["final_price"])
-                        * cart_item.quantity
-                    ),
-                    "cart_savings": str(total_savings),
-                    "subtotal_before_discount": str(subtotal_before_discount),
+                    **_line_summary(line),
+                    **_cart_summary(quote),
                 }
             )
 
@@ -124,23 +130,9 @@ def update_cart_quantity_ajax(request):
             if cart_item.quantity > 1:
                 cart_item.quantity -= 1
                 cart_item.save()
-                cart_item.cart.calculate_total()
-
-                offer_data = apply_offer_to_variant(cart_item.variant)
-
-                total_savings = Decimal("0")
-                subtotal_before_discount = Decimal("0")
-                for it in cart_item.cart.items.all():
-                    offer = apply_offer_to_variant(it.variant)
-                    total_savings += (
-                        offer["original_price"] - offer["final_price"]
-                    ) * it.quantity
-                    subtotal_before_discount += offer["original_price"] * it.quantity
-
-                # subtotal_before_discount = sum(
-                #     item.original_price * item.quantity
-                #     for item in cart_item.cart.items.all()
-                # )
+                bump_cart_version(cart_item.cart)
+                quote = CartPricer(cart_item.cart).quote()
+                line = quote.line_for(cart_item.id)
 
                 return JsonResponse(
                     {
@@ -148,22 +140,8 @@ def update_cart_quantity_ajax(request):
                         "message": f"Quantity updated to {cart_item.quantity}.",
                         "cart_item_id": cart_item_id,
                         "new_quantity": cart_item.quantity,
-                        "original_price": str(offer_data["original_price"]),
-                        "discount_amount": str(offer_data["discount_amount"]),
-                        "final_price": str(offer_data["final_price"]),
-                        "discount_percentage": str(offer_data["discount_percentage"]),
-                        "item_subtotal": str(cart_item.get_subtotal()),
-                        "cart_total": str(cart_item.cart.total),
-                        "cart_count": cart_item.cart.get_item_count(),
-                        "line_discount": str(
-                            offer_data["original_price"] - offer_data["final_price"]
-                        ),
-                        "item_savings": str(
-                            (offer_data["original_price"] - offer_data["final_price"])
-                            * cart_item.quantity
-                        ),
-                        "cart_savings": str(total_savings),
-                        "subtotal_before_discount": str(subtotal_before_discount),
+                        **_line_summary(line),
+                        **_cart_summary(quote),
                     }
                 )
             else:
@@ -171,27 +149,16 @@ def update_cart_quantity_ajax(request):
                 product_name = cart_item.product.product_name
                 cart = cart_item.cart
                 cart_item.delete()
-                cart.calculate_total()
-
-                total_savings = Decimal("0")
-                subtotal_before_discount = Decimal("0")
-                for it in cart.items.all():
-                    offer = apply_offer_to_variant(it.variant)
-                    total_savings += (
-                        offer["original_price"] - offer["final_price"]
-                    ) * it.quantity
-                    subtotal_before_discount += offer["original_price"] * it.quantity
+                bump_cart_version(cart)
+                quote = CartPricer(cart).quote()
 
                 return JsonResponse(
                     {
                         "success": True,
                         "message": f"{product_name} removed from cart.",
                         "removed": True,
-                        "cart_total": str(cart.total),
-                        "cart_count": cart.get_item_count(),
                         "cart_item_id": cart_item_id,
-                        "cart_savings": str(total_savings),
-                        "subtotal_before_discount": str(subtotal_before_discount),
+                        **_cart_summary(quote),
                     }
                 )
 
@@ -207,24 +174,15 @@ def remove_from_cart_ajax(request):
     product_name = cart_item.product.product_name
     cart = cart_item.cart
     cart_item.delete()
-    cart.calculate_total()
-
-    total_savings = Decimal("0")
-    subtotal_before_discount = Decimal("0")
-    for it in cart.items.all():
-        offer = apply_offer_to_variant(it.variant)
-        total_savings += (offer["original_price"] - offer["final_price"]) * it.quantity
-        subtotal_before_discount += offer["original_price"] * it.quantity
+    bump_cart_version(cart)
+    quote = CartPricer(cart).quote()
 
     return JsonResponse(
         {
             "success": True,
             "message": f"{product_name} removed from your cart.",
-            "cart_total": str(cart.total),
-            "cart_count": cart.get_item_count(),
             "cart_item_id": cart_item_id,
-            "cart_savings": str(total_savings),
-            "subtotal_before_discount": str(subtotal_before_discount),
+            **_cart_summary(quote),
         }
     )
 
@@ -237,6 +195,8 @@ def clear_cart_ajax(request):
     cart.items.all().delete()
     cart.total = Decimal("0.00")
     cart.save()
+    bump_cart_version(cart)
+    set_cart_item_count(request.user.id, 0)
     return JsonResponse(
         {
             "success": True,
@@ -249,35 +209,134 @@ def clear_cart_ajax(request):
     )
 
 
-@login_required
-def cart_view(request):
-    """Display cart items"""
+# AJAX: batch of quantity changes / removals from the cart page
+@require_POST
+def cart_batch_update(request):
+    """Apply {"version": n, "operations": [...]} in one transaction, return the
+    new cart state. A stale version is rejected with 409 and the current state
+    so the page can resync instead of overwriting changes made elsewhere.
+    """
+    try:
+        payload = json.loads(request.body)
+        version = int(payload["version"])
+        operations = payload["operations"]
+        if not isinstance(operations, list) or not all(
+            isinstance(operation, dict) for operation in operations
+        ):
+            raise ValueError
+    except (ValueError, KeyError, TypeError):
+        return JsonResponse(
+            {"success": False, "message": "Invalid cart update."}, status=400
+        )
+
+    if not request.user.is_authenticated:
+        return _guest_cart_batch_update(request, operations)
+
     cart = get_or_create_cart(request.user)
-    cart.calculate_total()
+    with transaction.atomic():
+        result, message = apply_cart_operations(cart, version, operations)
+        if result != "ok":
+            cart.refresh_from_db(fields=["version"])
+        quote = CartPricer(cart).quote()
+
+    return JsonResponse(
+        _cart_state(result, message, quote),
+        status={"ok": 200, "stale": 409}.get(result, 400),
+    )
 
-    cart_items = cart.items.select_related(
-        "product", "variant", "product__category"
-    ).all()
 
-    for item in cart_items:
-        if (
-            not item.variant.product.is_listed
-            or not item.variant.is_listed
-            or item.variant.stock <= 0
-        ):
-            item.unavailable = True
+def _cart_state(result, message, quote):
+    return {
+        "success": result == "ok",
+        "stale": result == "stale",
+        "message": message,
+        "version": quote.cart.version,
+        "items": [
+            {
+                "cart_item_id": line.item.id,
+                "new_quantity": line.quantity,
+                **_line_summary(line),
+            }
+            for line in quote.lines
+        ],
+        **_cart_summary(quote),
+    }
+
+
+def _guest_cart_batch_update(request, operations):
+    """cart_batch_update on the guest cart cookie (item ids are variant ids).
+    Checked against stock here, no version: the cookie belongs to one browser.
+    """
+    entries = read_guest_cart(request)
+    items = {item.id: item for item in load_guest_cart(entries)}
+    result, message = "ok", "Cart updated."
+
+    for operation in operations:
+        action = operation.get("op")
+        try:
+            item_id = int(operation.get("item") or 0)
+            quantity = int(operation.get("quantity") or 0)
+        except (TypeError, ValueError):
+            result, message = "invalid", "Invalid cart update."
+            break
+
+        if action == "clear":
+            entries = {}
+        elif action == "remove" or (action == "set" and quantity <= 0):
+            entries.pop(item_id, None)
+        elif action == "set" and item_id in items:
+            variant = items[item_id].variant
+            if quantity > CartItem.MAX_QUANTITY_PER_PRODUCT:
+                result = "invalid"
+                message = f"Maximum {CartItem.MAX_QUANTITY_PER_PRODUCT} items allowed per product."
+                break
+            if quantity > variant.stock:
+                result = "invalid"
+                message = f"Cannot update {variant.product.product_name}. Only {variant.stock} items available."
+                break
+            entries[item_id] = quantity
+        else:
+            result, message = "invalid", "Invalid cart update."
+            break
+
+    if result != "ok":
+        entries = read_guest_cart(request)  # all or nothing, like the user cart
+
+    remaining = []
+    for item_id, quantity in entries.items():
+        if item_id in items:
+            items[item_id].quantity = quantity
+            remaining.append(items[item_id])
+    quote = CartPricer(Cart(total=Decimal("0.00")), remaining).quote(save=False)
+
+    response = JsonResponse(
+        _cart_state(result, message, quote), status=200 if result == "ok" else 400
+    )
+    write_guest_cart(response, entries)
+    return response
+
+
+def cart_view(request):
+    """Display cart items (guest cart from the cookie for anonymous users)"""
+    if request.user.is_authenticated:
+        quote = get_cart_quote(request)
+    else:
+        quote = get_guest_cart_quote(request)
+
+    cart_items = []
+    for line in quote.lines:
+        item = line.item
+        item.unavailable = line.unavailable
+        if line.unavailable:
             item.original_price = item.price
             item.final_price = item.price
             item.discount_amount = Decimal("0.00")
         else:
-            item.unavailable = False
-
-            offer_data = apply_offer_to_variant(item.variant)
-
-            item.original_price = offer_data["original_price"]
-            item.discount_amount = offer_data["discount_amount"]
-            item.final_price = offer_data["final_price"]
-            item.discount_percentage = offer_data.get("discount_percentage", 0)
+            item.original_price = line.original_price
+            item.discount_amount = line.discount_amount
+            item.final_price = line.final_price
+            item.discount_percentage = line.discount_percentage
+        cart_items.append(item)
 
     subtotal_before_discount = sum(
         item.original_price * item.quantity for item in cart_items
@@ -296,9 +355,11 @@ def cart_view(request):
     estimated_delivery = date.today() + timedelta(days=7)
 
     context = {
-        "cart": cart,
+        "cart": quote.cart,
         "cart_items": cart_items,
-        "cart_count": cart.get_item_count(),
+        "cart_count": quote.item_count,
+        # the guest cart is never saved, its cart.total stays 0
+        "cart_total": quote.subtotal,
         "breadcrumbs": breadcrumbs,
         "any_unavailable": any(item.unavailable for item in cart_items),
         "estimated_delivery": estimated_delivery,
@@ -308,10 +369,9 @@ def cart_view(request):
     return render(request, "cart/cart.html", context)
 
 
-@login_required(login_url="login")
 @require_POST
 def add_to_cart(request):
-    """Add product to cart"""
+    """Add product to cart (guests: to the guest cart cookie)"""
     logger.info("Add to cart function called")
     # logger.debug(f"User: {request.user.email}")
     # logger.warning("Test warning message")
@@ -353,6 +413,9 @@ def add_to_cart(request):
         )
         return redirect("product_detail", slug=product.slug)
 
+    if not request.user.is_authenticated:
+        return _add_to_guest_cart(request, product, variant, quantity)
+
     # transaction to ensure data consistancy
     with transaction.atomic():
         cart = get_or_create_cart(request.user)
@@ -397,6 +460,8 @@ def add_to_cart(request):
         else:
             messages.success(request, f"{product.product_name} added to your cart.")
 
+        bump_cart_version(cart)
+
         # remove from wishlist if exists
         remove_from_wishlist_if_exists(request.user, product, variant)
 
@@ -428,6 +493,37 @@ def add_to_cart(request):
         return redirect("user_product_list")
 
 
+def _add_to_guest_cart(request, product, variant, quantity):
+    """add_to_cart for anonymous users, only the signed cookie changes"""
+    entries = read_guest_cart(request)
+    new_quantity = entries.get(variant.id, 0) + quantity
+    product_url = f"/product/{product.slug}/?variant={variant.id}"
+
+    if new_quantity > variant.stock:
+        messages.error(
+            request, f"Cannot add more. Only {variant.stock} items available."
+        )
+        return redirect(product_url)
+
+    if new_quantity > CartItem.MAX_QUANTITY_PER_PRODUCT:
+        messages.error(
+            request,
+            f"Cannot add more. Maximum {CartItem.MAX_QUANTITY_PER_PRODUCT} "
+            f"items allowed per product.",
+        )
+        return redirect(product_url)
+
+    if variant.id not in entries and len(entries) >= GUEST_CART_MAX_LINES:
+        messages.error(request, "Your cart is full. Please log in to add more items.")
+        return redirect(product_url)
+
+    entries[variant.id] = new_quantity
+    messages.success(request, f"{product.product_name} added to your cart.")
+    response = redirect(product_url)
+    write_guest_cart(response, entries)
+    return response
+
+
 # @login_required(login_url='login')
 # @require_POST
 # def update_cart_quantity(request):
@@ -509,13 +605,11 @@ def add_to_cart(request):
 @login_required(login_url="login")
 def proceed_to_checkout(request):
     """Validate cart and proceed to checkout"""
-    cart = get_or_create_cart(request.user)
+    quote = get_cart_quote(request)
 
     # Validate cart
-    is_valid, errors = validate_cart_for_checkout(cart)
-
-    if not is_valid:
-        for error in errors:
+    if not quote.is_valid:
+        for error in quote.errors:
             messages.error(request, error)
         return redirect("cart_view")
 
@@ -527,5 +621,4 @@ def proceed_to_checkout(request):
 @login_required(login_url="login")
 def get_cart_count(request):
     """Get cart item count for AJAX requests"""
-    cart = get_or_create_cart(request.user)
-    return JsonResponse({"count": cart.get_item_count()})
+    return JsonResponse({"count": get_cart_item_count(request.user)})
@@ -1,6 +1,7 @@
-from .models import Category
+from .utils import get_category_tree
 
 
 def menu_links(request):
-    links = Category.objects.all()
+    # cached tree, no query per request
+    links = get_category_tree().categories
     return dict(links=links)
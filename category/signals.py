@@ -0,0 +1,25 @@
+from django.core.management import call_command
+from django.db import transaction
+from django.db.models.signals import post_migrate, post_save, post_delete
+from django.dispatch import receiver
+
+from .models import Category
+from .utils import invalidate_category_tree
+
+
+# after commit, or another worker could reload the old rows under the new
+# version
+
+
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def category_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_category_tree)
+
+
+@receiver(post_migrate)
+def create_cache_table(sender, using, **kwargs):
+    # the database cache (settings.CACHES without REDIS_URL) needs its table,
+    # createcachetable skips existing tables and other backends
+    if sender.name == "category":
+        call_command("createcachetable", database=using, verbosity=0)
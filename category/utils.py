@@ -0,0 +1,96 @@
+import threading
+
+from ecommerce.versions import bump_version, get_version
+from .models import Category
+
+
+# process-level category tree. One query per process per change: Category
+# save/delete (category/signals.py) stores a new version in the cache and
+# every process reloads its copy on the next lookup (the version itself is
+# re-read every few seconds, see ecommerce/versions.py).
+_VERSION_KEY = "category_tree:version"
+
+_tree = None
+_tree_version = None
+_lock = threading.Lock()
+
+
+class CategoryTree:
+    """All categories in memory with parent/children links.
+
+    Nodes are Category instances (default ordering, -created_at) with
+    .parent already set and a .children list, so templates can use them
+    like query results. Treat them as read only, they are shared.
+    """
+
+    def __init__(self, categories):
+        self.categories = list(categories)
+        self.by_id = {category.id: category for category in self.categories}
+        self.by_slug = {
+            category.slug: category for category in self.categories if category.slug
+        }
+
+        for category in self.categories:
+            category.children = []
+        for category in self.categories:
+            parent = self.by_id.get(category.parent_id)
+            if parent is not None:
+                category.parent = parent  # no query on .parent
+                parent.children.append(category)
+
+    def get(self, category_id):
+        return self.by_id.get(category_id)
+
+    def get_by_slug(self, slug):
+        return self.by_slug.get(slug)
+
+    def main_categories(self, listed_only=True):
+        """parent categories (Men/Women) by name"""
+        return sorted(
+            (
+                category
+                for category in self.categories
+                if category.parent_id is None and (category.is_listed or not listed_only)
+            ),
+            key=lambda category: category.category_name,
+        )
+
+    def subcategories(self, listed_only=True):
+        """categories with a parent, default ordering"""
+        return [
+            category
+            for category in self.categories
+            if category.parent_id is not None
+            and (category.is_listed or not listed_only)
+        ]
+
+    def children_of_slug(self, slug, listed_only=False):
+        category = self.by_slug.get(slug)
+        if category is None:
+            return []
+        return [
+            child for child in category.children if child.is_listed or not listed_only
+        ]
+
+    def children_ids(self, slug, listed_only=False):
+        """ids for category_id__in=..., replaces category__parent__slug=slug"""
+        return [child.id for child in self.children_of_slug(slug, listed_only)]
+
+
+def get_category_tree():
+    """Cached CategoryTree, reloaded when another process bumped the version"""
+    global _tree, _tree_version
+
+    version = get_version(_VERSION_KEY)
+    if _tree is not None and _tree_version == version:
+        return _tree
+
+    with _lock:
+        if _tree is None or _tree_version != version:
+            _tree = CategoryTree(Category.objects.all())
+            _tree_version = version
+    return _tree
+
+
+def invalidate_category_tree():
+    bump_version(_VERSION_KEY)
@@ -5,6 +5,7 @@ from django.core.paginator import Paginator
 from django.db.models import Q
 from django.contrib.auth.decorators import login_required
 from category.models import Category
+from .utils import get_category_tree
 from django.utils.text import slugify
 
 # Create your views here.
@@ -44,7 +45,7 @@ def category_list(request):
     categories_page = paginator.get_page(page_number)
 
     # get main categories for filter
-    main_categories = Category.objects.filter(parent=None, is_listed=True)
+    main_categories = get_category_tree().main_categories()
 
     context = {
         "categories": categories_page,
@@ -62,9 +63,7 @@ def add_category(request):
         return redirect("admin_login")
 
     # get main categories (Male/Female) for parent selection
-    main_categories = Category.objects.filter(parent=None, is_listed=True).order_by(
-        "category_name"
-    )
+    main_categories = get_category_tree().main_categories()
 
     if request.method == "POST":
         category_name = request.POST.get("category_name", "").strip()
@@ -173,9 +172,11 @@ def edit_category(request, category_id):
     category = get_object_or_404(Category, id=category_id)
 
     # Get main categories for parent selection (exclude current category and its children)
-    main_categories = Category.objects.filter(parent=None, is_listed=True).exclude(
-        id=category_id
-    )
+    main_categories = [
+        main
+        for main in get_category_tree().main_categories()
+        if main.id != category.id
+    ]
 
     if request.method == "POST":
         category_name = request.POST.get("category_name", "").strip()
@@ -140,6 +140,31 @@ def calculate_return_refund_with_coupon(order, items_to_return):
     }
 
 
+def calculate_item_refunds(items):
+    """{item.id: refund} for cancelled/returned items of any orders.
+    Same coupon share as calculate_return_refund_with_coupon, one CouponUsage
+    query for all of them.
+    """
+    usages = {
+        order_id: (discount, total_before)
+        for order_id, discount, total_before in CouponUsage.objects.filter(
+            order_id__in={item.order_id for item in items}
+        ).values_list("order_id", "discount_amount", "cart_total_before_discount")
+    }
+
+    refunds = {}
+    for item in items:
+        item_paid_total = item.price * item.quantity
+        usage = usages.get(item.order_id)
+        if usage:
+            coupon_discount, original_order_total = usage
+            item_paid_total -= coupon_discount * (
+                item_paid_total / original_order_total
+            )
+        refunds[item.id] = item_paid_total
+    return refunds
+
+
 def get_coupon_discount_for_display(order):
     """Get coupon info to display in order details"""
 
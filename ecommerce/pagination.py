@@ -0,0 +1,271 @@
+import datetime
+import decimal
+import json
+import math
+import uuid
+
+from django.core import signing
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.db.models.constants import LOOKUP_SEP
+from django.utils.functional import cached_property
+
+
+def estimate_count(queryset):
+    """Row estimate from the PostgreSQL planner (no COUNT scan).
+
+    Other databases (SQLite for local runs) fall back to an exact count.
+    """
+    if connections[queryset.db].vendor != "postgresql":
+        return queryset.count()
+    try:
+        plan = json.loads(queryset.order_by().explain(format="json"))
+        return int(plan[0]["Plan"]["Plan Rows"])
+    except Exception:
+        return queryset.count()
+
+
+def _dump_value(value):
+    # full precision, DjangoJSONEncoder would cut microseconds
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, (decimal.Decimal, uuid.UUID)):
+        return str(value)
+    return value
+
+
+class KeysetPaginator:
+    """Cursor (keyset) pagination, a drop-in for Paginator on big listings.
+
+    Pages are fetched with WHERE (sort keys) > (last row) instead of OFFSET
+    and no COUNT(*) is run unless the template asks for paginator.count,
+    which is a planner estimate on PostgreSQL. The queryset ordering is used
+    as the key, with pk appended as tie-breaker; sort fields must be
+    non-null. Pages are addressed by opaque signed tokens (next_cursor /
+    previous_cursor), pass them back with ?cursor=.
+    """
+
+    def __init__(self, object_list, per_page, ordering=None):
+        self.object_list = object_list
+        self.per_page = int(per_page)
+
+        ordering = list(
+            ordering
+            or object_list.query.order_by
+            or object_list.model._meta.ordering
+        )
+        for key in ordering:
+            if not isinstance(key, str) or key == "?":
+                raise ValueError(f"Cannot paginate by cursor on ordering {key!r}")
+
+        pk_name = object_list.model._meta.pk.name
+        if not any(key.lstrip("-") in ("pk", pk_name) for key in ordering):
+            last_desc = bool(ordering) and ordering[-1].startswith("-")
+            ordering.append("-pk" if last_desc else "pk")
+
+        self.ordering = ordering
+        # [(name, descending)]
+        self.keys = [(key.lstrip("-"), key.startswith("-")) for key in ordering]
+        # token only valid for the same sort
+        self.salt = "keyset-pagination:" + ",".join(ordering)
+
+    @cached_property
+    def count(self):
+        """Estimated total (exact outside PostgreSQL)"""
+        return estimate_count(self.object_list)
+
+    @property
+    def estimated(self):
+        """count is a planner estimate, templates show it as ~count"""
+        return connections[self.object_list.db].vendor == "postgresql"
+
+    @property
+    def num_pages(self):
+        return max(1, math.ceil(self.count / self.per_page))
+
+    @property
+    def page_range(self):
+        return range(1, self.num_pages + 1)
+
+    def _field(self, name):
+        query = self.object_list.query
+        if name in query.annotations:
+            return query.annotations[name].output_field
+        model = self.object_list.model
+        if name == "pk":
+            return model._meta.pk
+        parts = name.split(LOOKUP_SEP)
+        for part in parts[:-1]:
+            model = model._meta.get_field(part).related_model
+        return model._meta.get_field(parts[-1])
+
+    def _row_values(self, obj):
+        values = []
+        for name, _ in self.keys:
+            value = obj
+            for part in name.split(LOOKUP_SEP):
+                value = getattr(value, part)
+            values.append(_dump_value(value))
+        return values
+
+    def _encode(self, obj, direction, number):
+        return signing.dumps(
+            {"v": self._row_values(obj), "d": direction, "n": number},
+            salt=self.salt,
+            compress=True,
+        )
+
+    def _decode(self, cursor):
+        """cursor dict or None for a missing/tampered/stale token"""
+        if not cursor:
+            return None
+        try:
+            state = signing.loads(cursor, salt=self.salt)
+            values = [
+                self._field(name).to_python(value)
+                for (name, _), value in zip(self.keys, state["v"], strict=True)
+            ]
+            return {"values": values, "direction": state["d"], "number": int(state["n"])}
+        except Exception:
+            return None
+
+    def _seek(self, values, backwards):
+        """rows after (or before) values in the sort order"""
+        condition = Q()
+        equal = {}
+        for (name, descending), value in zip(self.keys, values):
+            lookup = "lt" if descending != backwards else "gt"
+            condition |= Q(**equal, **{f"{name}__{lookup}": value})
+            equal[name] = value
+        return condition
+
+    def get_page(self, cursor=None):
+        """Page for the cursor token, first page if it is missing or invalid"""
+        state = self._decode(cursor)
+        queryset = self.object_list.order_by(*self.ordering)
+
+        if state is None:
+            rows = list(queryset[: self.per_page + 1])
+            has_next = len(rows) > self.per_page
+            return KeysetPage(rows[: self.per_page], 1, self, has_next, False)
+
+        if state["direction"] == "next":
+            rows = list(
+                queryset.filter(self._seek(state["values"], backwards=False))[
+                    : self.per_page + 1
+                ]
+            )
+            has_next = len(rows) > self.per_page
+            return KeysetPage(
+                rows[: self.per_page], state["number"], self, has_next, True
+            )
+
+        reverse_ordering = [
+            name if descending else f"-{name}" for name, descending in self.keys
+        ]
+        rows = list(
+            self.object_list.order_by(*reverse_ordering).filter(
+                self._seek(state["values"], backwards=True)
+            )[: self.per_page + 1]
+        )
+        has_previous = len(rows) > self.per_page
+        rows = rows[: self.per_page][::-1]
+        number = state["number"] if has_previous else 1
+        return KeysetPage(rows, number, self, True, has_previous)
+
+
+class KeysetPage:
+    """Subset of django Page used by the templates, plus the cursor tokens"""
+
+    def __init__(self, object_list, number, paginator, has_next, has_previous):
+        self.object_list = object_list
+        self.number = number
+        self.paginator = paginator
+        self._has_next = has_next
+        self._has_previous = has_previous
+
+    def __repr__(self):
+        return f"<Page {self.number} (cursor)>"
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def __getitem__(self, index):
+        return self.object_list[index]
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def has_next(self):
+        return self._has_next
+
+    def has_previous(self):
+        return self._has_previous
+
+    def has_other_pages(self):
+        return self._has_next or self._has_previous
+
+    def next_page_number(self):
+        return self.number + 1
+
+    def previous_page_number(self):
+        return self.number - 1
+
+    @cached_property
+    def next_cursor(self):
+        if not self._has_next or not self.object_list:
+            return ""
+        return self.paginator._encode(self.object_list[-1], "next", self.number + 1)
+
+    @cached_property
+    def previous_cursor(self):
+        if not self._has_previous or not self.object_list:
+            return ""
+        return self.paginator._encode(self.object_list[0], "prev", self.number - 1)
+
+    def start_index(self):
+        if not self.object_list:
+            return 0
+        return (self.number - 1) * self.paginator.per_page + 1
+
+    def end_index(self):
+        return self.start_index() + len(self.object_list) - 1
+
+
+# offset pages up to here, past it the Next/Previous links switch to cursors
+KEYSET_AFTER_PAGE = 20
+
+
+def paginate(request, object_list, per_page, keyset_after=KEYSET_AFTER_PAGE):
+    """Page of object_list for ?page= or ?cursor=.
+
+    Numbered offset pages (exact count) as with Paginator up to page
+    keyset_after. From there on the page also gets next_cursor and
+    previous_cursor, so templates link onwards with ?cursor= and deeper
+    pages are fetched by KeysetPaginator (estimated count) instead of a
+    growing OFFSET. Both are "" when the links should use ?page=.
+    page.offset_pages is keyset_after: templates only render page number
+    and Last links up to it.
+    """
+    cursor = request.GET.get("cursor")
+    if cursor:
+        page = KeysetPaginator(object_list, per_page).get_page(cursor)
+        page.offset_pages = keyset_after
+        return page
+
+    page = Paginator(object_list, per_page).get_page(request.GET.get("page"))
+    page.object_list = list(page.object_list)
+    page.offset_pages = keyset_after
+    page.next_cursor = ""
+    page.previous_cursor = ""
+    if page.number >= keyset_after and page.object_list:
+        keyset = KeysetPaginator(object_list, per_page)
+        if page.has_next():
+            page.next_cursor = keyset._encode(
+                page.object_list[-1], "next", page.number + 1
+            )
+        page.previous_cursor = keyset._encode(
+            page.object_list[0], "prev", page.number - 1
+        )
+    return page
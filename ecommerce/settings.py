@@ -112,6 +112,7 @@ MIDDLEWARE = [
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
     "allauth.account.middleware.AccountMiddleware",
     "accounts.middleware.UserStatusCheckMiddleware",
+    "cart.middleware.GuestCartMiddleware",
 ]
 
 ROOT_URLCONF = "ecommerce.urls"
@@ -167,6 +168,32 @@ DATABASES = {
 }
 
 
+# Cache
+# Shared by every worker: the category tree, active offers and listing
+# facets are invalidated by bumping a version key here, and the cart and
+# wishlist badge counts live here. A per-process cache (LocMem) would leave
+# the other workers stale. Redis when REDIS_URL is set, otherwise a table in
+# the database (created by migrate, see category/signals.py).
+
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "django_cache",
+        }
+    }
+
+# how often a process re-reads the version keys above (ecommerce/versions.py)
+CACHE_VERSION_CHECK_SECONDS = int(os.getenv("CACHE_VERSION_CHECK_SECONDS", "5"))
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -277,4 +304,8 @@ ACCOUNT_DOMAIN = "127.0.0.1:8000"
 RAZORPAY_KEY_ID = os.getenv("RAZORPAY_KEY_ID")
 RAZORPAY_KEY_SECRET = os.getenv("RAZORPAY_KEY_SECRET")
 
+# minutes stock stays held for a pending Razorpay payment
+# (expired holds are released by: python manage.py release_stock_holds)
+STOCK_HOLD_MINUTES = int(os.getenv("STOCK_HOLD_MINUTES", "15"))
+
 SECURE_CROSS_ORIGIN_OPENER_POLICY = "same-origin-allow-popups"
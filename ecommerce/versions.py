@@ -0,0 +1,37 @@
+import time
+import uuid
+
+from django.conf import settings
+from django.core.cache import cache
+
+
+# Version keys for the per-process indexes (category tree, active offers,
+# listing facets, ...). Each process keeps its own copy of the data and
+# reloads it when the version in the shared cache changes. The shared cache
+# is read at most once every CACHE_VERSION_CHECK_SECONDS per key and
+# process, so a request looking a version up many times (pricing loops, the
+# navbar) costs no cache round trip.
+
+# key -> (version, time.monotonic() of the last check)
+_checked = {}
+
+
+def get_version(key):
+    """Current version of key, from the shared cache at most every few seconds"""
+    now = time.monotonic()
+    checked = _checked.get(key)
+    if checked is not None and now - checked[1] < settings.CACHE_VERSION_CHECK_SECONDS:
+        return checked[0]
+
+    version = cache.get_or_set(key, "1", None)
+    _checked[key] = (version, now)
+    return version
+
+
+def bump_version(key):
+    """Store a new version, seen by this process at once and by the others
+    within CACHE_VERSION_CHECK_SECONDS"""
+    version = uuid.uuid4().hex
+    cache.set(key, version, None)
+    _checked[key] = (version, time.monotonic())
+    return version
@@ -1,11 +1,9 @@
-from category.models import Category
+from category.utils import get_category_tree
 
 
 def navbar_context(request):
-    """Make main categories available in all templates"""
-    main_categories = Category.objects.filter(
-        parent__isnull=True, is_listed=True
-    ).order_by("category_name")
+    """Make main categories available in all templates (cached tree, no query)"""
+    main_categories = get_category_tree().main_categories()
 
     return {
         "main_categories": main_categories,
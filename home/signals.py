@@ -0,0 +1,36 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from category.models import Category
+from offers.models import CategoryOffer, ProductOffer
+from products.models import Product, Product_varients
+from .utils import invalidate_autocomplete_index, invalidate_listing_facets
+
+
+# product/category names or listing changed, every process rebuilds its
+# suggestions on the next lookup once the change is committed
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=Category)
+@receiver(post_delete, sender=Category)
+def catalog_changed(sender, **kwargs):
+    transaction.on_commit(invalidate_autocomplete_index)
+    transaction.on_commit(invalidate_listing_facets)
+
+
+# variant colour/price/listing or offers change the facet counts and prices
+
+
+@receiver(post_save, sender=Product_varients)
+@receiver(post_delete, sender=Product_varients)
+@receiver(post_save, sender=ProductOffer)
+@receiver(post_delete, sender=ProductOffer)
+@receiver(post_save, sender=CategoryOffer)
+@receiver(post_delete, sender=CategoryOffer)
+def listing_changed(sender, **kwargs):
+    # after commit, or another worker could cache the old counts under the
+    # new version
+    transaction.on_commit(invalidate_listing_facets)
@@ -0,0 +1,365 @@
+import hashlib
+import json
+import math
+import re
+import threading
+import unicodedata
+from bisect import bisect_left
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.core.cache import cache
+from django.db.models import Count, Exists, F, Max, Min, OuterRef, Q
+from django.urls import reverse
+
+from category.utils import get_category_tree
+from ecommerce.versions import bump_version, get_version
+from products.models import Product, Product_varients
+
+
+# in-process autocomplete index of listed product and category names.
+# Built on first use in each process and rebuilt by every process once
+# home/signals.py stores a new version in the shared cache.
+_INDEX_VERSION_KEY = "autocomplete_index:version"
+MIN_SIMILARITY = 0.3
+
+_WORD_RE = re.compile(r"[a-z0-9]+")
+
+
+def normalize(text):
+    """lowercase, strip accents and punctuation: 'Café-Noir ' -> 'cafe noir'"""
+    text = unicodedata.normalize("NFKD", text or "")
+    text = text.encode("ascii", "ignore").decode("ascii").lower()
+    return " ".join(_WORD_RE.findall(text))
+
+
+def trigrams(text):
+    """set of 3-letter grams of every word, padded like pg_trgm"""
+    grams = set()
+    for word in text.split():
+        padded = f"  {word} "
+        grams.update(padded[i : i + 3] for i in range(len(padded) - 2))
+    return grams
+
+
+class AutocompleteIndex:
+    """Prefix (sorted word list + bisect) and trigram index over names.
+
+    Entries are plain dicts ready for JSON: {"type", "name", "url"}.
+    """
+
+    def __init__(self, entries):
+        self.entries = entries
+        self.grams = []
+        self.words = []  # sorted (word, entry index)
+        self.postings = defaultdict(set)  # trigram -> entry indexes
+
+        for index, entry in enumerate(entries):
+            name = normalize(entry["name"])
+            grams = trigrams(name)
+            self.grams.append(grams)
+            for gram in grams:
+                self.postings[gram].add(index)
+            for word in set(name.split()):
+                self.words.append((word, index))
+        self.words.sort()
+
+    def _prefix_matches(self, word):
+        matches = set()
+        position = bisect_left(self.words, (word,))
+        while position < len(self.words) and self.words[position][0].startswith(word):
+            matches.add(self.words[position][1])
+            position += 1
+        return matches
+
+    def search(self, query, limit=8):
+        query = normalize(query)
+        if not query:
+            return []
+
+        # every query word must prefix some word of the name
+        prefix_hits = None
+        for word in query.split():
+            matches = self._prefix_matches(word)
+            prefix_hits = matches if prefix_hits is None else prefix_hits & matches
+
+        scores = {index: 2.0 for index in prefix_hits or ()}
+
+        # typo tolerance: trigram similarity (shared / union), like pg_trgm
+        if len(scores) < limit:
+            query_grams = trigrams(query)
+            shared = defaultdict(int)
+            for gram in query_grams:
+                for index in self.postings.get(gram, ()):
+                    shared[index] += 1
+            for index, count in shared.items():
+                if index in scores:
+                    continue
+                similarity = count / len(query_grams | self.grams[index])
+                if similarity >= MIN_SIMILARITY:
+                    scores[index] = similarity
+
+        ranked = sorted(
+            scores,
+            key=lambda index: (
+                -scores[index],
+                self.entries[index]["type"] != "category",
+                self.entries[index]["name"],
+            ),
+        )
+        return [self.entries[index] for index in ranked[:limit]]
+
+
+_index = None
+_index_version = None
+_lock = threading.Lock()
+
+
+def build_autocomplete_entries():
+    """Listed categories (cached tree) and listed products of listed categories"""
+    shop_url = reverse("user_product_list")
+    entries = []
+
+    for category in get_category_tree().categories:
+        if not category.is_listed or not category.slug:
+            continue
+        param = "main" if category.parent_id is None else "category"
+        entries.append(
+            {
+                "type": "category",
+                "name": category.category_name,
+                "url": f"{shop_url}?{param}={category.slug}",
+            }
+        )
+
+    products = Product.objects.filter(is_listed=True).filter(
+        Q(category__isnull=True) | Q(category__is_listed=True)
+    )
+    for name, slug in products.values_list("product_name", "slug"):
+        entries.append(
+            {
+                "type": "product",
+                "name": name,
+                "url": reverse("product_detail", args=[slug]),
+            }
+        )
+
+    return entries
+
+
+def get_autocomplete_index():
+    """Current index, rebuilt when another process bumped the version"""
+    global _index, _index_version
+
+    version = get_version(_INDEX_VERSION_KEY)
+    if _index is not None and _index_version == version:
+        return _index
+
+    with _lock:
+        # another thread may have rebuilt it while we waited
+        if _index is None or _index_version != version:
+            _index = AutocompleteIndex(build_autocomplete_entries())
+            _index_version = version
+    return _index
+
+
+def invalidate_autocomplete_index():
+    """New version, every process rebuilds its index on the next lookup"""
+    bump_version(_INDEX_VERSION_KEY)
+
+
+# ---- shop listing filters and facet counts ----
+
+# [min, max) selling price buckets shown with counts in the sidebar
+PRICE_BUCKETS = [
+    (Decimal("0"), Decimal("1000")),
+    (Decimal("1000"), Decimal("2500")),
+    (Decimal("2500"), Decimal("5000")),
+    (Decimal("5000"), Decimal("10000")),
+    (Decimal("10000"), None),
+]
+FACETS_TIMEOUT = 600  # also covers offers starting/ending at midnight
+_FACETS_VERSION_KEY = "listing_facets:version"
+
+
+def _clean_price(value):
+    try:
+        price = Decimal(str(value).strip())
+    except (InvalidOperation, ValueError):
+        return ""
+    if not price.is_finite() or price < 0:
+        return ""
+    return str(price.quantize(Decimal("0.01")))
+
+
+def normalize_listing_filters(params):
+    """Listing filters from request.GET in one canonical form.
+
+    Used both to filter and as the facet cache signature, so "?search= Gold "
+    and "?search=gold" share a cache entry. Invalid prices are dropped.
+    """
+    colours = {value for value, _ in Product_varients.COLOUR_CHOICES}
+    colour = (params.get("colour") or "").strip()
+    return {
+        "main": (params.get("main") or "").strip(),
+        "category": (params.get("category") or "").strip(),
+        "colour": colour if colour in colours else "",
+        "search": " ".join((params.get("search") or "").lower().split()),
+        "min_price": _clean_price(params.get("min_price") or ""),
+        "max_price": _clean_price(params.get("max_price") or ""),
+    }
+
+
+def listing_base_queryset(filters):
+    """Visible products with effective_price, main category and search applied"""
+    products = (
+        Product.objects.filter(summary__is_visible=True)
+        .with_effective_price()  # price after offers, for filter/sort in SQL
+        .order_by("-created_at")
+    )
+    if filters["main"]:
+        # subcategory ids from the cached tree instead of joining category twice
+        products = products.filter(
+            category_id__in=get_category_tree().children_ids(filters["main"])
+        )
+    if filters["search"]:
+        # ranked full-text search, an explicit sort still wins
+        products = products.search(filters["search"])
+    return products
+
+
+def _has_colour(colour):
+    return Q(
+        Exists(
+            Product_varients.objects.filter(
+                product=OuterRef("pk"), is_listed=True, colour=colour
+            )
+        )
+    )
+
+
+def _price_range(low, high, inclusive=False):
+    condition = Q()
+    if low not in (None, ""):
+        condition &= Q(effective_price__gte=low)
+    if high not in (None, ""):
+        lookup = "effective_price__lte" if inclusive else "effective_price__lt"
+        condition &= Q(**{lookup: high})
+    return condition
+
+
+def listing_facet_conditions(filters):
+    """{facet: Q} for the category, colour and price filters"""
+    return {
+        "category": (
+            Q(category__slug=filters["category"]) if filters["category"] else Q()
+        ),
+        "colour": _has_colour(filters["colour"]) if filters["colour"] else Q(),
+        # the slider is inclusive on both ends
+        "price": _price_range(filters["min_price"], filters["max_price"], True),
+    }
+
+
+def compute_listing_facets(filters, categories):
+    """Subcategory, colour and price bucket counts plus slider bounds.
+
+    One aggregate query. Each facet is counted with every other active
+    filter but not its own (picking a colour still shows the other colours).
+    """
+    colours = Product_varients.COLOUR_CHOICES
+
+    # per product row: category, one flag per colour (effective_price is
+    # already there); the aggregates below only filter on these annotations
+    rows = listing_base_queryset(filters).order_by().annotate(
+        facet_category=F("category_id"),
+        **{
+            f"facet_colour_{index}": Exists(
+                Product_varients.objects.filter(
+                    product=OuterRef("pk"), is_listed=True, colour=colour
+                )
+            )
+            for index, (colour, _) in enumerate(colours)
+        },
+    )
+
+    category_id = next(
+        (c.id for c in categories if c.slug == filters["category"]), None
+    )
+    category_q = Q(facet_category=category_id) if filters["category"] else Q()
+    colour_q = Q()
+    for index, (colour, _) in enumerate(colours):
+        if colour == filters["colour"]:
+            colour_q = Q(**{f"facet_colour_{index}": True})
+    price_q = _price_range(filters["min_price"], filters["max_price"], True)
+
+    aggregates = {"total": Count("id", filter=category_q & colour_q & price_q)}
+    for category in categories:
+        aggregates[f"category_{category.id}"] = Count(
+            "id", filter=Q(facet_category=category.id) & colour_q & price_q
+        )
+    for index in range(len(colours)):
+        aggregates[f"colour_{index}"] = Count(
+            "id", filter=Q(**{f"facet_colour_{index}": True}) & category_q & price_q
+        )
+    for index, (low, high) in enumerate(PRICE_BUCKETS):
+        aggregates[f"bucket_{index}"] = Count(
+            "id", filter=_price_range(low, high) & category_q & colour_q
+        )
+    # slider bounds ignore the price filter itself
+    aggregates["price_min"] = Min("effective_price", filter=category_q & colour_q)
+    aggregates["price_max"] = Max("effective_price", filter=category_q & colour_q)
+
+    result = rows.aggregate(**aggregates)
+
+    return {
+        "total": result["total"],
+        "categories": [
+            {
+                "slug": category.slug,
+                "name": category.category_name,
+                "count": result[f"category_{category.id}"],
+            }
+            for category in categories
+        ],
+        "colours": [
+            {"value": colour, "label": label, "count": result[f"colour_{index}"]}
+            for index, (colour, label) in enumerate(colours)
+        ],
+        "price_buckets": [
+            {
+                "min": low,
+                "max": high,
+                # the max_price filter is inclusive, stop one paisa short
+                "max_param": high - Decimal("0.01") if high is not None else None,
+                "count": result[f"bucket_{index}"],
+            }
+            for index, (low, high) in enumerate(PRICE_BUCKETS)
+        ],
+        "price_min": result["price_min"] or 0,
+        "price_max": result["price_max"] or 0,
+        # round up to nearest 5000 for the slider
+        "slider_max": math.ceil(int(result["price_max"] or 10000) / 5000) * 5000,
+    }
+
+
+def get_listing_facets(filters, categories):
+    """compute_listing_facets cached by filter signature (see home/signals.py)"""
+    version = get_version(_FACETS_VERSION_KEY)
+    signature = json.dumps(
+        [filters, [category.id for category in categories]], sort_keys=True
+    )
+    key = "listing_facets:%s:%s" % (
+        version,
+        hashlib.md5(signature.encode()).hexdigest(),
+    )
+
+    facets = cache.get(key)
+    if facets is None:
+        facets = compute_listing_facets(filters, categories)
+        cache.set(key, facets, FACETS_TIMEOUT)
+    return facets
+
+
+def invalidate_listing_facets():
+    """new version, every cached facet entry becomes unreachable"""
+    bump_version(_FACETS_VERSION_KEY)
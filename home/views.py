@@ -1,41 +1,38 @@
 from django.shortcuts import render, get_object_or_404, redirect
 from django.contrib import messages
-from django.db.models import Min, Max, Q, Avg
+from django.db.models import Q, Avg
 from django.http import JsonResponse
 from products.models import Product, VariantImage
 from reviews.models import Review
 from reviews.utils import has_purchased_product
-from django.core.paginator import Paginator
-from category.models import Category
-import math
+from ecommerce.pagination import paginate
+from category.utils import get_category_tree
 from django.urls import reverse
 from offers.utils import apply_offer_to_variant
+from products.utils import load_product_cards
+from .utils import (
+    get_autocomplete_index,
+    get_listing_facets,
+    listing_base_queryset,
+    listing_facet_conditions,
+    normalize_listing_filters,
+)
 
 
 # Create your views here.
 
 
 def home_page(request):
-    products = (
-        Product.objects.filter(
-            is_listed=True, varients__is_listed=True, varients__stock__gt=0
-        )
-        .annotate(min_price=Min("varients__price"))
-        .prefetch_related("varients__images", "varients", "category")
-        .distinct()  # to prevent duplicte products
-        .order_by("-created_at")[:4]
-    )
+    # visibility/stock come from the denormalized ProductSummary row (no join + distinct)
+    products = Product.objects.filter(
+        summary__is_visible=True, summary__in_stock=True
+    ).order_by("-created_at")[:4]
 
-    # attach min price variant to each product for template access
-    for product in products:
-        product.min_variant = product.varients.filter(
-            is_listed=True, price=product.min_price
-        ).first()
+    # attach min price variant, image and pricing to each product for template access
+    products = load_product_cards(products, in_stock_only=True)
 
     # get main categories for navbar dropdown(parent categories only)
-    main_categories = Category.objects.filter(
-        parent__isnull=True, is_listed=True
-    ).order_by("category_name")
+    main_categories = get_category_tree().main_categories()
 
     return render(
         request,
@@ -46,46 +43,23 @@ def home_page(request):
 
 def user_product_list(request):
     """product listing wiith filter adnsearch"""
-    products = (
-        Product.objects.filter(
-            is_listed=True, varients__is_listed=True, varients__stock__gte=0
-        )
-        .annotate(min_price=Min("varients__price"))
-        .prefetch_related("varients__images", "varients", "category")
-        .order_by("-created_at")
-    )
-
-    main = request.GET.get("main")
-    if main:
-        # filter by parent slug
-        products = products.filter(category__parent__slug=main)
-
-    # filter- sub category
-    category = request.GET.get("category")
-    if category:
-        products = products.filter(category__slug=category)
-
-    search = request.GET.get("search")
-    if search:
-        products = products.filter(product_name__icontains=search)
-
-    min_price = request.GET.get("min_price")
-    max_price = request.GET.get("max_price")
+    filters = normalize_listing_filters(request.GET)
+    conditions = listing_facet_conditions(filters)
 
-    if min_price:
-        products = products.filter(min_price__gte=min_price)
-    if max_price:
-        products = products.filter(min_price__lte=max_price)
+    # main category (parent slug) and search
+    products = listing_base_queryset(filters)
 
-    # remove duplicate product from price filtering
-    products = products.distinct()
+    # sub category, colour and selling price (after offers, not the variant list price)
+    products = products.filter(
+        conditions["category"], conditions["colour"], conditions["price"]
+    )
 
     # sorting
     sort = request.GET.get("sort")
     if sort == "price_low":
-        products = products.order_by("min_price")
+        products = products.order_by("effective_price")
     elif sort == "price_high":
-        products = products.order_by("-min_price")
+        products = products.order_by("-effective_price")
     elif sort == "name_asc":
         products = products.order_by("product_name")
     elif sort == "name_desc":
@@ -93,30 +67,17 @@ def user_product_list(request):
     elif sort == "new":
         products = products.order_by("-created_at")
 
-    highest_variant_price = (
-        products.aggregate(Max("min_price"))["min_price__max"] or 10000
-    )
-
-    #  Round up to nearest 5000
-    rounded_max_price = math.ceil(int(highest_variant_price) / 5000) * 5000
+    categories = get_category_tree().subcategories()
 
-    paginator = Paginator(products, 5)
-    page = request.GET.get("page")
-    products_page = paginator.get_page(page)
+    # counts per subcategory/colour/price bucket and slider bounds, cached
+    facets = get_listing_facets(filters, categories)
 
-    # attach min price variant to each product for consistent display
-    for product in products_page:
-        product.min_variant = product.varients.filter(
-            is_listed=True, price=product.min_price
-        ).first()  # This line creates a temporary attribute not a model filed and not save to db
+    # numbered pages, cursors past KEYSET_AFTER_PAGE (no deep OFFSET)
+    products_page = paginate(request, products, 5)
 
-        if product.min_variant:
-            pricing_pl = apply_offer_to_variant(product.min_variant)
-            product.pricing = pricing_pl  # pass offer details to templates
-        else:
-            product.pricing = None
-
-    categories = Category.objects.filter(parent__isnull=False, is_listed=True)
+    # attach min price variant, image and pricing to each product for consistent display
+    # (fixed number of queries for the whole page)
+    products_page.object_list = load_product_cards(products_page.object_list)
 
     breadcrumbs = [
         {"label": "Home", "url": reverse("home")},
@@ -129,7 +90,9 @@ def user_product_list(request):
             "products": products_page,
             "categories": categories,
             "request": request,  # Important for retaining filter values
-            "max_price": rounded_max_price,
+            "max_price": facets["slider_max"],
+            "facets": facets,
+            "filters": filters,
             "breadcrumbs": breadcrumbs,
         },
     )
@@ -206,28 +169,16 @@ def user_product_detail(request, slug):
     selcted_pricing = apply_offer_to_variant(selected_variant)
 
     # related products (same category, exclude current)
-    related = (
-        Product.objects.filter(
-            is_listed=True,
-            category=product.category,
-            varients__is_listed=True,
-            varients__stock__gt=0,
-        )
-        .exclude(id=product.id)
-        .annotate(min_price=Min("varients__price"))
-        .prefetch_related("varients__images", "varients")
-        .distinct()[:8]
-    )
-    # attach min price variant to realated products
-    for related_product in related:
-        related_product.min_variant = related_product.varients.filter(
-            is_listed=True, price=related_product.min_price
-        ).first()
+    related = Product.objects.filter(
+        category=product.category,
+        summary__is_visible=True,
+        summary__in_stock=True,
+    ).exclude(id=product.id)[:8]
+    # attach min price variant, image and pricing to realated products
+    related = load_product_cards(related, in_stock_only=True)
 
     # get main categories for navbar
-    main_categories = Category.objects.filter(
-        parent__isnull=True, is_listed=True
-    ).order_by("category_name")
+    main_categories = get_category_tree().main_categories()
 
     reviews = (
         Review.objects.filter(product=product)
@@ -283,6 +234,16 @@ def user_product_detail(request, slug):
     )
 
 
+def autocomplete(request):
+    """search suggestions as json, served from the in-process index (no db hit)"""
+    query = request.GET.get("q", "").strip()[:100]
+    if len(query) < 2:
+        return JsonResponse({"query": query, "results": []})
+
+    results = get_autocomplete_index().search(query)
+    return JsonResponse({"query": query, "results": results})
+
+
 def product_unavailable(request):
     return render(request, "errors/product_unavailable.html", status=410)
 
@@ -0,0 +1,72 @@
+import heapq
+import time
+from datetime import datetime, time as dt_time, timezone as dt_timezone
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from offers.utils import get_offer_transition_dates, sync_offer_statuses
+
+
+def _transition_moment(day):
+    # offer dates are compared with timezone.now().date(), a UTC date
+    return datetime.combine(day, dt_time.min, tzinfo=dt_timezone.utc)
+
+
+class Command(BaseCommand):
+    help = (
+        "Flip offer status (scheduled/active/expired) at start and end dates. "
+        "Runs once by default, --loop keeps running and wakes up at each transition."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running, sleeping until the next offer starts or expires",
+        )
+        parser.add_argument(
+            "--refresh",
+            type=int,
+            default=300,
+            help="Seconds between reloading upcoming transitions in --loop mode",
+        )
+
+    def handle(self, *args, **options):
+        changed = sync_offer_statuses()
+        self.stdout.write(self.style.SUCCESS(f"Updated {changed} offer(s)"))
+
+        if options["loop"]:
+            try:
+                self.run_loop(max(options["refresh"], 1))
+            except KeyboardInterrupt:
+                self.stdout.write("Offer scheduler stopped")
+
+    def run_loop(self, refresh):
+        """Priority queue of upcoming transition moments, reloaded every refresh
+        seconds so offers added or edited meanwhile are picked up."""
+
+        queue = []
+        reload_at = 0.0
+
+        while True:
+            if time.monotonic() >= reload_at:
+                queue = [_transition_moment(day) for day in get_offer_transition_dates()]
+                heapq.heapify(queue)
+                reload_at = time.monotonic() + refresh
+                close_old_connections()
+
+            now = timezone.now()
+            if queue and queue[0] <= now:
+                # everything due at once: one bulk update per status change
+                while queue and queue[0] <= now:
+                    heapq.heappop(queue)
+                changed = sync_offer_statuses()
+                self.stdout.write(f"{now:%Y-%m-%d %H:%M} updated {changed} offer(s)")
+                continue
+
+            wait = refresh
+            if queue:
+                wait = min(wait, (queue[0] - now).total_seconds())
+            time.sleep(max(wait, 1))
@@ -0,0 +1,62 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:13
+
+from django.db import migrations, models
+from django.utils import timezone
+
+
+def normalize_offer_status(apps, schema_editor):
+    """active offers that have not started become scheduled, ended ones expired"""
+    today = timezone.now().date()
+    for name in ("ProductOffer", "CategoryOffer"):
+        model = apps.get_model("offers", name)
+        model.objects.filter(status="active", end_date__lt=today).update(
+            status="expired"
+        )
+        model.objects.filter(status="active", start_date__gt=today).update(
+            status="scheduled"
+        )
+
+
+def revert_offer_status(apps, schema_editor):
+    for name in ("ProductOffer", "CategoryOffer"):
+        model = apps.get_model("offers", name)
+        model.objects.filter(status="scheduled").update(status="active")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("offers", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="categoryoffer",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("active", "Active"),
+                    ("scheduled", "Scheduled"),
+                    ("inactive", "Inactive"),
+                    ("expired", "Expired"),
+                ],
+                default="active",
+                max_length=10,
+            ),
+        ),
+        migrations.AlterField(
+            model_name="productoffer",
+            name="status",
+            field=models.CharField(
+                choices=[
+                    ("active", "Active"),
+                    ("scheduled", "Scheduled"),
+                    ("inactive", "Inactive"),
+                    ("expired", "Expired"),
+                ],
+                default="active",
+                max_length=10,
+            ),
+        ),
+        migrations.RunPython(normalize_offer_status, revert_offer_status),
+    ]
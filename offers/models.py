@@ -21,8 +21,12 @@ class BaseOffer(models.Model):
     start_date = models.DateField()
     end_date = models.DateField()
 
+    # active = running today, scheduled = active but not started yet.
+    # Kept in step with the dates by save() and the offer scheduler
+    # (python manage.py run_offer_scheduler), inactive is only set by admins.
     STATUS_CHOICES = [
         ("active", "Active"),
+        ("scheduled", "Scheduled"),
         ("inactive", "Inactive"),
         ("expired", "Expired"),
     ]
@@ -51,6 +55,24 @@ class BaseOffer(models.Model):
             <= self.end_date  # return ture if today's date is between start_date and end_date else False
         )
 
+    def status_for_date(self, today):
+        """Status this offer should have on the given day (inactive stays inactive)"""
+        if self.status == "inactive":
+            return self.status
+
+        start_date = self._meta.get_field("start_date").to_python(self.start_date)
+        end_date = self._meta.get_field("end_date").to_python(self.end_date)
+        if end_date < today:
+            return "expired"
+        if start_date > today:
+            return "scheduled"
+        return "active"
+
+    def save(self, *args, **kwargs):
+        # admins pick active/inactive, the dates decide between active/scheduled/expired
+        self.status = self.status_for_date(timezone.now().date())
+        super().save(*args, **kwargs)
+
     def __str__(self):
         """
         String representation shown in Django admin.
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete, pre_save
+from django.dispatch import receiver
+
+from .models import CategoryOffer, ProductOffer
+from .utils import invalidate_active_offer_index
+
+
+def _target_field(sender):
+    return "product_id" if sender is ProductOffer else "category_id"
+
+
+@receiver(pre_save, sender=ProductOffer)
+@receiver(pre_save, sender=CategoryOffer)
+def offer_saving(sender, instance, **kwargs):
+    # an edit may move the offer to another product/category, reprice both
+    instance._previous_target_id = None
+    if instance.pk:
+        instance._previous_target_id = (
+            sender.objects.filter(pk=instance.pk)
+            .values_list(_target_field(sender), flat=True)
+            .first()
+        )
+
+
+# once the change is committed every process rebuilds its active offer index
+# on the next lookup, then the stored prices of carts holding the affected
+# products are rewritten
+
+
+@receiver(post_save, sender=ProductOffer)
+@receiver(post_delete, sender=ProductOffer)
+@receiver(post_save, sender=CategoryOffer)
+@receiver(post_delete, sender=CategoryOffer)
+def offer_changed(sender, instance, **kwargs):
+    # bumping before commit would let another worker rebuild from the old rows
+    transaction.on_commit(invalidate_active_offer_index)
+
+    # local import, cart.models imports offers.utils
+    from cart.utils import reprice_carts
+
+    target_ids = {
+        getattr(instance, _target_field(sender)),
+        getattr(instance, "_previous_target_id", None),
+    } - {None}
+    if sender is ProductOffer:
+        transaction.on_commit(lambda: reprice_carts(product_ids=target_ids))
+    else:
+        transaction.on_commit(lambda: reprice_carts(category_ids=target_ids))
@@ -3,6 +3,7 @@ from . import views
 
 urlpatterns = [
     path("dashboard/", views.offer_dashboard, name="offer_dashboard"),
+    path("preview/", views.offer_impact_preview, name="offer_impact_preview"),
     path("category/", views.category_offer_list, name="category_offer_list"),
     path("category/add/", views.add_category_offer, name="add_category_offer"),
     path(
@@ -1,28 +1,109 @@
+import operator
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from datetime import timedelta
 from decimal import Decimal
+from django.db.models import Q
 from django.utils import timezone
+from ecommerce.versions import bump_version, get_version
 from .models import ProductOffer, CategoryOffer
 
 
-def get_best_offer_for_product(product):
-    """Get the best offer (category offer , product offer)"""
+# Per-process index of the offers that apply today. Rebuilt lazily (2
+# queries) when offer save/delete stores a new version in the cache
+# (offers/signals.py) or when the date passes the next start/end of an
+# indexed offer; in between resolving an offer is a dict lookup (the version
+# is re-read every few seconds, see ecommerce/versions.py).
+_INDEX_VERSION_KEY = "active_offer_index:version"
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+class ActiveOfferIndex:
+    """Oldest running "active" offer per product / category id.
+
+    The scheduler keeps status="active" to running offers, the date check
+    here only matters until it catches up (and matches with_effective_price).
+    """
+
+    def __init__(self, product_offers, category_offers, today):
+        self.today = today
+        self.by_product = {}
+        self.by_category = {}
+        boundaries = []
+
+        for offers, key, target in (
+            (product_offers, "product_id", self.by_product),
+            (category_offers, "category_id", self.by_category),
+        ):
+            for offer in offers:  # ordered by created_at, id
+                if offer.start_date > today:
+                    boundaries.append(offer.start_date)
+                elif offer.end_date >= today:
+                    target.setdefault(getattr(offer, key), offer)
+                    boundaries.append(offer.end_date + timedelta(days=1))
+
+        # first day the index may be wrong without any offer being saved
+        self.valid_until = min(boundaries) if boundaries else None
+
+    def is_current(self, today):
+        return today == self.today and (
+            self.valid_until is None or today < self.valid_until
+        )
+
+    def best_offer(self, product_id, category_id):
+        return _choose_best_offer(
+            self.by_product.get(product_id), self.by_category.get(category_id)
+        )
+
+
+def get_active_offer_index():
+    """Current ActiveOfferIndex, rebuilt on version bump or date boundary"""
+    global _index, _index_version
+
+    version = get_version(_INDEX_VERSION_KEY)
+    today = timezone.now().date()
+    if _index is not None and _index_version == version and _index.is_current(today):
+        return _index
 
-    product_offer = ProductOffer.objects.filter(
-        product=product, status="active"
-    ).first()
+    with _index_lock:
+        if _index is None or _index_version != version or not _index.is_current(today):
+            _index = ActiveOfferIndex(
+                ProductOffer.objects.filter(status="active").order_by(
+                    "created_at", "id"
+                ),
+                CategoryOffer.objects.filter(status="active").order_by(
+                    "created_at", "id"
+                ),
+                today,
+            )
+            _index_version = version
+    return _index
 
-    # get active category offer
-    category_offer = None
-    if product.category:
-        category_offer = CategoryOffer.objects.filter(
-            category=product.category, status="active"
-        ).first()
 
-    # check offers are active and not expired
-    if product_offer and not product_offer.is_active:
-        product_offer = None  # Ignore expired offer
+def get_active_offer_version():
+    """changes whenever the active offers do (cache key for offer prices)"""
+    return get_version(_INDEX_VERSION_KEY)
 
-    if category_offer and not category_offer.is_active:
-        category_offer = None
+
+def invalidate_active_offer_index():
+    bump_version(_INDEX_VERSION_KEY)
+
+
+def get_best_offer_for_product(product):
+    """Get the best offer (category offer , product offer), no query"""
+
+    return get_active_offer_index().best_offer(product.id, product.category_id)
+
+
+def _choose_best_offer(product_offer, category_offer):
+    """Pick the larger of a product and category offer (product wins a tie).
+    Both must already be running today (the index only keeps those), either may be None.
+    """
 
     # no offer at all
     if not product_offer and not category_offer:
@@ -58,6 +139,20 @@ def get_best_offer_for_product(product):
         }
 
 
+def get_best_offers_for_products(products):
+    """Bulk version of get_best_offer_for_product.
+
+    Takes a list/queryset of products and returns {product_id: offer_info or None}
+    from the in-memory offer index (no offer queries).
+    """
+
+    index = get_active_offer_index()
+    return {
+        product.id: index.best_offer(product.id, product.category_id)
+        for product in products
+    }
+
+
 def calculate_discounted_price(original_price, discount_percentage):
     """calculate final price after applying percentage discount."""
 
@@ -89,12 +184,52 @@ def apply_offer_to_variant(variant):
 
     product = variant.product
 
-    # get variants original price
-    original_price = variant.price
-
     # check for offers on this product
     offer_info = get_best_offer_for_product(product)
 
+    return _build_variant_pricing(variant.price, offer_info)
+
+
+def apply_offers_to_variants(variants):
+    """Bulk version of apply_offer_to_variant for a whole page/cart of variants.
+
+    Takes a list/queryset of variants and returns {variant_id: pricing} where
+    pricing is the same dict apply_offer_to_variant returns.
+    No offer queries, at most one query for products not loaded with the variants.
+    """
+
+    from products.models import Product
+
+    variants = [variant for variant in variants if variant is not None]
+    if not variants:
+        return {}
+
+    # reuse products already loaded with select_related, fetch the rest in one go
+    products = {}
+    missing_ids = set()
+    for variant in variants:
+        if variant.__class__.product.is_cached(variant):
+            products[variant.product_id] = variant.product
+        else:
+            missing_ids.add(variant.product_id)
+
+    missing_ids -= products.keys()
+    if missing_ids:
+        products.update(Product.objects.in_bulk(missing_ids))
+
+    offers = get_best_offers_for_products(products.values())
+
+    return {
+        variant.id: _build_variant_pricing(
+            variant.price, offers.get(variant.product_id)
+        )
+        for variant in variants
+    }
+
+
+def _build_variant_pricing(original_price, offer_info):
+    """Pricing dict returned by apply_offer_to_variant / apply_offers_to_variants"""
+
     if not offer_info:
         return {
             "original_price": original_price,
@@ -161,20 +296,10 @@ def get_offer_statistics():
 def expired_old_offers():
     """Mark expired offer as expired
 
-    # management/commands/expire_offers.py
-    from django.core.management.base import BaseCommand
-    from offers.utils import expire_old_offers
-
-    class Command(BaseCommand):
-        def handle(self, *args, **options):
-            count = expire_old_offers()
-            print(f"Expired {count} offers")
-
-    Run daily:
-    python manage.py expire_offers
-
-    Or add to crontab:
-    0 0 * * * python manage.py expire_offers
+    Only handles expiry, sync_offer_statuses does every transition and is
+    what the scheduler runs:
+    python manage.py run_offer_scheduler          (once, e.g. from cron)
+    python manage.py run_offer_scheduler --loop   (long running)
 
     Returns:
         int: Number of offers expired
@@ -191,4 +316,231 @@ def expired_old_offers():
         end_date__lt=today, status="active"
     ).update(status="expired")
 
+    # update() sends no signals
+    if category_count or product_count:
+        invalidate_active_offer_index()
+
     return category_count + product_count
+
+
+def sync_offer_statuses(today=None):
+    """Bring stored offer status in line with the dates, in bulk.
+
+    active -> scheduled (not started) / expired (ended), scheduled -> active
+    (started) / expired. Inactive offers are left alone. Stored prices of
+    carts holding products of the changed offers are rewritten.
+    Returns the number of offers changed.
+    """
+
+    today = today or timezone.now().date()
+    now = timezone.now()
+    transitions = [
+        (Q(status__in=["active", "scheduled"], end_date__lt=today), "expired"),
+        (Q(status="active", start_date__gt=today), "scheduled"),
+        (Q(status="scheduled", start_date__lte=today, end_date__gte=today), "active"),
+    ]
+    changed = 0
+    # products / categories of the offers that changed, for the cart reprice
+    targets = {ProductOffer: set(), CategoryOffer: set()}
+
+    for model, target_ids in targets.items():
+        target_field = "product_id" if model is ProductOffer else "category_id"
+        for condition, status in transitions:
+            rows = list(model.objects.filter(condition).values_list("id", target_field))
+            if not rows:
+                continue
+            changed += model.objects.filter(
+                condition, id__in=[offer_id for offer_id, _ in rows]
+            ).update(status=status, updated_at=now)
+            target_ids.update(target_id for _, target_id in rows)
+
+    # update() sends no signals
+    if changed:
+        invalidate_active_offer_index()
+
+        # local import, cart.models imports this module
+        from cart.utils import reprice_carts
+
+        reprice_carts(
+            product_ids=targets[ProductOffer], category_ids=targets[CategoryOffer]
+        )
+
+    return changed
+
+
+def get_offer_transition_dates(today=None):
+    """Upcoming days on which some offer starts or expires, for the scheduler.
+
+    An offer starts on start_date and expires the day after end_date.
+    """
+
+    today = today or timezone.now().date()
+    dates = set()
+
+    for model in (ProductOffer, CategoryOffer):
+        dates.update(
+            model.objects.filter(status="scheduled", start_date__gt=today)
+            .values_list("start_date", flat=True)
+            .distinct()
+        )
+        dates.update(
+            end_date + timedelta(days=1)
+            for end_date in model.objects.filter(
+                status__in=["active", "scheduled"], end_date__gte=today
+            )
+            .values_list("end_date", flat=True)
+            .distinct()
+        )
+
+    return sorted(dates)
+
+
+# ---- offer impact preview (admin, before saving an offer) ----
+
+PREVIEW_TIME_BUDGET = 2.0  # seconds, the summary covers what was scanned by then
+PREVIEW_SALES_DAYS = 30  # "recent sales volume" window
+PREVIEW_CHUNK_SIZE = 5000  # variants per query
+# lower bounds of the selling price distribution buckets
+PREVIEW_PRICE_BUCKETS = [0, 1000, 2500, 5000, 10000]
+
+
+def _discounted(prices, discounts):
+    return array(
+        "d", map(lambda price, discount: price * (100 - discount) / 100, prices, discounts)
+    )
+
+
+def _price_distribution(prices):
+    counts = [0] * len(PREVIEW_PRICE_BUCKETS)
+    for position in map(lambda price: bisect_right(PREVIEW_PRICE_BUCKETS, price) - 1, prices):
+        counts[max(position, 0)] += 1
+    return [
+        {
+            "min": low,
+            "max": PREVIEW_PRICE_BUCKETS[index + 1]
+            if index + 1 < len(PREVIEW_PRICE_BUCKETS)
+            else None,
+            "count": counts[index],
+        }
+        for index, low in enumerate(PREVIEW_PRICE_BUCKETS)
+    ]
+
+
+def preview_offer_impact(
+    offer_type, target_id, discount, offer_id=None, time_budget=PREVIEW_TIME_BUDGET
+):
+    """What saving an offer would do to listed variant prices, without saving it.
+
+    offer_type is "category" or "product", target_id the category / product id,
+    offer_id the offer being edited (None for a new one). Variants are read in
+    chunks into flat arrays (price, current discount, new discount, units sold
+    in the last PREVIEW_SALES_DAYS days) and the summary is computed over the
+    arrays, not per variant like apply_offer_to_variant. Stops reading after
+    time_budget seconds and reports complete=False.
+    """
+    from django.db.models import Sum
+    from orders.models import OrderItem
+    from products.models import Product_varients
+
+    started = time.monotonic()
+    deadline = started + time_budget
+    discount = float(discount)
+    index = get_active_offer_index()
+
+    variants = Product_varients.objects.filter(is_listed=True, product__is_listed=True)
+    if offer_type == "category":
+        variants = variants.filter(product__category_id=target_id)
+    else:
+        variants = variants.filter(product_id=target_id)
+
+    def discounts_for(product_id, category_id):
+        """(current, new) best discount, same rules as ActiveOfferIndex.best_offer"""
+        product_offer = index.by_product.get(product_id)
+        category_offer = index.by_category.get(category_id)
+        product_discount = float(product_offer.discount) if product_offer else 0.0
+        category_discount = float(category_offer.discount) if category_offer else 0.0
+        current = max(product_discount, category_discount)
+
+        # the oldest running offer keeps its slot, the new one only fills an empty slot
+        if offer_type == "product":
+            if product_offer is None or product_offer.id == offer_id:
+                product_discount = discount
+        elif category_offer is None or category_offer.id == offer_id:
+            category_discount = discount
+        return current, max(product_discount, category_discount)
+
+    prices = array("d")
+    current_discounts = array("d")
+    new_discounts = array("d")
+    units_sold = array("d")
+    product_discounts = {}  # product_id -> (current, new)
+    since = timezone.now() - timedelta(days=PREVIEW_SALES_DAYS)
+    complete = True
+    last_id = 0
+
+    while True:
+        if time.monotonic() > deadline:
+            complete = False
+            break
+
+        rows = list(
+            variants.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", "product_id", "product__category_id", "price")[
+                :PREVIEW_CHUNK_SIZE
+            ]
+        )
+        if not rows:
+            break
+        last_id = rows[-1][0]
+
+        sold = dict(
+            OrderItem.objects.filter(
+                variant_id__in=[row[0] for row in rows], created_at__gte=since
+            )
+            .exclude(status__in=["cancelled", "returned"])
+            .values("variant_id")
+            .annotate(units=Sum("quantity"))
+            .values_list("variant_id", "units")
+        )
+
+        for variant_id, product_id, category_id, price in rows:
+            if product_id not in product_discounts:
+                product_discounts[product_id] = discounts_for(product_id, category_id)
+            current, new = product_discounts[product_id]
+            prices.append(float(price))
+            current_discounts.append(current)
+            new_discounts.append(new)
+            units_sold.append(sold.get(variant_id, 0))
+
+        if len(rows) < PREVIEW_CHUNK_SIZE:
+            break
+
+    scanned = len(prices)
+    prices_before = _discounted(prices, current_discounts)
+    prices_after = _discounted(prices, new_discounts)
+    affected = sum(map(operator.ne, current_discounts, new_discounts))
+    revenue_before = sum(map(operator.mul, prices_before, units_sold))
+    revenue_after = sum(map(operator.mul, prices_after, units_sold))
+
+    def average(values):
+        return round(sum(values) / scanned, 2) if scanned else 0
+
+    return {
+        "complete": complete,
+        "variants_scanned": scanned,
+        "variants_affected": affected,
+        "average_discount_before": average(current_discounts),
+        "average_discount_after": average(new_discounts),
+        "average_price_before": average(prices_before),
+        "average_price_after": average(prices_after),
+        "units_sold": int(sum(units_sold)),
+        "sales_days": PREVIEW_SALES_DAYS,
+        # at the same volume, demand change is not modelled
+        "revenue_before": round(revenue_before, 2),
+        "revenue_after": round(revenue_after, 2),
+        "revenue_delta": round(revenue_after - revenue_before, 2),
+        "price_distribution_before": _price_distribution(prices_before),
+        "price_distribution_after": _price_distribution(prices_after),
+        "elapsed_ms": round((time.monotonic() - started) * 1000),
+    }
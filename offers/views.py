@@ -2,13 +2,14 @@ from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.contrib.auth.decorators import login_required
 from django.core.paginator import Paginator
+from django.http import JsonResponse
 from django.db.models import Q
 from datetime import date
 from django.urls import reverse
 from .models import CategoryOffer, ProductOffer
 from category.models import Category
 from products.models import Product
-from .utils import get_offer_statistics
+from .utils import get_offer_statistics, preview_offer_impact
 
 # Create your views here.
 
@@ -441,3 +442,41 @@ def offer_dashboard(request):
     }
 
     return render(request, "offers/dashboard.html", context)
+
+
+@login_required(login_url="admin_login")
+def offer_impact_preview(request):
+    """JSON summary of what an offer would change, used by the add/edit offer forms.
+
+    GET params: offer_type (category/product), target (category/product id),
+    discount and offer_id when editing.
+    """
+
+    if not request.user.is_superuser:
+        return JsonResponse(
+            {"status": "error", "message": "Permission denied."}, status=403
+        )
+
+    offer_type = request.GET.get("offer_type")
+    if offer_type not in ("category", "product"):
+        return JsonResponse(
+            {"status": "error", "message": "Invalid offer type."}, status=400
+        )
+
+    try:
+        target_id = int(request.GET.get("target", ""))
+        discount = float(request.GET.get("discount", ""))
+        if discount <= 0 or discount > 90:
+            raise ValueError
+        offer_id = int(request.GET["offer_id"]) if request.GET.get("offer_id") else None
+    except ValueError:
+        return JsonResponse(
+            {
+                "status": "error",
+                "message": "Select a target and a discount between 0 and 90.",
+            },
+            status=400,
+        )
+
+    summary = preview_offer_impact(offer_type, target_id, discount, offer_id)
+    return JsonResponse({"status": "success", "preview": summary})
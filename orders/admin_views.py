@@ -1,6 +1,7 @@
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib import messages
 from django.core.paginator import Paginator
+from ecommerce.pagination import paginate
 from django.db.models import Q
 from django.http import JsonResponse
 from django.views.decorators.http import require_POST
@@ -11,6 +12,10 @@ from django.views.decorators.csrf import csrf_protect
 from .models import Order, OrderItem, OrderStatusHistory
 from .forms import AdminOrderStatusForm, OrderSearchForm
 from .utils import (
+    BULK_STATUS_CHOICES,
+    CANCELLABLE_STATUSES,
+    bulk_update_order_status,
+    cancel_orders,
     update_order_status,
     search_orders,
     filter_orders,
@@ -62,9 +67,7 @@ def admin_orders_list(request):
         sort_by = form.cleaned_data.get("sort_by") or "-created_at"
         orders = orders.order_by(sort_by)
 
-    paginator = Paginator(orders, 15)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, orders, 15)
 
     stats = get_order_statistics()
 
@@ -72,11 +75,88 @@ def admin_orders_list(request):
         "page_obj": page_obj,
         "form": form,
         "stats": stats,
-        "total_count": orders.count(),
+        "total_count": page_obj.paginator.count,
+        "bulk_status_choices": [
+            (value, label)
+            for value, label in Order.STATUS_CHOICES
+            if value in BULK_STATUS_CHOICES
+        ],
     }
     return render(request, "admin/orders/order_list.html", context)
 
 
+@admin_required
+@require_POST
+def admin_bulk_cancel_orders(request):
+    """Admin: cancel the selected orders, or every open order of a recalled variant"""
+    reason = request.POST.get("reason", "").strip() or "Cancelled by admin"
+
+    variant_id = request.POST.get("variant_id", "")
+    if variant_id.isdigit():
+        # product recall
+        orders = Order.objects.filter(
+            items__variant_id=variant_id, items__status__in=CANCELLABLE_STATUSES
+        ).distinct()
+        back = redirect("admin_inventory")
+    else:
+        orders = [
+            order_id
+            for order_id in request.POST.getlist("order_ids")
+            if order_id.isdigit()
+        ]
+        back = redirect("admin_orders_list")
+        if not orders:
+            messages.error(request, "Select at least one order to cancel.")
+            return back
+
+    cancelled = cancel_orders(orders, reason=reason, cancelled_by=request.user)
+
+    if cancelled:
+        messages.success(
+            request,
+            f"{len(cancelled)} order(s) cancelled, stock restored and refunds credited.",
+        )
+    else:
+        messages.error(request, "No orders that can still be cancelled were found.")
+    return back
+
+
+@admin_required
+@require_POST
+def admin_bulk_update_order_status(request):
+    """Admin: move the selected orders to the next status in one go"""
+    new_status = request.POST.get("status", "")
+    if new_status not in BULK_STATUS_CHOICES:
+        messages.error(request, "Choose a status to move the selected orders to.")
+        return redirect("admin_orders_list")
+
+    order_ids = [
+        order_id for order_id in request.POST.getlist("order_ids") if order_id.isdigit()
+    ]
+    if not order_ids:
+        messages.error(request, "Select at least one order to update.")
+        return redirect("admin_orders_list")
+
+    updated, skipped = bulk_update_order_status(
+        order_ids,
+        new_status,
+        changed_by=request.user,
+        # the reason box of the bulk bar doubles as the history notes
+        notes=request.POST.get("reason", "").strip() or None,
+    )
+
+    status_label = dict(Order.STATUS_CHOICES)[new_status]
+    if updated:
+        messages.success(request, f"{len(updated)} order(s) moved to {status_label}.")
+    if skipped:
+        details = "; ".join(
+            f"#{order.order_id}: {error}" for order, error in skipped[:5]
+        )
+        more = f" (+{len(skipped) - 5} more)" if len(skipped) > 5 else ""
+        messages.warning(request, f"{len(skipped)} order(s) skipped. {details}{more}")
+    return redirect("admin_orders_list")
+
+
 @csrf_protect
 @admin_required
 def admin_order_detail(request, order_id):
@@ -198,9 +278,7 @@ def admin_inventory_management(request):
     else:
         variants = variants.order_by("product__product_name")
 
-    paginator = Paginator(variants, 20)
-    page_number = request.GET.get("page")
-    page_obj = paginator.get_page(page_number)
+    page_obj = paginate(request, variants, 20)
 
     total_variants = Product_varients.objects.filter(
         is_listed=True, product__is_listed=True
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from orders.utils import RECONCILE_CHUNK_SIZE, reconcile_open_orders
+
+
+class Command(BaseCommand):
+    help = (
+        "Bring the status of every open order in line with its item statuses "
+        "(e.g. nightly, or after bulk item changes)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=RECONCILE_CHUNK_SIZE,
+            help="Orders reconciled per transaction",
+        )
+
+    def handle(self, *args, **options):
+        updated = reconcile_open_orders(chunk_size=max(options["chunk_size"], 1))
+        self.stdout.write(self.style.SUCCESS(f"Reconciled {updated} order(s)"))
@@ -0,0 +1,38 @@
+import orders.models
+from django.db import migrations, models
+
+
+def create_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE SEQUENCE IF NOT EXISTS {orders.models.ORDER_NUMBER_SEQUENCE} "
+            "START WITH 2400000000 MAXVALUE 9999999999"
+        )
+
+
+def drop_sequence(apps, schema_editor):
+    if schema_editor.connection.vendor == "postgresql":
+        schema_editor.execute(
+            f"DROP SEQUENCE IF EXISTS {orders.models.ORDER_NUMBER_SEQUENCE}"
+        )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("orders", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_sequence, drop_sequence),
+        migrations.AlterField(
+            model_name="order",
+            name="order_id",
+            field=models.CharField(
+                db_default=orders.models.OrderNumber(),
+                editable=False,
+                max_length=20,
+                unique=True,
+            ),
+        ),
+    ]
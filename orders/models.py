@@ -3,15 +3,46 @@ from django.core.validators import MinValueValidator
 from accounts.models import Account, Address
 from products.models import Product, Product_varients
 from django.utils import timezone
-import uuid
 from decimal import Decimal
 
 
+ORDER_NUMBER_SEQUENCE = "orders_order_number_seq"
+
+
+class OrderNumber(models.Func):
+    """Database default of Order.order_id: TS + date + sequence number.
+
+    On PostgreSQL the number comes from ORDER_NUMBER_SEQUENCE (migration
+    0002), so ids are unique by construction and come back with the INSERT
+    (RETURNING), no SELECT or retry. The sequence starts at 2400000000 so new
+    ids can never match an old TS + timestamp + random one (hour 24).
+    Other databases (SQLite for local runs) fall back to timestamp + random.
+    """
+
+    output_field = models.CharField(max_length=20)
+
+    def as_sql(self, compiler, connection, **extra_context):
+        return (
+            "('TS' || strftime('%%Y%%m%%d%%H%%M%%S', 'now') "
+            "|| substr(abs(random()), 1, 4))",
+            [],
+        )
+
+    def as_postgresql(self, compiler, connection, **extra_context):
+        return (
+            "('TS' || to_char(now(), 'YYYYMMDD') "
+            f"|| lpad(nextval('{ORDER_NUMBER_SEQUENCE}')::text, 10, '0'))",
+            [],
+        )
+
+
 class Order(models.Model):
     """Main order model"""
 
-    # order identification
-    order_id = models.CharField(max_length=20, unique=True, editable=False)
+    # order identification, generated by the database on insert
+    order_id = models.CharField(
+        max_length=20, unique=True, editable=False, db_default=OrderNumber()
+    )
     user = models.ForeignKey(Account, on_delete=models.PROTECT, related_name="orders")
     # shipping info
     shipping_address = models.ForeignKey(
@@ -103,15 +134,6 @@ class Order(models.Model):
             models.Index(fields=["status"]),
         ]
 
-    # order ID generator
-    def save(self, *args, **kwargs):
-        if not self.order_id:
-            # Generate unique order ID: TS + timestamp + random
-            timestamp = timezone.now().strftime("%Y%m%d%H%M%S")
-            random_part = str(uuid.uuid4().int)[:4]
-            self.order_id = f"TS{timestamp}{random_part}"
-        super().save(*args, **kwargs)
-
     def __str__(self):
         return f"Order {self.order_id} - {self.user.email}"
 
@@ -134,11 +156,11 @@ class Order(models.Model):
     @property
     def total_refund_amount(self):
         """Total refunded amount for this order (cancelled + returned items)."""
+        from coupons.utils import calculate_item_refunds
+
         refunded_items = self.items.filter(status__in=["cancelled", "returned"])
-        total = Decimal("0.00")
-        for item in refunded_items:
-            total += item.refund_amount
-        return total
+        # one coupon lookup for all items instead of one per item
+        return sum(calculate_item_refunds(refunded_items).values(), Decimal("0.00"))
 
     @property
     def has_return_request(self):
@@ -174,51 +196,13 @@ class Order(models.Model):
 
     def update_status_based_on_items(self):
         """Update order status based on item statuses"""
-        items = self.items.all()
-        for item in items:
-            item.refresh_from_db()
+        from .utils import reconcile_order_statuses
 
-        if not items.exists():
-            return
-
-        item_statuses = set(items.values_list("status", flat=True))
-
-        # If all items cancelled
-        if item_statuses == {"cancelled"}:
-            self.status = "cancelled"
-
-            # Refund shipping for FULL cancellation
-            if self.shipping_charge > 0:
-                self.shipping_charge = Decimal("0.00")
-
-        # all returned
-        elif item_statuses == {"returned"}:
-            self.status = "returned"
-
-            # FULL RETURN → refund shipping
-            if self.shipping_charge > 0:
-                self.shipping_charge = Decimal("0.00")
-
-        elif item_statuses.issubset({"cancelled", "returned"}):
-            self.status = "returned"
-
-        # If all items delivered
-        elif item_statuses == {"delivered"}:
-            self.status = "delivered"
-            if not self.delivered_at:
-                self.delivered_at = timezone.now()
-
-        # mix of delivered + returned
-        elif item_statuses.issubset({"delivered", "returned"}):
-            self.status = "returned"
-
-        # If mix of delivered and cancelled
-        elif item_statuses.issubset({"delivered", "cancelled"}):
-            self.status = "delivered"
-            if not self.delivered_at:
-                self.delivered_at = timezone.now()
-
-        self.save()
+        # one grouped count over the items, see reconcile_order_statuses
+        if reconcile_order_statuses([self.id]):
+            self.refresh_from_db(
+                fields=["status", "shipping_charge", "delivered_at", "updated_at"]
+            )
 
 
 class OrderItem(models.Model):
@@ -1,3 +1,309 @@
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+
+from accounts.models import Account
+from category.models import Category
+from coupons.models import Coupon, CouponUsage
+from products.models import Product, Product_varients
+from wallet.models import Wallet, WalletTransaction
+from .models import Order, OrderItem, OrderStatusHistory
+from .utils import (
+    InsufficientStock,
+    bulk_update_order_status,
+    cancel_orders,
+    reconcile_open_orders,
+    reconcile_order_statuses,
+    reserve_stock,
+    update_order_status,
+)
+
+
+class OrderTestData:
+    """Catalog, customer and order builders shared by the order tests"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = Account.objects.create_user(
+            first_name="Test", last_name="User", email="user@example.com", password="pw"
+        )
+        category = Category.objects.create(category_name="Watches", slug="watches")
+        cls.product = Product.objects.create(
+            product_name="Diver",
+            slug="diver",
+            base_price=Decimal("1000"),
+            description="Steel diver",
+            category=category,
+        )
+        cls.variants = [
+            Product_varients.objects.create(
+                product=cls.product, colour=colour, price=Decimal("1000"), stock=5
+            )
+            for colour, _ in Product_varients.COLOUR_CHOICES[:3]
+        ]
+
+    def stock(self, variant):
+        return Product_varients.objects.get(pk=variant.pk).stock
+
+    def make_order(self, lines, status="pending", user=None, **fields):
+        """Order with one item per (variant, quantity[, item status]) line"""
+        order = Order.objects.create(
+            user=user or self.user,
+            full_name="Test User",
+            mobile="9999999999",
+            street_address="1 Main Road",
+            city="Kochi",
+            state="Kerala",
+            postal_code="682001",
+            subtotal=Decimal("0.00"),
+            total_amount=Decimal("0.00"),
+            status=status,
+            **fields,
+        )
+        for variant, quantity, *item_status in lines:
+            OrderItem.objects.create(
+                order=order,
+                product=variant.product,
+                variant=variant,
+                product_name=variant.product.product_name,
+                variant_colour=variant.colour,
+                price=Decimal("100.00"),
+                original_price=Decimal("100.00"),
+                quantity=quantity,
+                status=item_status[0] if item_status else status,
+            )
+        return order
+
+    def order_items(self, lines):
+        """unsaved OrderItems, as order placement builds them"""
+        return [
+            OrderItem(variant=variant, product=variant.product, quantity=quantity)
+            for variant, quantity in lines
+        ]
+
+
+class ReserveStockTests(OrderTestData, TestCase):
+    def test_takes_stock_for_every_line(self):
+        first, second, _ = self.variants
+        with transaction.atomic():
+            reserve_stock(self.order_items([(first, 2), (second, 5)]))
+
+        self.assertEqual(self.stock(first), 3)
+        self.assertEqual(self.stock(second), 0)
+
+    def test_quantities_of_the_same_variant_are_added_up(self):
+        first = self.variants[0]
+        with self.assertRaises(InsufficientStock):
+            with transaction.atomic():
+                reserve_stock(self.order_items([(first, 3), (first, 3)]))
+
+        self.assertEqual(self.stock(first), 5)
+
+    def test_short_line_leaves_every_row_untouched(self):
+        first, second, third = self.variants
+        items = self.order_items([(first, 1), (second, 6), (third, 2)])
+
+        with self.assertRaises(InsufficientStock) as raised:
+            with transaction.atomic():
+                reserve_stock(items)
+
+        # only the short line is reported, with the stock that is left
+        [(variant, quantity)] = raised.exception.shortages
+        self.assertEqual((variant.id, variant.stock, quantity), (second.id, 5, 6))
+        self.assertIn("Only 5 left", raised.exception.messages[0])
+        # the lines taken before the short one are rolled back too
+        self.assertEqual([self.stock(v) for v in self.variants], [5, 5, 5])
+
+
+class CancelOrdersTests(OrderTestData, TestCase):
+    def balance(self, user):
+        return Wallet.objects.get(user=user).balance
+
+    def test_restocks_every_variant_once_per_item(self):
+        first, second, _ = self.variants
+        orders = [
+            self.make_order([(first, 1), (second, 2)]),
+            self.make_order([(first, 3)], status="confirmed"),
+        ]
+
+        cancelled = cancel_orders(orders, reason="Product recall")
+
+        self.assertEqual(len(cancelled), 2)
+        self.assertEqual([self.stock(first), self.stock(second)], [9, 7])
+        self.assertFalse(OrderItem.objects.exclude(status="cancelled").exists())
+        self.assertEqual(
+            OrderStatusHistory.objects.filter(new_status="cancelled").count(), 2
+        )
+
+    def test_refunds_each_customer_the_total_of_their_orders(self):
+        other = Account.objects.create_user(
+            first_name="Other", last_name="User", email="other@example.com"
+        )
+        first, second, _ = self.variants
+        orders = [
+            self.make_order([(first, 1), (second, 2)]),
+            self.make_order([(second, 1)]),
+            self.make_order([(first, 2)], user=other),
+        ]
+
+        cancel_orders(orders, reason="Product recall")
+
+        self.assertEqual(self.balance(self.user), Decimal("400.00"))
+        self.assertEqual(self.balance(other), Decimal("200.00"))
+        self.assertEqual(WalletTransaction.objects.count(), 3)
+        self.assertEqual(
+            set(Order.objects.values_list("status", "payment_status")),
+            {("cancelled", "refunded")},
+        )
+
+    def test_coupon_share_is_kept_out_of_the_refund(self):
+        order = self.make_order([(self.variants[0], 1), (self.variants[1], 2)])
+        today = timezone.now().date()
+        coupon = Coupon.objects.create(
+            code="SAVE30",
+            discount_amount=Decimal("30.00"),
+            start_date=today,
+            end_date=today + timedelta(days=7),
+        )
+        CouponUsage.objects.create(
+            coupon=coupon,
+            user=self.user,
+            order=order,
+            discount_amount=Decimal("30.00"),
+            cart_total_before_discount=Decimal("300.00"),
+        )
+
+        cancel_orders([order])
+
+        self.assertEqual(self.balance(self.user), Decimal("270.00"))
+
+    def test_items_cancelled_earlier_are_not_restocked_or_refunded_again(self):
+        first, second, _ = self.variants
+        order = self.make_order([(first, 1), (second, 2, "cancelled")])
+
+        cancel_orders([order])
+
+        self.assertEqual([self.stock(first), self.stock(second)], [6, 5])
+        self.assertEqual(self.balance(self.user), Decimal("100.00"))
+
+    def test_orders_past_processing_are_skipped(self):
+        shipped = self.make_order([(self.variants[0], 1)], status="shipped")
+
+        self.assertEqual(cancel_orders(Order.objects.all()), [])
+
+        shipped.refresh_from_db()
+        self.assertEqual(shipped.status, "shipped")
+        self.assertEqual(self.stock(self.variants[0]), 5)
+        self.assertFalse(WalletTransaction.objects.exists())
+
+
+class ReconcileOrderStatusesTests(OrderTestData, TestCase):
+    def make_shipped_order(self, *item_statuses):
+        return self.make_order(
+            [(self.variants[0], 1, status) for status in item_statuses],
+            status="shipped",
+            shipping_charge=Decimal("50.00"),
+        )
+
+    def test_status_follows_the_items(self):
+        cancelled = self.make_shipped_order("cancelled", "cancelled")
+        delivered = self.make_shipped_order("delivered", "cancelled")
+        returned = self.make_shipped_order("delivered", "returned")
+        in_progress = self.make_shipped_order("delivered", "shipped")
+
+        changed = reconcile_order_statuses(Order.objects.all())
+
+        self.assertEqual(
+            changed,
+            {
+                cancelled.id: "cancelled",
+                delivered.id: "delivered",
+                returned.id: "returned",
+            },
+        )
+        orders = Order.objects.in_bulk()
+        # a full cancellation refunds the shipping too
+        self.assertEqual(orders[cancelled.id].shipping_charge, Decimal("0.00"))
+        self.assertEqual(orders[delivered.id].shipping_charge, Decimal("50.00"))
+        self.assertIsNotNone(orders[delivered.id].delivered_at)
+        self.assertEqual(orders[in_progress.id].status, "shipped")
+
+    def test_orders_already_matching_are_not_rewritten(self):
+        order = self.make_shipped_order("delivered")
+        reconcile_order_statuses([order])
+        first_run = Order.objects.get(pk=order.pk)
+
+        self.assertEqual(reconcile_order_statuses([order]), {})
+        second_run = Order.objects.get(pk=order.pk)
+        self.assertEqual(second_run.updated_at, first_run.updated_at)
+        self.assertEqual(second_run.delivered_at, first_run.delivered_at)
+
+    def test_open_orders_are_reconciled_in_chunks(self):
+        for _ in range(3):
+            self.make_shipped_order("delivered")
+        self.make_shipped_order("shipped")
+        self.make_order([(self.variants[0], 1, "delivered")], status="cancelled")
+
+        self.assertEqual(reconcile_open_orders(chunk_size=2), 3)
+        self.assertEqual(reconcile_open_orders(chunk_size=2), 0)
+        self.assertEqual(Order.objects.filter(status="cancelled").count(), 1)
+
+
+class BulkUpdateOrderStatusTests(OrderTestData, TestCase):
+    def test_valid_transitions_move_and_others_are_skipped(self):
+        first, second, _ = self.variants
+        moving = self.make_order([(first, 1), (second, 1, "cancelled")], "processing")
+        already = self.make_order([(first, 1)], status="shipped")
+        too_early = self.make_order([(first, 1)], status="pending")
+
+        updated, skipped = bulk_update_order_status(
+            Order.objects.all(), "shipped", notes="Courier pickup"
+        )
+
+        self.assertEqual([order.id for order in updated], [moving.id])
+        skipped = {order.id: message for order, message in skipped}
+        self.assertEqual(skipped[already.id], "Order is already shipped.")
+        self.assertIn("Cannot change status from 'pending'", skipped[too_early.id])
+        self.assertEqual(
+            dict(moving.items.values_list("variant", "status")),
+            {first.id: "shipped", second.id: "cancelled"},
+        )
+        self.assertEqual(Order.objects.get(pk=too_early.pk).status, "pending")
+        [history] = OrderStatusHistory.objects.all()
+        self.assertEqual(
+            (history.order_id, history.old_status, history.new_status, history.notes),
+            (moving.id, "processing", "shipped", "Courier pickup"),
+        )
+
+    def test_delivery_completes_the_payment(self):
+        order = self.make_order([(self.variants[0], 1)], status="out_for_delivery")
+
+        bulk_update_order_status([order], "delivered")
+
+        order.refresh_from_db()
+        self.assertEqual(order.payment_status, "completed")
+        self.assertIsNotNone(order.delivered_at)
+        self.assertIsNotNone(order.items.get().delivered_at)
+
+    def test_earlier_steps_keep_the_payment_status(self):
+        paid = self.make_order([(self.variants[0], 1)], payment_status="completed")
+        cod = self.make_order([(self.variants[1], 1)])
+
+        bulk_update_order_status([paid, cod], "confirmed")
+
+        self.assertEqual(
+            dict(Order.objects.values_list("id", "payment_status")),
+            {paid.id: "completed", cod.id: "pending"},
+        )
+
+    def test_single_update_follows_the_same_payment_rule(self):
+        paid = self.make_order([(self.variants[0], 1)], payment_status="completed")
+
+        success, _ = update_order_status(paid, "confirmed")
 
-# Create your tests here.
+        self.assertTrue(success)
+        paid.refresh_from_db()
+        self.assertEqual((paid.status, paid.payment_status), ("confirmed", "completed"))
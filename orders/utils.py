@@ -1,9 +1,404 @@
-from decimal import Decimal
-from django.db.models import Q
+from decimal import Decimal, InvalidOperation
+from typing import NamedTuple
+from django.core import signing
+from django.db import transaction
+from django.db import models
+from django.db.models import Case, Count, F, IntegerField, Q, Value, When
+from django.db.models.functions import Coalesce
 from .models import Order, OrderItem, OrderStatusHistory
 from django.utils import timezone
-from wallet.utils import credit_wallet
+from wallet.utils import credit_wallets
 from coupons.models import CouponUsage
+from coupons.utils import calculate_item_refunds
+from cart.utils import (
+    CartPricer,
+    get_cart_quote,
+    get_or_create_cart,
+    set_cart_item_count,
+)
+from offers.utils import apply_offer_to_variant, get_active_offer_version
+from products.models import Product_varients
+
+
+class InsufficientStock(Exception):
+    """Raised by reserve_stock, rolls back the order transaction.
+    shortages: [(variant, requested quantity)], variant.stock is the stock left.
+    """
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        super().__init__("; ".join(self.messages))
+
+    @property
+    def messages(self):
+        return [
+            f"Only {variant.stock} left of {variant.product.product_name} "
+            f"({variant.colour}), you asked for {quantity}."
+            for variant, quantity in self.shortages
+        ]
+
+
+def _refresh_summaries_on_commit(variant_ids):
+    # .update() skips the variant signals, refresh in_stock once committed
+    from products.utils import refresh_product_summaries
+
+    def refresh():
+        refresh_product_summaries(
+            set(
+                Product_varients.objects.filter(id__in=variant_ids).values_list(
+                    "product_id", flat=True
+                )
+            )
+        )
+
+    transaction.on_commit(refresh)
+
+
+def stock_quantities(items):
+    """{variant_id: total quantity} of items"""
+    quantities = {}
+    for item in items:
+        quantities[item.variant_id] = quantities.get(item.variant_id, 0) + item.quantity
+    return quantities
+
+
+def reserve_stock(items):
+    """Take stock for order items (anything with variant_id and quantity).
+
+    One conditional UPDATE ... SET stock = stock - qty WHERE stock >= qty per
+    variant, so the database decides and concurrent checkouts cannot oversell.
+    Variants go in id order, two checkouts lock shared rows in the same order.
+    Call inside transaction.atomic(); raises InsufficientStock with every
+    line that was short.
+    """
+    quantities = stock_quantities(items)
+
+    short = []
+    for variant_id in sorted(quantities):
+        quantity = quantities[variant_id]
+        updated = Product_varients.objects.filter(
+            id=variant_id, stock__gte=quantity
+        ).update(stock=F("stock") - quantity)
+        if not updated:
+            short.append(variant_id)
+
+    if short:
+        variants = Product_varients.objects.filter(id__in=short).select_related(
+            "product"
+        )
+        raise InsufficientStock(
+            [(variant, quantities[variant.id]) for variant in variants]
+        )
+
+    _refresh_summaries_on_commit(list(quantities))
+
+
+def release_stock(items):
+    """Give back stock taken by reserve_stock (same item shape).
+    One UPDATE ... SET stock = stock + CASE id WHEN ... for all variants.
+    """
+    quantities = stock_quantities(items)
+    if not quantities:
+        return
+
+    Product_varients.objects.filter(id__in=quantities).update(
+        stock=F("stock")
+        + Case(
+            *[
+                When(id=variant_id, then=Value(quantity))
+                for variant_id, quantity in sorted(quantities.items())
+            ],
+            default=Value(0),
+            output_field=IntegerField(),
+        )
+    )
+    _refresh_summaries_on_commit(list(quantities))
+
+
+def create_order_items(order, items):
+    """Insert unsaved OrderItems for the order with one query.
+    Their stock must already be taken with reserve_stock.
+    """
+    for item in items:
+        item.order = order
+    return OrderItem.objects.bulk_create(items)
+
+
+# ---- checkout quote ----
+
+# One priced snapshot of the checkout (cart or buy now) shared by the
+# checkout page, COD / wallet placement and the Razorpay views. Signed and
+# kept in the session for CHECKOUT_QUOTE_MAX_AGE seconds; rebuilt earlier
+# when the cart version, the active offers, the coupon or the day change.
+CHECKOUT_QUOTE_SESSION_KEY = "checkout_quote"
+CHECKOUT_QUOTE_SALT = "orders.checkout_quote"
+CHECKOUT_QUOTE_MAX_AGE = 300
+FREE_SHIPPING_THRESHOLD = Decimal("2000")
+SHIPPING_CHARGE = Decimal("50.00")
+COD_LIMIT = Decimal("1000")
+
+
+class CheckoutLine(NamedTuple):
+    """One line of a CheckoutQuote, prices per item"""
+
+    product_id: int
+    variant_id: int
+    product_name: str
+    variant_colour: str
+    quantity: int
+    price: Decimal  # after offer
+    original_price: Decimal
+    discount_amount: Decimal
+
+    @property
+    def total(self):
+        return self.price * self.quantity
+
+
+class CheckoutQuote(NamedTuple):
+    """Totals of a checkout, from get_checkout_quote. Read only."""
+
+    mode: str  # "cart" / "buy_now"
+    fingerprint: str
+    lines: tuple
+    coupon_id: object
+    coupon_discount: Decimal
+
+    @property
+    def subtotal(self):
+        return sum((line.total for line in self.lines), Decimal("0.00"))
+
+    @property
+    def mrp_total(self):
+        return sum(
+            (line.original_price * line.quantity for line in self.lines),
+            Decimal("0.00"),
+        )
+
+    @property
+    def discount_amount(self):
+        """offer discount"""
+        return sum(
+            (line.discount_amount * line.quantity for line in self.lines),
+            Decimal("0.00"),
+        )
+
+    @property
+    def shipping_charge(self):
+        if self.subtotal >= FREE_SHIPPING_THRESHOLD:
+            return Decimal("0.00")
+        return SHIPPING_CHARGE
+
+    @property
+    def total_amount(self):
+        total = self.subtotal - self.coupon_discount + self.shipping_charge
+        return total.quantize(Decimal("0.01"))
+
+    @property
+    def cod_allowed(self):
+        return self.total_amount <= COD_LIMIT
+
+    def wallet_split(self, balance):
+        """(wallet_used, online_amount) when the wallet pays first"""
+        wallet_used = min(max(Decimal(balance), Decimal("0.00")), self.total_amount)
+        return wallet_used, self.total_amount - wallet_used
+
+    def order_items(self):
+        """Unsaved OrderItems for the lines"""
+        return [
+            OrderItem(
+                product_id=line.product_id,
+                variant_id=line.variant_id,
+                product_name=line.product_name,
+                variant_colour=line.variant_colour,
+                price=line.price,
+                original_price=line.original_price,
+                discount_amount=line.discount_amount,
+                quantity=line.quantity,
+                status="pending",
+            )
+            for line in self.lines
+        ]
+
+    def dumps(self):
+        return signing.dumps(
+            [
+                self.mode,
+                self.fingerprint,
+                [
+                    [
+                        line.product_id,
+                        line.variant_id,
+                        line.product_name,
+                        line.variant_colour,
+                        line.quantity,
+                        str(line.price),
+                        str(line.original_price),
+                        str(line.discount_amount),
+                    ]
+                    for line in self.lines
+                ],
+                self.coupon_id,
+                str(self.coupon_discount),
+            ],
+            salt=CHECKOUT_QUOTE_SALT,
+            compress=True,
+        )
+
+    @classmethod
+    def loads(cls, data, max_age=CHECKOUT_QUOTE_MAX_AGE):
+        """CheckoutQuote from dumps(), None if tampered with or expired"""
+        try:
+            mode, fingerprint, lines, coupon_id, coupon_discount = signing.loads(
+                data, salt=CHECKOUT_QUOTE_SALT, max_age=max_age
+            )
+            return cls(
+                mode,
+                fingerprint,
+                tuple(
+                    CheckoutLine(
+                        product_id,
+                        variant_id,
+                        name,
+                        colour,
+                        int(quantity),
+                        Decimal(price),
+                        Decimal(original_price),
+                        Decimal(discount),
+                    )
+                    for (
+                        product_id,
+                        variant_id,
+                        name,
+                        colour,
+                        quantity,
+                        price,
+                        original_price,
+                        discount,
+                    ) in lines
+                ),
+                coupon_id,
+                Decimal(coupon_discount),
+            )
+        except (signing.BadSignature, TypeError, ValueError, InvalidOperation):
+            return None
+
+
+def _checkout_fingerprint(request):
+    """what a checkout quote depends on besides time"""
+    buy_now_item = request.session.get("buy_now")
+    if buy_now_item:
+        basis = f"buy_now:{buy_now_item['variant_id']}:{buy_now_item['quantity']}"
+    else:
+        cart = get_or_create_cart(request.user)
+        basis = f"cart:{cart.id}:{cart.version}"
+
+    return "|".join(
+        [
+            basis,
+            get_active_offer_version(),
+            timezone.now().date().isoformat(),
+            str(request.session.get("applied_coupon_id") or ""),
+            str(request.session.get("coupon_discount") or ""),
+        ]
+    )
+
+
+def build_checkout_quote(request, fingerprint=None):
+    """Price the checkout now. Returns (CheckoutQuote or None, errors)"""
+    fingerprint = fingerprint or _checkout_fingerprint(request)
+
+    coupon_id = request.session.get("applied_coupon_id")
+    coupon_discount = Decimal(
+        request.session.get("coupon_discount", "0.00") if coupon_id else "0.00"
+    )
+
+    buy_now_item = request.session.get("buy_now")
+    if buy_now_item:
+        variant = (
+            Product_varients.objects.select_related("product__category")
+            .filter(id=buy_now_item["variant_id"])
+            .first()
+        )
+        if (
+            variant is None
+            or not variant.is_listed
+            or not variant.product.is_listed
+            or (variant.product.category and not variant.product.category.is_listed)
+        ):
+            return None, ["This product is no longer available."]
+
+        # same offer pricing as the cart
+        pricing = apply_offer_to_variant(variant)
+        lines = (
+            CheckoutLine(
+                variant.product_id,
+                variant.id,
+                variant.product.product_name,
+                variant.colour,
+                int(buy_now_item["quantity"]),
+                Decimal(str(pricing["final_price"])),
+                Decimal(str(pricing["original_price"])),
+                Decimal(str(pricing["discount_amount"])),
+            ),
+        )
+        mode = "buy_now"
+    else:
+        cart_quote = get_cart_quote(request)
+        if not cart_quote.is_valid:
+            return None, list(cart_quote.errors)
+
+        lines = tuple(
+            CheckoutLine(
+                line.item.product_id,
+                line.item.variant_id,
+                line.item.product.product_name,
+                line.item.variant.colour,
+                line.quantity,
+                line.final_price,
+                line.original_price,
+                line.discount_amount,
+            )
+            for line in cart_quote.lines
+        )
+        mode = "cart"
+
+    return CheckoutQuote(mode, fingerprint, lines, coupon_id, coupon_discount), []
+
+
+def get_checkout_quote(request, refresh=False):
+    """(CheckoutQuote or None, errors) from the session, rebuilt when stale"""
+    fingerprint = _checkout_fingerprint(request)
+
+    if not refresh:
+        stored = request.session.get(CHECKOUT_QUOTE_SESSION_KEY)
+        quote = CheckoutQuote.loads(stored) if stored else None
+        if quote is not None and quote.fingerprint == fingerprint:
+            return quote, []
+
+    quote, errors = build_checkout_quote(request, fingerprint)
+    if quote is None:
+        request.session.pop(CHECKOUT_QUOTE_SESSION_KEY, None)
+    else:
+        request.session[CHECKOUT_QUOTE_SESSION_KEY] = quote.dumps()
+    return quote, errors
+
+
+def unavailable_checkout_lines(quote):
+    """names of lines unlisted since the quote was made, one query"""
+    listed = set(
+        Product_varients.objects.filter(
+            Q(product__category__isnull=True) | Q(product__category__is_listed=True),
+            id__in=[line.variant_id for line in quote.lines],
+            is_listed=True,
+            product__is_listed=True,
+        ).values_list("id", flat=True)
+    )
+    return [
+        f"{line.product_name} is no longer available."
+        for line in quote.lines
+        if line.variant_id not in listed
+    ]
 
 
 def create_order_form_cart(user, cart, shipping_address, payment_method):
@@ -11,74 +406,69 @@ def create_order_form_cart(user, cart, shipping_address, payment_method):
     Returns: (order, error_message)
     """
     try:
+        items = list(cart.items.select_related("product__category", "variant"))
+
         # validate cart
-        if not cart.items.exists():
+        if not items:
             return None, "Cart is empty"
 
         # restrict cod above 10,000
         if payment_method == "cod":
-            payable_amount = cart.get_total_amount()
+            payable_amount = CartPricer(cart).quote().subtotal
 
             if payable_amount > Decimal("1000"):
                 return None, "Cash on Delivery is not available for orders above ₹1,000"
 
-        # create order
-        order = Order.objects.create(
-            user=user,
-            shipping_address=shipping_address,
-            full_name=shipping_address.full_name,
-            mobile=shipping_address.mobile,
-            street_address=shipping_address.street_address,
-            city=shipping_address.city,
-            state=shipping_address.state,
-            postal_code=shipping_address.postal_code,
-            payment_method=payment_method,
-            subtotal=Decimal("0.00"),
-            total_amount=Decimal("0.00"),
-        )
-
-        # Create order items from cart
-        for cart_item in cart.items.all():
-            # Double check availability
+        # Double check availability
+        for cart_item in items:
             if not cart_item.is_product_available():
-                order.delete()
                 return None, f"{cart_item.product.product_name} is no longer available"
 
-            # Check stock
-            if cart_item.quantity > cart_item.variant.stock:
-                order.delete()
-                return None, f"Insufficient stock for {cart_item.product.product_name}"
-
-            # Calculate pricing
-            original_price = cart_item.variant.price
-            current_price = cart_item.price
-            discount = original_price - current_price
-
-            # Create order Item
-            order_item = OrderItem.objects.create(
-                order=order,
+        order_items = [
+            OrderItem(
                 product=cart_item.product,
                 variant=cart_item.variant,
                 product_name=cart_item.product.product_name,
                 variant_colour=cart_item.variant.colour,
-                price=current_price,
-                original_price=original_price,
-                discount_amount=discount,
+                price=cart_item.price,
+                original_price=cart_item.variant.price,
+                discount_amount=cart_item.variant.price - cart_item.price,
                 quantity=cart_item.quantity,
                 status="pending",
             )
+            for cart_item in items
+        ]
+
+        with transaction.atomic():
+            # stock checked and taken by the database
+            reserve_stock(order_items)
+
+            # create order
+            order = Order.objects.create(
+                user=user,
+                shipping_address=shipping_address,
+                full_name=shipping_address.full_name,
+                mobile=shipping_address.mobile,
+                street_address=shipping_address.street_address,
+                city=shipping_address.city,
+                state=shipping_address.state,
+                postal_code=shipping_address.postal_code,
+                payment_method=payment_method,
+                subtotal=Decimal("0.00"),
+                shipping_charge=Decimal("0.00"),
+                total_amount=Decimal("0.00"),
+            )
 
-            # Reduce stock
-            cart_item.variant.stock -= cart_item.quantity
-            cart_item.variant.save()
+            create_order_items(order, order_items)
 
-        # calculate totals
-        order.calculate_totals()
+            # calculate totals
+            order.calculate_totals()
 
-        # Clear cart
-        cart.items.all().delete()
-        cart.total = Decimal("0.00")
-        cart.save()
+            # Clear cart
+            cart.items.all().delete()
+            cart.total = Decimal("0.00")
+            cart.save()
+        set_cart_item_count(cart.user_id, 0)
 
         return order, None
 
@@ -86,64 +476,228 @@ def create_order_form_cart(user, cart, shipping_address, payment_method):
         return None, str(e)
 
 
+CANCELLABLE_STATUSES = ["pending", "confirmed", "processing"]
+
+
+def cancel_orders(orders, reason=None, cancelled_by=None):
+    """Cancel many orders (e.g. a product recall), restock and refund them.
+
+    orders: Order queryset, instances or ids. Orders that can no longer be
+    cancelled are skipped. A fixed number of queries whatever the count:
+    one UPDATE restocks every variant, one marks the items, two mark the
+    orders, then one refund calculation and bulk inserts for history and
+    wallet credits. Returns the cancelled orders.
+    """
+    if isinstance(orders, models.QuerySet):
+        order_ids = orders.values("id")
+    else:
+        order_ids = [getattr(order, "id", order) for order in orders]
+
+    with transaction.atomic():
+        cancelled = list(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids, status__in=CANCELLABLE_STATUSES)
+            .order_by("id")
+        )
+        if not cancelled:
+            return []
+        cancelled_ids = [order.id for order in cancelled]
+
+        items = list(
+            OrderItem.objects.filter(
+                order_id__in=cancelled_ids, status__in=CANCELLABLE_STATUSES
+            ).only("id", "order_id", "variant_id", "quantity", "price")
+        )
+        release_stock(items)
+
+        now = timezone.now()
+        OrderItem.objects.filter(id__in=[item.id for item in items]).update(
+            status="cancelled",
+            cancellation_reason=reason,
+            cancelled_at=now,
+            updated_at=now,
+        )
+
+        # only the items cancelled now, ones cancelled earlier were refunded then
+        item_refunds = calculate_item_refunds(items)
+        refunds = {}
+        for item in items:
+            refunds[item.order_id] = refunds.get(item.order_id, Decimal("0.00")) + (
+                item_refunds[item.id]
+            )
+
+        refunded_ids = [
+            order_id for order_id in cancelled_ids if refunds.get(order_id, 0) > 0
+        ]
+        fields = {
+            "status": "cancelled",
+            "cancellation_reason": reason,
+            "cancelled_by": cancelled_by,
+            "cancelled_at": now,
+            "updated_at": now,
+        }
+        Order.objects.filter(id__in=refunded_ids).update(
+            payment_status="refunded", **fields
+        )
+        Order.objects.filter(id__in=cancelled_ids).exclude(id__in=refunded_ids).update(
+            payment_status="pending", **fields
+        )
+
+        history = []
+        credits = []
+        for order in cancelled:
+            history.append(
+                OrderStatusHistory(
+                    order=order,
+                    old_status=order.status,
+                    new_status="cancelled",
+                    changed_by=cancelled_by,
+                    notes=reason,
+                )
+            )
+            if order.id in refunded_ids:
+                credits.append(
+                    {
+                        "user_id": order.user_id,
+                        "amount": refunds[order.id],
+                        "description": f"Refund for cancelled order {order.order_id}",
+                        "order": order,
+                    }
+                )
+            # keep the instances in step with the rows
+            for field, value in fields.items():
+                setattr(order, field, value)
+            order.payment_status = "refunded" if order.id in refunded_ids else "pending"
+
+        OrderStatusHistory.objects.bulk_create(history)
+        credit_wallets(credits)
+
+    return cancelled
+
+
 def cancel_order(order, reason=None, cancelled_by=None):
     """
     Cancel entire order and restore stock
     Returns: (success, message)
     """
-    if not order.can_be_cancelled:
+    if not order.can_be_cancelled or not cancel_orders(
+        [order], reason=reason, cancelled_by=cancelled_by
+    ):
         return False, "This order cannot be cancelled"
 
-    # refund_amount = order.total_refund_amount # property that already written in Orde model
+    order.refresh_from_db()
+    return True, "Order cancelled successfully"
 
-    # cancel all items
-    for item in order.items.all():
-        if item.can_be_cancelled:
-            # Restore stock
-            item.variant.stock += item.quantity
-            item.variant.save()
 
-            item.status = "cancelled"
-            item.cancellation_reason = reason
-            item.cancelled_at = timezone.now()
-            item.save()
+# ---- order status from item statuses ----
 
-    refund_amount = order.total_refund_amount
+RECONCILE_CHUNK_SIZE = 1000
 
-    # Upadate order
-    old_status = order.status
-    order.status = "cancelled"
-    order.cancellation_reason = reason
-    order.cancelled_by = cancelled_by
-    order.cancelled_at = timezone.now()
-    if refund_amount > 0:
-        order.payment_status = "refunded"
-    else:
-        order.payment_status = "pending"
 
-    order.save()
+def order_item_status_counts(order_ids):
+    """{order_id: {"total", "cancelled", "returned", "delivered"}} item counts.
+    One GROUP BY query for any number of orders.
+    """
+    rows = (
+        OrderItem.objects.filter(order_id__in=order_ids)
+        .values("order_id")
+        .annotate(
+            total=Count("id"),
+            cancelled=Count("id", filter=Q(status="cancelled")),
+            returned=Count("id", filter=Q(status="returned")),
+            delivered=Count("id", filter=Q(status="delivered")),
+        )
+        .order_by()
+    )
+    return {row.pop("order_id"): row for row in rows}
 
-    # Record status change
-    OrderStatusHistory.objects.create(
-        order=order,
-        old_status=old_status,
-        new_status="cancelled",
-        changed_by=cancelled_by,
-        notes=reason,
+
+def status_from_item_counts(counts):
+    """(order status, free shipping) the item counts add up to.
+    Status is None when the items are still in progress.
+    """
+    total = counts["total"]
+    cancelled, returned, delivered = (
+        counts["cancelled"],
+        counts["returned"],
+        counts["delivered"],
     )
 
-    # if the whole order is cancelled, refund everything
-    if refund_amount > 0:
-        description = f"Refund for cancelled order {order.order_id}"
-        credit_wallet(
-            user=order.user,
-            amount=refund_amount,
-            tx_type="credit",
-            description=description,
-            order=order,
+    # full cancellation or return refunds the shipping too
+    if cancelled == total:
+        return "cancelled", True
+    if returned == total:
+        return "returned", True
+    if cancelled + returned == total:
+        return "returned", False
+    if delivered == total:
+        return "delivered", False
+    # mix of delivered + returned
+    if delivered + returned == total:
+        return "returned", False
+    # mix of delivered + cancelled
+    if delivered + cancelled == total:
+        return "delivered", False
+    return None, False
+
+
+def reconcile_order_statuses(orders):
+    """Set order status from item statuses for many orders at once.
+
+    orders: Order queryset, instances or ids. One aggregate query over the
+    items, then one UPDATE per (status, free shipping) group, so thousands
+    of orders cost a handful of queries. Orders already matching their items
+    are left alone. Returns {order_id: status} for the orders that changed.
+    """
+    if isinstance(orders, models.QuerySet):
+        order_ids = list(orders.values_list("id", flat=True))
+    else:
+        order_ids = [getattr(order, "id", order) for order in orders]
+
+    groups = {}
+    for order_id, counts in order_item_status_counts(order_ids).items():
+        status, free_shipping = status_from_item_counts(counts)
+        if status:
+            groups.setdefault((status, free_shipping), []).append(order_id)
+
+    now = timezone.now()
+    reconciled = {}
+    for (status, free_shipping), ids in groups.items():
+        fields = {"status": status, "updated_at": now}
+        stale = ~Q(status=status)
+        if free_shipping:
+            fields["shipping_charge"] = Decimal("0.00")
+            stale |= ~Q(shipping_charge=0)
+        if status == "delivered":
+            fields["delivered_at"] = Coalesce("delivered_at", Value(now))
+            stale |= Q(delivered_at__isnull=True)
+        changed = list(
+            Order.objects.filter(stale, id__in=ids).values_list("id", flat=True)
         )
+        if changed:
+            Order.objects.filter(stale, id__in=changed).update(**fields)
+            reconciled.update(dict.fromkeys(changed, status))
+    return reconciled
 
-    return True, "Order cancelled successfully"
+
+def reconcile_open_orders(chunk_size=RECONCILE_CHUNK_SIZE):
+    """reconcile_order_statuses over every order not cancelled or returned yet,
+    chunk_size orders per batch. Returns the number of orders updated.
+    """
+    open_orders = Order.objects.exclude(status__in=["cancelled", "returned"])
+    last_id = 0
+    total = 0
+    while True:
+        ids = list(
+            open_orders.filter(id__gt=last_id)
+            .order_by("id")
+            .values_list("id", flat=True)[:chunk_size]
+        )
+        if not ids:
+            return total
+        with transaction.atomic():
+            total += len(reconcile_order_statuses(ids))
+        last_id = ids[-1]
 
 
 def validate_status_transition(current_status, new_staus):
@@ -177,6 +731,16 @@ def validate_status_transition(current_status, new_staus):
     return True, None
 
 
+# payment status set by an order status change, shared by the single and bulk
+# updates. Other steps keep it: COD stays pending until delivery and orders
+# paid online / by wallet stay completed
+PAYMENT_STATUS_FOR_ORDER_STATUS = {
+    "delivered": "completed",
+    "returned": "refunded",
+    "cancelled": "cancelled",
+}
+
+
 def update_order_status(order, new_status, changed_by=None, notes=None):
     """
     Update order status and create history
@@ -198,17 +762,11 @@ def update_order_status(order, new_status, changed_by=None, notes=None):
     order.status = new_status
 
     # Update payment status properly
-    if new_status in ["confirmed", "processing", "shipped", "out_for_delivery"]:
-        order.payment_status = "pending"  # COD stays pending until delivered
-    elif new_status == "delivered":
-        order.payment_status = "completed"
-        if not order.delivered_at:
-            order.delivered_at = timezone.now()
-
-    elif new_status == "returned":
-        order.payment_status = "refunded"
-    elif new_status == "cancelled":
-        order.payment_status = "cancelled"
+    order.payment_status = PAYMENT_STATUS_FOR_ORDER_STATUS.get(
+        new_status, order.payment_status
+    )
+    if new_status == "delivered" and not order.delivered_at:
+        order.delivered_at = timezone.now()
 
     order.save()
 
@@ -220,10 +778,9 @@ def update_order_status(order, new_status, changed_by=None, notes=None):
         delivered_at=order.delivered_at if new_status == "delivered" else None,
     )
 
-    # If you updated items via .update(),  Refresh items so templates show new status
-    order.refresh_from_db()
-    for item in order.items.all():
-        item.refresh_from_db()
+    # items were changed with .update(), drop prefetched copies so templates
+    # load the new statuses
+    getattr(order, "_prefetched_objects_cache", {}).pop("items", None)
 
     OrderStatusHistory.objects.create(
         order=order,
@@ -236,16 +793,104 @@ def update_order_status(order, new_status, changed_by=None, notes=None):
     return True, f"Order status updated to {order.get_status_display()}"
 
 
+# targets of the bulk action, cancelling goes through cancel_orders
+BULK_STATUS_CHOICES = [
+    "confirmed",
+    "processing",
+    "shipped",
+    "out_for_delivery",
+    "delivered",
+]
+
+
+def bulk_update_order_status(orders, new_status, changed_by=None, notes=None):
+    """update_order_status for many orders (e.g. ship 500 orders).
+
+    Transitions are validated in memory with validate_status_transition,
+    then applied with one UPDATE for the orders, one for their items and
+    one bulk INSERT of OrderStatusHistory.
+    Returns (updated orders, [(order, error message)] for skipped ones).
+    """
+    if isinstance(orders, models.QuerySet):
+        order_ids = orders.values("id")
+    else:
+        order_ids = [getattr(order, "id", order) for order in orders]
+
+    with transaction.atomic():
+        locked = list(
+            Order.objects.select_for_update()
+            .filter(id__in=order_ids)
+            .only("id", "order_id", "status")
+            .order_by("id")
+        )
+
+        updated, skipped = [], []
+        for order in locked:
+            if order.status == new_status:
+                skipped.append((order, f"Order is already {new_status}."))
+                continue
+            is_valid, error_message = validate_status_transition(
+                order.status, new_status
+            )
+            if is_valid:
+                updated.append(order)
+            else:
+                skipped.append((order, error_message))
+
+        if not updated:
+            return updated, skipped
+
+        updated_ids = [order.id for order in updated]
+        now = timezone.now()
+
+        fields = {"status": new_status, "updated_at": now}
+        if new_status in PAYMENT_STATUS_FOR_ORDER_STATUS:
+            fields["payment_status"] = PAYMENT_STATUS_FOR_ORDER_STATUS[new_status]
+        if new_status == "delivered":
+            fields["delivered_at"] = Coalesce("delivered_at", Value(now))
+        Order.objects.filter(id__in=updated_ids).update(**fields)
+
+        OrderItem.objects.filter(order_id__in=updated_ids).exclude(
+            status__in=["cancelled", "returned", "return_requested"]
+        ).update(
+            status=new_status,
+            delivered_at=now if new_status == "delivered" else None,
+            updated_at=now,
+        )
+
+        OrderStatusHistory.objects.bulk_create(
+            [
+                OrderStatusHistory(
+                    order=order,
+                    old_status=order.status,
+                    new_status=new_status,
+                    changed_by=changed_by,
+                    notes=notes
+                    or f"Status updated from {order.status} to {new_status}",
+                )
+                for order in updated
+            ]
+        )
+
+        for order in updated:
+            order.status = new_status
+
+    return updated, skipped
+
+
 def check_and_update_order_status_after_item_change(order):
     """
     Check if all items are cancelled/returned and update order status accordingly
     This is called after individual item cancellation or return
     """
-    items = order.items.all()
-
-    total_items = items.count()
-    cancelled_items = items.filter(status="cancelled").count()
-    returned_items = items.filter(status="returned").count()
+    # one grouped count instead of three
+    counts = order_item_status_counts([order.id]).get(order.id)
+    if counts is None:
+        return
+
+    total_items = counts["total"]
+    cancelled_items = counts["cancelled"]
+    returned_items = counts["returned"]
 
     # if all items are cancelled
     if cancelled_items == total_items:
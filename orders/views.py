@@ -1,4 +1,5 @@
 import json
+import uuid
 from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth.decorators import login_required
 from django.contrib import messages
@@ -15,8 +16,13 @@ from django.views.decorators.csrf import csrf_exempt
 from .models import Order, OrderItem, OrderStatusHistory
 from .forms import CancelOrderForm, CancelOrderItemForm, ReturnOrderItemForm
 from .utils import (
+    InsufficientStock,
     cancel_order,
+    create_order_items,
+    get_checkout_quote,
+    reserve_stock,
     search_orders,
+    unavailable_checkout_lines,
     check_and_update_order_status_after_item_change,
 )
 from .invoice import generate_invoice_pdf
@@ -25,7 +31,14 @@ from products.models import Product, Product_varients
 from offers.utils import apply_offer_to_variant
 from wallet.models import Wallet
 from wallet.utils import debit_wallet
-from cart.utils import get_or_create_cart, validate_cart_for_checkout
+from cart.utils import get_or_create_cart, set_cart_item_count
+from payments.models import StockHold
+from payments.utils import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    idempotency_failed,
+    release_stock_holds,
+)
 from coupons.utils import validate_and_apply_coupon, record_coupon_usage
 from coupons.models import Coupon
 
@@ -275,16 +288,8 @@ def checkout_view(request):
             coupon_code = request.POST.get("coupon_code", "").strip()
 
             # calculate cart total before coupon
-            buy_now_item = request.session.get("buy_now")
-            if buy_now_item:
-                # for buy now
-                cart_total = (
-                    Decimal(str(buy_now_item["price"])) * buy_now_item["quantity"]
-                )
-            else:
-                # for cart
-                cart = get_or_create_cart(request.user)
-                cart_total = cart.total
+            checkout, errors = get_checkout_quote(request)
+            cart_total = checkout.subtotal if checkout else Decimal("0.00")
 
             try:
                 # validate and apply coupon
@@ -361,84 +366,42 @@ def checkout_view(request):
 
         return redirect("checkout")
 
-    buy_now_item = request.session.get("buy_now")
-    if buy_now_item:
-        variant = Product_varients.objects.select_related("product").get(
-            id=buy_now_item["variant_id"]
-        )
-        product = variant.product
-        quantity = int(buy_now_item["quantity"])
-        price = Decimal(str(buy_now_item["price"]))
-        original_price = Decimal(str(buy_now_item.get("original_price", price)))
-        item_discount = Decimal(str(buy_now_item.get("discount_amount", 0)))
-
-        # temp cart_items to list in the template loop
-        cart_items = [
-            {
-                "product": product,
-                "variant": variant,
-                "product_name": product.product_name,
-                "variant_colour": variant.colour,
-                "quantity": quantity,
-                "price": price,
-                "original_price": original_price,
-                "discount_amount": item_discount,
-                "total": price * quantity,
-            }
-        ]
-
-        mrp_total = original_price * quantity
-        subtotal = price * quantity
-        discount_amount = item_discount * quantity
+    # priced once, reused by place_order / create_razorpay_order
+    checkout, errors = get_checkout_quote(request)
+    if checkout is None:
+        if request.session.get("buy_now"):
+            return render(request, "errors/product_unavailable.html", status=404)
+        for error in errors:
+            messages.error(request, error)
+        return redirect("cart_view")
+
+    # variants only for the images
+    variants = Product_varients.objects.select_related("product").prefetch_related(
+        "images"
+    ).in_bulk([line.variant_id for line in checkout.lines])
+    cart_items = [
+        {
+            "product": variants[line.variant_id].product,
+            "variant": variants[line.variant_id],
+            "product_name": line.product_name,
+            "variant_colour": line.variant_colour,
+            "quantity": line.quantity,
+            "price": line.price,
+            "original_price": line.original_price,
+            "discount_amount": line.discount_amount,  # per single item
+            "total": line.total,
+        }
+        for line in checkout.lines
+        if line.variant_id in variants
+    ]
 
-    else:
+    mrp_total = checkout.mrp_total
+    subtotal = checkout.subtotal
+    discount_amount = checkout.discount_amount
 
-        cart = get_or_create_cart(request.user)
-        cart.calculate_total()
-
-        # validate cart
-        is_valid, errors = validate_cart_for_checkout(cart)
-        if not is_valid:
-            for error in errors:
-                messages.error(request, error)
-            return redirect("cart_view")
-
-        # Calculate total summary
-        cart_items_qs = cart.items.select_related("product", "variant").all()
-        cart_items = []
-
-        mrp_total = Decimal("0.00")
-        subtotal = Decimal("0.00")
-        discount_amount = Decimal("0.00")
-
-        for item in cart_items_qs:
-            # Recompute pricing from offers utils for display (do not change cart DB)
-            pricing = apply_offer_to_variant(item.variant)
-            final_price = Decimal(str(pricing["final_price"]))
-            original_price = Decimal(str(pricing["original_price"]))
-            item_discount = Decimal(str(pricing["discount_amount"]))
-
-            line_total = final_price * item.quantity
-
-            cart_items.append(
-                {
-                    "product": item.product,
-                    "variant": item.variant,
-                    "product_name": item.product.product_name,
-                    "variant_colour": item.variant.colour,
-                    "quantity": item.quantity,
-                    "price": final_price,
-                    "original_price": original_price,
-                    "discount_amount": item_discount,  # per single item
-                    "total": line_total,
-                    "has_offer": pricing["has_offer"],
-                    "offer_name": pricing.get("offer_name"),
-                    "discount_percentage": pricing.get("discount_percentage"),
-                }
-            )
-            mrp_total += original_price * item.quantity
-            subtotal += line_total
-            discount_amount += item_discount * item.quantity
+    if checkout.coupon_id and applied_coupon is None:
+        applied_coupon = Coupon.objects.filter(id=checkout.coupon_id).first()
+    discount_from_coupon = checkout.coupon_discount
 
     # Get user addresses
     addresses = Address.objects.filter(user=request.user).order_by("-created_at")
@@ -458,15 +421,11 @@ def checkout_view(request):
     tax_rate = Decimal("0.18")
     # tax_amount = (subtotal - discount_amount) * tax_rate
 
-    # Shipping free above 1000
-    shipping_charge = Decimal("0.00") if subtotal >= 2000 else Decimal("50.00")
-
-    # original_price = original_price * quantity
+    # Shipping free above 2000
+    shipping_charge = checkout.shipping_charge
 
     # Total amount
-    total_amount = subtotal - discount_from_coupon + shipping_charge  # + tax_amount
-
-    # total_amount = (subtotal - discount_from_coupon + shipping_charge).quantize(Decimal("0.01"))
+    total_amount = checkout.total_amount  # + tax_amount
 
     # using wallet amount
     use_wallet = False
@@ -516,6 +475,8 @@ def checkout_view(request):
         "remaining_amount": remaining_amount,
         "applied_coupon": applied_coupon,
         "coupon_discount": discount_from_coupon,
+        # one key per rendered page, a double submit places a single order
+        "idempotency_key": uuid.uuid4().hex,
     }
 
     return render(request, "orders/checkout.html", context)
@@ -530,6 +491,12 @@ def select_address(request, address_id):
     return redirect("checkout")
 
 
+def _replay_place_order(request, idempotency):
+    """Checkout form submitted again, show what the first submit did"""
+    request.session["last_order_id"] = idempotency.order_id
+    return redirect("order_success")
+
+
 @login_required(login_url="login")
 @transaction.atomic
 def place_order(request):
@@ -541,56 +508,77 @@ def place_order(request):
     if request.method != "POST":
         return redirect("checkout")
 
-    # buy now place order
-    buy_now_item = request.session.get("buy_now")
-
-    if buy_now_item:
-        try:
-            variant = Product_varients.objects.select_related("product").get(
-                id=buy_now_item["variant_id"]
+    idempotency, first = claim_idempotency_key(
+        request.user, "place_order", request.POST.get("idempotency_key", "")
+    )
+    if not first:
+        return _replay_place_order(request, idempotency)
+
+    # the quote the checkout page showed, repriced only if it went stale
+    checkout, errors = get_checkout_quote(request)
+    if checkout is None:
+        if request.session.get("buy_now"):
+            return idempotency_failed(
+                render(request, "errors/product_unavailable.html", status=404)
             )
-            product = variant.product
-        except Product_varients.DoesNotExist:
-            return render(request, "errors/product_unavailable.html", status=404)
+        for error in errors:
+            messages.error(request, error)
+        return idempotency_failed(redirect("checkout"))
+
+    # unlisted while the quote was cached
+    errors = unavailable_checkout_lines(checkout)
+    if errors:
+        request.session.pop("checkout_quote", None)
+        if checkout.mode == "buy_now":
+            return idempotency_failed(
+                render(request, "errors/product_unavailable.html", status=404)
+            )
+        for error in errors:
+            messages.error(request, error)
+        return idempotency_failed(redirect("checkout"))
 
-        quantity = buy_now_item["quantity"]
+    subtotal = checkout.subtotal
+    discount_amount = checkout.discount_amount  # offer discount
+    coupon_discount = checkout.coupon_discount
+    shipping_charge = checkout.shipping_charge
+    total_amount = checkout.total_amount
 
-        # recomputing price  using offers (don't trust session completely)
-        pricing = apply_offer_to_variant(variant)
-        price = Decimal(str(pricing["final_price"]))
-        original_price = Decimal(str(pricing["original_price"]))
-        discount_per_item = Decimal(str(pricing["discount_amount"]))
-
-        if not product.is_listed or not variant.is_listed:
-            return render(request, "errors/product_unavailable.html", status=404)
+    # resrict cod above 1,000
+    if not wallet_only and not checkout.cod_allowed:
+        messages.error(
+            request,
+            "Cash on Delivery is not available for orders above ₹1,000. Please pay online or use wallet.",
+        )
+        return idempotency_failed(redirect("checkout"))
 
-        if variant.stock < quantity:
-            messages.error(request, "Not enough stock available.")
-            return redirect("checkout")
+    if wallet_only and wallet.balance < total_amount:
+        messages.error(request, "Insufficient wallet balance.")
+        return idempotency_failed(redirect("checkout"))
 
-        subtotal = price * quantity
-        discount_amount = discount_per_item * quantity
+    order_items = checkout.order_items()
 
-        coupon_discount = Decimal("0.00")
-        if "coupon_discount" in request.session:
-            coupon_discount = Decimal(request.session["coupon_discount"])
+    # buy now place order
+    if checkout.mode == "buy_now":
+        selected_address_id = request.session.get("selected_address_id")
+        if not selected_address_id:
+            messages.error(request, "Please select a delivery address.")
+            return idempotency_failed(redirect("checkout"))
 
-        shipping_charge = Decimal("0.00") if subtotal >= 2000 else Decimal("50.00")
-        total_amount = subtotal - coupon_discount + shipping_charge
+        shipping_address = get_object_or_404(
+            Address, id=selected_address_id, user=request.user
+        )
 
-        # resrict cod above 10,000
-        if not wallet_only and total_amount > Decimal("1000"):
-            messages.error(
-                request,
-                "Cash on Delivery is not available for orders  above ₹1,000. Please pay online or use wallet.",
-            )
-            return redirect("checkout")
+        # take the stock first, nothing else is written if it ran out
+        try:
+            with transaction.atomic():
+                reserve_stock(order_items)
+        except InsufficientStock as e:
+            for message in e.messages:
+                messages.error(request, message)
+            return idempotency_failed(redirect("checkout"))
 
         # wallet payments
         if wallet_only:
-            if wallet.balance < total_amount:
-                messages.error(request, "Insufficient wallet balance.")
-                return redirect("checkout")
             debit_wallet(
                 user=request.user,
                 amount=total_amount,
@@ -598,17 +586,6 @@ def place_order(request):
                 description="Order payment(Buy Now)",
             )
 
-        selected_address_id = request.session.get("selected_address_id")
-        if not selected_address_id:
-            messages.error(request, "Please select a delivery address.")
-            return redirect("checkout")
-
-        shipping_address = get_object_or_404(
-            Address, id=selected_address_id, user=request.user
-        )
-
-        mrp_total = original_price * quantity
-
         order = Order.objects.create(
             user=request.user,
             shipping_address=shipping_address,
@@ -627,26 +604,10 @@ def place_order(request):
             payment_status="completed" if wallet_only else "pending",
             status="pending",
             order_notes=request.POST.get("order_note", ""),
+            estimated_delivery=date.today() + timedelta(days=7),
         )
-        order.estimated_delivery = date.today() + timedelta(days=7)
-        order.save()
-
-        OrderItem.objects.create(
-            order=order,
-            product=product,
-            product_name=product.product_name,
-            variant=variant,
-            variant_colour=variant.colour,
-            price=price,
-            original_price=original_price,
-            discount_amount=discount_per_item,
-            quantity=quantity,
-            status="pending",
-        )
-
-        # reduce stock
-        variant.stock -= quantity
-        variant.save()
+        create_order_items(order, order_items)
+        complete_idempotency_key(idempotency, order=order)
 
         OrderStatusHistory.objects.create(
             order=order,
@@ -678,6 +639,7 @@ def place_order(request):
                 logger.error(f"error in recording coupon usage: {e}")
 
         del request.session["buy_now"]
+        request.session.pop("checkout_quote", None)
         if "selected_address_id" in request.session:
             del request.session["selected_address_id"]
 
@@ -685,79 +647,27 @@ def place_order(request):
         messages.success(request, f"Order {order.order_id} placed successfully.")
         return redirect("order_success")
 
-    cart = get_or_create_cart(request.user)
-
-    # Validate cart
-    is_valid, errors = validate_cart_for_checkout(cart)
-    if not is_valid:
-        for error in errors:
-            messages.error(request, error)
-        return redirect("checkout")
-
     # Get address
     selected_address_id = request.session.get("selected_address_id")
     if not selected_address_id:
         messages.error(request, "Please select a delivery address.")
-        return redirect("checkout")
+        return idempotency_failed(redirect("checkout"))
 
     shipping_address = get_object_or_404(
         Address, id=selected_address_id, user=request.user
     )
 
-    # Calculate totals using offer per variant
-    cart_items = cart.items.select_related("product", "variant").all()
-    subtotal = Decimal("0.00")
-    total_discount = Decimal("0.00")
-
-    for item in cart_items:
-        if not item.product.is_listed or not item.variant.is_listed:
-            return render(request, "errors/product_unavailable.html", status=404)
-
-        if item.variant.stock <= 0 or item.variant.stock < item.quantity:
-            messages.error(
-                request, f"Not enough stock for {item.product.product_name}."
-            )
-            return redirect("checkout")
-
-    line_data = []
-    for item in cart_items:
-        pricing = apply_offer_to_variant(item.variant)
-        final_price = Decimal(str(pricing["final_price"]))
-        original_price = Decimal(str(pricing["original_price"]))
-        item_discount = Decimal(str(pricing["discount_amount"]))  # per single item
-
-        line_total = final_price * item.quantity
-        subtotal += line_total
-        total_discount += item_discount * item.quantity
-
-        line_data.append(
-            {
-                "item": item,
-                "final_price": final_price,
-                "original_price": original_price,
-                "item_discount": item_discount,
-            }
-        )
-
-    coupon_discount = Decimal("0.00")
-    if "coupon_discount" in request.session:
-        coupon_discount = Decimal(request.session["coupon_discount"])
-
-    shipping_charge = Decimal("0.00") if subtotal >= 2000 else Decimal("50.00")
-    total_amount = subtotal - coupon_discount + shipping_charge
-
-    if not wallet_only and total_amount > Decimal("1000"):
-        messages.error(
-            request,
-            "Cash on Delivery is not available for orders above ₹1,000. Please select pay online or use wallet",
-        )
-        return redirect("checkout")
+    # take the stock first (one conditional UPDATE per variant), nothing
+    # else is written if a line ran out since the quote
+    try:
+        with transaction.atomic():
+            reserve_stock(order_items)
+    except InsufficientStock as e:
+        for message in e.messages:
+            messages.error(request, message)
+        return idempotency_failed(redirect("checkout"))
 
     if wallet_only:
-        if wallet.balance < total_amount:
-            messages.error(request, "Insufficient wallet balance.")
-            return redirect("checkout")
-
         debit_wallet(
             user=request.user,
             amount=total_amount,
@@ -765,13 +675,6 @@ def place_order(request):
             description="Order payment",
         )
 
-    mrp_total = Decimal("0.00")
-
-    for item in cart_items:
-        pricing = apply_offer_to_variant(item.variant)
-        original_price = Decimal(str(pricing["original_price"]))
-        mrp_total += original_price * item.quantity
-
     # Create order
     order = Order.objects.create(
         user=request.user,
@@ -783,7 +686,7 @@ def place_order(request):
         state=shipping_address.state,
         postal_code=shipping_address.postal_code,
         subtotal=subtotal,
-        discount_amount=total_discount,  # offer discount
+        discount_amount=discount_amount,  # offer discount
         coupon_discount=coupon_discount,
         shipping_charge=shipping_charge,
         total_amount=total_amount,
@@ -791,29 +694,12 @@ def place_order(request):
         payment_status="completed" if wallet_only else "pending",
         status="pending",
         order_notes=request.POST.get("order_note", ""),
+        estimated_delivery=date.today() + timedelta(days=7),
     )
-    order.estimated_delivery = date.today() + timedelta(days=7)
-    order.save()
-
-    # Create order items
-    for d in line_data:
-        cart_item = d["item"]
-        OrderItem.objects.create(
-            order=order,
-            product=cart_item.product,
-            variant=cart_item.variant,
-            product_name=cart_item.product.product_name,
-            variant_colour=cart_item.variant.colour,
-            price=d["final_price"],
-            original_price=d["original_price"],
-            discount_amount=d["item_discount"],
-            quantity=cart_item.quantity,
-            status="pending",
-        )
 
-        # Reduce stock
-        cart_item.variant.stock -= cart_item.quantity
-        cart_item.variant.save()
+    # Create order items, one INSERT
+    create_order_items(order, order_items)
+    complete_idempotency_key(idempotency, order=order)
 
     # Create status history
     OrderStatusHistory.objects.create(
@@ -845,11 +731,14 @@ def place_order(request):
             logger.debug(f"Coupon recording error: {e}")
 
     # Clear cart
+    cart = get_or_create_cart(request.user)
     cart.items.all().delete()
     cart.total = Decimal("0.00")
     cart.save()
+    set_cart_item_count(cart.user_id, 0)
 
     # Clear session
+    request.session.pop("checkout_quote", None)
     if "selected_address_id" in request.session:
         del request.session["selected_address_id"]
 
@@ -881,6 +770,14 @@ def order_success(request):
 
 @login_required(login_url="login")
 def payment_failed(request):
+    # payment abandoned, give its held stock back now instead of at expiry
+    pending = request.session.get("pending_payment")
+    if pending:
+        release_stock_holds(
+            StockHold.objects.filter(
+                user=request.user, razorpay_order_id=pending.get("razorpay_order_id")
+            )
+        )
     return render(request, "orders/payment_failed.html")
 
 
@@ -0,0 +1,49 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from payments.utils import STOCK_HOLD_RELEASE_CHUNK, release_expired_stock_holds
+
+
+class Command(BaseCommand):
+    help = (
+        "Give back the stock of expired Razorpay stock holds. "
+        "Runs once by default, --loop keeps sweeping every --interval seconds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--loop",
+            action="store_true",
+            help="Keep running and sweep every --interval seconds",
+        )
+        parser.add_argument(
+            "--interval",
+            type=int,
+            default=60,
+            help="Seconds between sweeps in --loop mode",
+        )
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=STOCK_HOLD_RELEASE_CHUNK,
+            help="Holds released per transaction",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = max(options["chunk_size"], 1)
+        self.sweep(chunk_size)
+
+        if options["loop"]:
+            try:
+                while True:
+                    time.sleep(max(options["interval"], 1))
+                    close_old_connections()
+                    self.sweep(chunk_size)
+            except KeyboardInterrupt:
+                self.stdout.write("Stock hold sweeper stopped")
+
+    def sweep(self, chunk_size):
+        released = release_expired_stock_holds(chunk_size=chunk_size)
+        self.stdout.write(self.style.SUCCESS(f"Released {released} stock hold(s)"))
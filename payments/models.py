@@ -1,3 +1,82 @@
 from django.db import models
+from django.db.models import Q
 
-# Create your models here.
+from accounts.models import Account
+from orders.models import Order
+from products.models import Product_varients
+
+
+class StockHold(models.Model):
+    """Stock taken off a variant while its Razorpay payment is pending.
+
+    The quantity is already subtracted from Product_varients.stock, so every
+    availability check sees it. verify_payment consumes the holds; the
+    release_stock_holds command gives back the stock of expired ones.
+    """
+
+    STATUS_CHOICES = [
+        ("active", "Active"),
+        ("consumed", "Consumed"),
+        ("released", "Released"),
+    ]
+
+    user = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="stock_holds"
+    )
+    variant = models.ForeignKey(
+        Product_varients, on_delete=models.CASCADE, related_name="stock_holds"
+    )
+    quantity = models.PositiveIntegerField()
+    razorpay_order_id = models.CharField(max_length=100, db_index=True)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="active")
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            # sweeper: active holds past expires_at
+            models.Index(
+                fields=["expires_at"],
+                name="stockhold_active_expiry",
+                condition=Q(status="active"),
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.variant_id} x{self.quantity} ({self.razorpay_order_id})"
+
+
+class IdempotencyKey(models.Model):
+    """First result of a request that must not run twice.
+
+    Double-clicked "Place order" forms and retried Razorpay callbacks send
+    the same key; the unique index lets only the first request through and
+    the others replay its order / wallet transaction.
+    """
+
+    SCOPE_CHOICES = [
+        ("place_order", "Place order"),
+        ("verify_payment", "Verify payment"),
+        ("wallet_recharge", "Wallet recharge"),
+    ]
+
+    user = models.ForeignKey(
+        Account, on_delete=models.CASCADE, related_name="idempotency_keys"
+    )
+    scope = models.CharField(max_length=20, choices=SCOPE_CHOICES)
+    key = models.CharField(max_length=100)
+    order = models.ForeignKey(Order, on_delete=models.SET_NULL, null=True, blank=True)
+    wallet_transaction = models.ForeignKey(
+        "wallet.WalletTransaction", on_delete=models.SET_NULL, null=True, blank=True
+    )
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "scope", "key"], name="unique_idempotency_key"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.scope}:{self.key}"
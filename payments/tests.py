@@ -1,3 +1,132 @@
+from datetime import timedelta
+
+from django.db import transaction
 from django.test import TestCase
+from django.utils import timezone
+
+from orders.tests import OrderTestData
+from orders.utils import InsufficientStock, reserve_stock
+from wallet.utils import credit_wallet
+from .models import IdempotencyKey, StockHold
+from .utils import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    consume_stock_holds,
+    hold_stock,
+    idempotency_failed,
+    release_expired_stock_holds,
+)
+
+
+class StockHoldTests(OrderTestData, TestCase):
+    def hold(self, razorpay_order_id, lines):
+        return hold_stock(self.user, razorpay_order_id, self.order_items(lines))
+
+    def statuses(self, razorpay_order_id):
+        return sorted(
+            StockHold.objects.filter(razorpay_order_id=razorpay_order_id).values_list(
+                "status", flat=True
+            )
+        )
+
+    def test_hold_takes_stock_until_expiry(self):
+        first, second, _ = self.variants
+        holds = self.hold("rp_1", [(first, 2), (second, 1)])
+
+        self.assertEqual([self.stock(first), self.stock(second)], [3, 4])
+        self.assertEqual(self.statuses("rp_1"), ["active", "active"])
+        self.assertTrue(all(hold.expires_at > timezone.now() for hold in holds))
+
+    def test_short_line_holds_nothing(self):
+        first, second, _ = self.variants
+        with self.assertRaises(InsufficientStock):
+            self.hold("rp_1", [(first, 2), (second, 6)])
+
+        self.assertEqual([self.stock(first), self.stock(second)], [5, 5])
+        self.assertFalse(StockHold.objects.exists())
+
+    def test_consumed_holds_hand_their_stock_to_the_order(self):
+        first = self.variants[0]
+        self.hold("rp_1", [(first, 2)])
+        # someone else buys the rest meanwhile
+        with transaction.atomic():
+            reserve_stock(self.order_items([(first, 3)]))
+
+        with transaction.atomic():
+            self.assertEqual(consume_stock_holds(self.user, "rp_1"), 1)
+            reserve_stock(self.order_items([(first, 2)]))
+
+        self.assertEqual(self.stock(first), 0)
+        self.assertEqual(self.statuses("rp_1"), ["consumed"])
+        # a retried verification finds nothing left to consume
+        self.assertEqual(consume_stock_holds(self.user, "rp_1"), 0)
+
+    def test_sweeper_releases_only_expired_active_holds(self):
+        first, second, third = self.variants
+        self.hold("rp_expired", [(first, 1), (second, 2)])
+        self.hold("rp_paid", [(third, 1)])
+        with transaction.atomic():
+            consume_stock_holds(self.user, "rp_paid")
+        StockHold.objects.update(expires_at=timezone.now() - timedelta(minutes=1))
+        self.hold("rp_pending", [(first, 1)])
+
+        self.assertEqual(release_expired_stock_holds(chunk_size=1), 2)
+
+        self.assertEqual(self.statuses("rp_expired"), ["released", "released"])
+        self.assertEqual(self.statuses("rp_paid"), ["consumed"])
+        self.assertEqual(self.statuses("rp_pending"), ["active"])
+        # the consumed hold's stock went back for the order to take
+        self.assertEqual([self.stock(v) for v in self.variants], [4, 5, 5])
+        self.assertEqual(release_expired_stock_holds(), 0)
+
+
+class IdempotencyKeyTests(OrderTestData, TestCase):
+    def claim(self, key="key-1", scope="place_order"):
+        with transaction.atomic():
+            return claim_idempotency_key(self.user, scope, key)
+
+    def test_completed_key_is_replayed(self):
+        record, first = self.claim()
+        self.assertTrue(first)
+        order = self.make_order([(self.variants[0], 1)])
+        complete_idempotency_key(record, order=order)
+
+        replay, first = self.claim()
+        self.assertFalse(first)
+        self.assertEqual((replay.pk, replay.order_id), (record.pk, order.pk))
+
+    def test_completed_wallet_recharge_is_replayed(self):
+        record, _ = self.claim(scope="wallet_recharge")
+        wallet_transaction = credit_wallet(self.user, "500", "credit")
+        complete_idempotency_key(record, wallet_transaction=wallet_transaction)
+
+        replay, first = self.claim(scope="wallet_recharge")
+        self.assertFalse(first)
+        self.assertEqual(replay.wallet_transaction_id, wallet_transaction.pk)
+
+    def test_keys_are_per_scope(self):
+        self.claim(scope="place_order")
+        _, first = self.claim(scope="verify_payment")
+        self.assertTrue(first)
+
+    def test_rolled_back_key_is_issued_again(self):
+        with transaction.atomic():
+            claim_idempotency_key(self.user, "verify_payment", "key-1")
+            response = idempotency_failed("error response")
+        self.assertEqual(response, "error response")
+        self.assertFalse(IdempotencyKey.objects.exists())
+
+        record, first = self.claim(scope="verify_payment")
+        self.assertTrue(first)
+        self.assertIsNotNone(record.pk)
+
+    def test_key_left_without_result_is_issued_again(self):
+        left, _ = self.claim()
+
+        record, first = self.claim()
+        self.assertTrue(first)
+        self.assertEqual(record.pk, left.pk)
 
-# Create your tests here.
+    def test_empty_key_is_not_tracked(self):
+        self.assertEqual(self.claim(key=""), (None, True))
+        self.assertFalse(IdempotencyKey.objects.exists())
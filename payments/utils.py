@@ -1,6 +1,156 @@
+from datetime import timedelta
+
 import razorpay
 from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from orders.utils import release_stock, reserve_stock
+from .models import IdempotencyKey, StockHold
 
 razorpay_client = razorpay.Client(
     auth=(settings.RAZORPAY_KEY_ID, settings.RAZORPAY_KEY_SECRET)
 )
+
+
+# ---- stock holds while a Razorpay payment is pending ----
+
+# default chunk for the sweeper
+STOCK_HOLD_RELEASE_CHUNK = 500
+
+
+def get_stock_hold_ttl():
+    """how long a hold lives (settings.STOCK_HOLD_MINUTES, default 15)"""
+    return timedelta(minutes=getattr(settings, "STOCK_HOLD_MINUTES", 15))
+
+
+def hold_stock(user, razorpay_order_id, items):
+    """Take stock for items (variant_id, quantity) until the payment is verified.
+
+    Same conditional UPDATEs as order creation (orders.utils.reserve_stock),
+    raises InsufficientStock and writes nothing if a line is short.
+    """
+    expires_at = timezone.now() + get_stock_hold_ttl()
+    holds = [
+        StockHold(
+            user=user,
+            variant_id=item.variant_id,
+            quantity=item.quantity,
+            razorpay_order_id=razorpay_order_id,
+            expires_at=expires_at,
+        )
+        for item in items
+    ]
+    with transaction.atomic():
+        reserve_stock(holds)
+        StockHold.objects.bulk_create(holds)
+    return holds
+
+
+def release_stock_holds(holds):
+    """Give back the stock of the active holds in the queryset.
+
+    Rows are locked and skipped if another worker (verify_payment or a second
+    sweeper) has them, so a hold is never both consumed and released.
+    Returns the number of holds released.
+    """
+    with transaction.atomic():
+        released = list(
+            holds.filter(status="active").select_for_update(skip_locked=True)
+        )
+        if not released:
+            return 0
+        StockHold.objects.filter(id__in=[hold.id for hold in released]).update(
+            status="released"
+        )
+        release_stock(released)
+    return len(released)
+
+
+def release_expired_stock_holds(now=None, chunk_size=STOCK_HOLD_RELEASE_CHUNK):
+    """Release every active hold past expires_at, chunk_size holds per transaction"""
+    now = now or timezone.now()
+    total = 0
+    while True:
+        expired = StockHold.objects.filter(
+            status="active", expires_at__lte=now
+        ).order_by("expires_at")[:chunk_size]
+        released = release_stock_holds(
+            StockHold.objects.filter(id__in=list(expired.values_list("id", flat=True)))
+        )
+        if not released:
+            return total
+        total += released
+
+
+def consume_stock_holds(user, razorpay_order_id):
+    """Hand the held stock of a paid Razorpay order to the order transaction.
+
+    The holds are marked consumed and their stock goes back on the variants,
+    whose rows stay locked until the transaction ends, so the order's own
+    reserve_stock takes the same units (even if the cart changed meanwhile).
+    Call inside the order transaction. Returns the number of holds.
+    """
+    holds = list(
+        StockHold.objects.filter(
+            user=user, razorpay_order_id=razorpay_order_id, status="active"
+        ).select_for_update()
+    )
+    if holds:
+        StockHold.objects.filter(id__in=[hold.id for hold in holds]).update(
+            status="consumed"
+        )
+        release_stock(holds)
+    return len(holds)
+
+
+# ---- idempotency keys for order placement and payment verification ----
+
+
+def claim_idempotency_key(user, scope, key):
+    """(record, first) for a request idempotency key.
+
+    first is True when this request owns the key: the row is inserted in the
+    caller's transaction and commits together with the result stored by
+    complete_idempotency_key. Otherwise record belongs to the earlier request
+    (one indexed lookup); a concurrent duplicate waits on the unique index
+    until the first one commits. A key without a result was left by an
+    attempt that failed, it is handed out again. Empty keys are not
+    tracked: (None, True).
+    """
+    if not key:
+        return None, True
+
+    record = IdempotencyKey.objects.filter(user=user, scope=scope, key=key).first()
+    if record is not None:
+        if record.order_id is None and record.wallet_transaction_id is None:
+            # lock it, a concurrent retry may be storing its result right now
+            record = IdempotencyKey.objects.select_for_update().get(pk=record.pk)
+            return record, (
+                record.order_id is None and record.wallet_transaction_id is None
+            )
+        return record, False
+
+    try:
+        with transaction.atomic():
+            return IdempotencyKey.objects.create(user=user, scope=scope, key=key), True
+    except IntegrityError:
+        return IdempotencyKey.objects.get(user=user, scope=scope, key=key), False
+
+
+def idempotency_failed(response):
+    """Return an error response after claim_idempotency_key.
+    Rolls back the view transaction (the claimed key, consumed holds, ...)
+    so a retry with the same key runs again instead of being replayed.
+    """
+    transaction.set_rollback(True)
+    return response
+
+
+def complete_idempotency_key(record, order=None, wallet_transaction=None):
+    """Store the result of the request that claimed the key"""
+    if record is None:
+        return
+    record.order = order
+    record.wallet_transaction = wallet_transaction
+    record.save(update_fields=["order", "wallet_transaction"])
@@ -11,12 +11,27 @@ from django.http import JsonResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.db import transaction
 
-from .utils import razorpay_client
-from orders.models import Order
+from .models import StockHold
+from .utils import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    consume_stock_holds,
+    hold_stock,
+    idempotency_failed,
+    razorpay_client,
+    release_stock_holds,
+)
 from accounts.models import Address
-from products.models import Product_varients
-from cart.utils import get_or_create_cart, validate_cart_for_checkout
-from orders.models import Order, OrderItem, OrderStatusHistory
+from cart.utils import get_or_create_cart, set_cart_item_count
+from orders.models import Order, OrderStatusHistory
+from orders.utils import (
+    CheckoutQuote,
+    InsufficientStock,
+    create_order_items,
+    get_checkout_quote,
+    reserve_stock,
+    unavailable_checkout_lines,
+)
 from wallet.utils import get_or_create_wallet, debit_wallet
 
 from coupons.utils import record_coupon_usage
@@ -46,6 +61,15 @@ def create_razorpay_order(request):
 
     user = request.user
 
+    # a retry replaces the previous attempt, give its held stock back first
+    previous = request.session.get("pending_payment")
+    if previous:
+        release_stock_holds(
+            StockHold.objects.filter(
+                user=user, razorpay_order_id=previous.get("razorpay_order_id")
+            )
+        )
+
     # NEW FIX: Store selected address in session for Razorpay verify
     selected_address_id = request.GET.get("address_id")
     if selected_address_id:
@@ -60,112 +84,32 @@ def create_razorpay_order(request):
         )
 
     shipping_address = get_object_or_404(Address, id=selected_address_id, user=user)
-    buy_now_item = request.session.get("buy_now")
 
-    # default values for wallet usage
-    wallet_used = Decimal("0.00")
-    online_amount = Decimal("0.00")
-    use_wallet = request.session.get("use_wallet", False)
-    wallet = get_or_create_wallet(user)
+    # same quote as the checkout page and place_order (offers included)
+    checkout, errors = get_checkout_quote(request)
+    if checkout is None:
+        return JsonResponse({"status": "error", "message": errors[0]}, status=400)
 
-    # get coupon discount from session or 0.00
-    coupon_discount = Decimal(request.session.get("coupon_discount", "0.00"))
+    errors = unavailable_checkout_lines(checkout)
+    if errors:
+        request.session.pop("checkout_quote", None)
+        return JsonResponse({"status": "error", "message": errors[0]}, status=400)
 
-    # buy now flow
-    if buy_now_item:
-        try:
-            variant = Product_varients.objects.select_related("product").get(
-                id=buy_now_item["variant_id"]
-            )
-            product = variant.product
-        except Product_varients.DoesNotExist:
-            return JsonResponse(
-                {"status": "error", "message": "Product not found."}, status=400
-            )
-
-        quantity = buy_now_item.get("quantity", 1)
-        # Handle both cases: price in session or not
-        price = Decimal(str(buy_now_item.get("price", variant.price)))
-
-        if not product.is_listed or not variant.is_listed:
-            return JsonResponse(
-                {"status": "error", "message": "Product is not available."}, status=400
-            )
-
-        if variant.stock < quantity:
-            return JsonResponse(
-                {"status": "error", "meesage": "Not enough stock available."},
-                status=400,
-            )
-
-        subtotal = price * quantity
-        discount_amount = Decimal("0.00")  # Implement any discount logic if needed
-        shipping_charge = Decimal("0.00") if subtotal >= 2000 else Decimal("50.00")
-
-        total_amount = subtotal - coupon_discount + shipping_charge
-
-        if use_wallet and wallet.balance > 0:
-            wallet_used = min(wallet.balance, total_amount)
-            online_amount = total_amount - wallet_used
-        else:
-            online_amount = total_amount
+    use_wallet = request.session.get("use_wallet", False)
+    wallet = get_or_create_wallet(user)
 
+    # wallet first, razorpay charges the rest
+    if use_wallet:
+        wallet_used, online_amount = checkout.wallet_split(wallet.balance)
     else:
-        # cart flow
-        cart = get_or_create_cart(user)
-        # same validation as place_order
-        is_valid, errors = validate_cart_for_checkout(cart)
-        if not is_valid:
-            return JsonResponse(
-                {
-                    "status": "error",
-                    "message": (
-                        errors[0] if errors else "Cart is not valid for checkout."
-                    ),
-                },
-                status=400,
-            )
+        wallet_used, online_amount = Decimal("0.00"), checkout.total_amount
 
-        cart_items = cart.items.select_related("product", "variant")
-        subtotal = cart.total
-
-        # listing and stock check
-        for item in cart_items:
-            if not item.product.is_listed or not item.variant.is_listed:
-                return JsonResponse(
-                    {
-                        "status": "error",
-                        "message": f"{item.product.product_name} is unavailable.",
-                    },
-                    status=400,
-                )
-            if item.variant.stock < item.quantity:
-                return JsonResponse(
-                    {
-                        "status": "error",
-                        "message": f"Not enough stock for {item.product.product_name}.",
-                    },
-                    status=400,
-                )
-
-        discount_amount = Decimal("0.00")  # Implement any discount logic if needed
-        shipping_charge = Decimal("0.00") if subtotal >= 2000 else Decimal("50.00")
-
-        total_amount = subtotal - coupon_discount + shipping_charge
-
-        wallet_used = Decimal("0.00")
-        online_amount = total_amount  # what razorpay will charge
-
-        if use_wallet and wallet.balance > 0:
-            wallet_used = min(wallet.balance, total_amount)
-            online_amount = total_amount - wallet_used
-
-        # if wallet covers full amount , don't razorpay
-        if online_amount <= 0:
-            request.session["wallet_only_checkout"] = True
-            return JsonResponse(
-                {"status": "wallet_only", "redirect_url": reverse("place_order")}
-            )
+    # if wallet covers full amount , don't razorpay
+    if online_amount <= 0:
+        request.session["wallet_only_checkout"] = True
+        return JsonResponse(
+            {"status": "wallet_only", "redirect_url": reverse("place_order")}
+        )
 
     amount_paise = int(online_amount * 100)  # Convert to paise
 
@@ -182,18 +126,22 @@ def create_razorpay_order(request):
         logger.error("RAZORPAY ERROR: %s", str(e))
         return JsonResponse({"status": "error", "message": "razorpay_limit_exceeded"})
 
+    # keep the stock until verify_payment (or the hold expires), so it cannot
+    # sell out while the customer is paying
+    try:
+        hold_stock(user, razorpay_order["id"], checkout.order_items())
+    except InsufficientStock as e:
+        return JsonResponse({"status": "error", "message": e.messages[0]}, status=400)
+
     # Save info in session so verify_payment can create DB Order correctly
+    # the quote itself travels with the payment, verify_payment reuses it
     request.session["pending_payment"] = {
-        "mode": "buy_now" if buy_now_item else "cart",
+        "mode": checkout.mode,
         "razorpay_order_id": razorpay_order["id"],
-        "subtotal": str(subtotal),
-        "discount_amount": str(discount_amount),
-        "shipping_charge": str(shipping_charge),
-        "total_amount": str(total_amount),
+        "quote": checkout.dumps(),
         "wallet_used": str(wallet_used),
         "online_amount": str(online_amount),
         "use_wallet": bool(use_wallet),
-        "coupon_discount": str(coupon_discount),
     }
 
     request.session.modified = True
@@ -256,13 +204,23 @@ def verify_payment(request):
             {"status": "failure", "message": "Payment verification failed."}, status=400
         )
 
+    # a retried callback for the same payment replays the first result
+    idempotency, first = claim_idempotency_key(
+        request.user, "verify_payment", razorpay_payment_id
+    )
+    if not first:
+        request.session["last_order_id"] = idempotency.order_id
+        return JsonResponse({"status": "success"})
+
     pending = request.session.get("pending_payment")
     logger.debug(f"PENDING SESSION DATA: {pending}")
 
     if not pending or pending.get("razorpay_order_id") != razorpay_order_id:
-        return JsonResponse(
-            {"status": "error", "message": "No matching pending payment found."},
-            status=400,
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "No matching pending payment found."},
+                status=400,
+            )
         )
 
     logger.debug("VERIFY FLOW CONTINUES: passed session check")
@@ -273,22 +231,28 @@ def verify_payment(request):
     # Address again (in case changed)
     selected_address_id = request.session.get("selected_address_id")
     if not selected_address_id:
-        return JsonResponse(
-            {"status": "error", "message": "Please select a delivery address."},
-            status=400,
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "Please select a delivery address."},
+                status=400,
+            )
         )
 
     shipping_address = get_object_or_404(Address, id=selected_address_id, user=user)
 
-    subtotal = Decimal(pending["subtotal"])
-    discount_amount = Decimal(pending["discount_amount"])
-    shipping_charge = Decimal(pending["shipping_charge"])
-    total_amount = Decimal(pending["total_amount"])
+    # what was quoted when the razorpay order was made; no max_age, the
+    # amount is checked against razorpay below
+    checkout = CheckoutQuote.loads(pending.get("quote", ""), max_age=None)
+    if checkout is None:
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "No matching pending payment found."},
+                status=400,
+            )
+        )
 
     wallet_used = Decimal(pending.get("wallet_used", "0.00"))
-    online_amount = Decimal(str(pending.get("online_amount", total_amount)))
-
-    coupon_discount = Decimal(pending.get("coupon_discount", "0.00"))
+    online_amount = Decimal(str(pending.get("online_amount", checkout.total_amount)))
 
     # We must check that Razorpay amount == online_amount
     try:
@@ -297,15 +261,45 @@ def verify_payment(request):
             Decimal("0.01")
         )  # convert paise to INR  and prevent floating by quantize
     except:
-        return JsonResponse(
-            {"status": "error", "message": "Failed to verify Razorpay order amount."},
-            status=400,
+        return idempotency_failed(
+            JsonResponse(
+                {
+                    "status": "error",
+                    "message": "Failed to verify Razorpay order amount.",
+                },
+                status=400,
+            )
         )
 
     if rp_amount != online_amount:
         logger.error(f"Amount mismatch! Expected {online_amount}, got {rp_amount}")
-        return JsonResponse(
-            {"status": "error", "message": "Payment amount mismatch."}, status=400
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "Payment amount mismatch."}, status=400
+            )
+        )
+
+    # held stock goes back on the variants (rows locked until commit) so the
+    # checks below and reserve_stock see it
+    consume_stock_holds(user, razorpay_order_id)
+
+    # order items and stock, before anything is written
+    errors = unavailable_checkout_lines(checkout)
+    if errors:
+        return idempotency_failed(
+            JsonResponse({"status": "error", "message": errors[0]}, status=400)
+        )
+
+    order_items = checkout.order_items()
+
+    # conditional stock UPDATEs, rolled back together if any line ran out
+    try:
+        with transaction.atomic():
+            reserve_stock(order_items)
+    except InsufficientStock as e:
+        logger.error(f"Stock ran out for paid order {razorpay_order_id}: {e}")
+        return idempotency_failed(
+            JsonResponse({"status": "error", "message": e.messages[0]}, status=400)
         )
 
     # create order
@@ -318,10 +312,11 @@ def verify_payment(request):
         city=shipping_address.city,
         state=shipping_address.state,
         postal_code=shipping_address.postal_code,
-        subtotal=subtotal,
-        discount_amount=discount_amount,
-        shipping_charge=shipping_charge,
-        total_amount=total_amount,
+        subtotal=checkout.subtotal,
+        discount_amount=checkout.discount_amount,
+        coupon_discount=checkout.coupon_discount,
+        shipping_charge=checkout.shipping_charge,
+        total_amount=checkout.total_amount,
         payment_method="online",
         payment_status="completed",
         status="pending",
@@ -329,109 +324,18 @@ def verify_payment(request):
         razorpay_order_id=razorpay_order_id,
         razorpay_payment_id=razorpay_payment_id,
         razorpay_signature=razorpay_signature,
+        estimated_delivery=date.today() + timedelta(days=7),
     )
-    order.estimated_delivery = date.today() + timedelta(days=7)
-    order.save()
-
-    # create order items and reduce stock
-    if mode == "buy_now":
-        buy_now_item = request.session.get("buy_now")
-        if not buy_now_item:
-            return JsonResponse(
-                {"status": "error", "message": "Buy now session expired."}, status=400
-            )
-
-        try:
-            variant = Product_varients.objects.select_related("product").get(
-                id=buy_now_item["variant_id"]
-            )
-            product = variant.product
-        except Product_varients.DoesNotExist:
-            return JsonResponse(
-                {"status": "error", "message": "product variant not found."}, status=400
-            )
-
-        quantity = buy_now_item.get("quantity", 1)
-        price = Decimal(str(buy_now_item.get("price", variant.price)))
-
-        if not product.is_listed or not variant.is_listed or variant.stock < quantity:
-            return JsonResponse(
-                {
-                    "status": "error",
-                    "message": "Product not available or out of stock.",
-                },
-                status=400,
-            )
-
-        OrderItem.objects.create(
-            order=order,
-            product=product,
-            product_name=product.product_name,
-            variant=variant,
-            variant_colour=variant.colour,
-            price=price,
-            original_price=variant.price,
-            discount_amount=Decimal("0.00"),
-            quantity=quantity,
-            status="pending",
-        )
-        # reduce stock
-        variant.stock -= quantity
-        variant.save()
-
-    else:
-        # cart flow
-        cart = get_or_create_cart(user)
-        cart_items = cart.items.select_related("product", "variant").all()
-
-        # Re-check listing and stock
-        for item in cart_items:
-            if not item.product.is_listed or not item.variant.is_listed:
-                return JsonResponse(
-                    {
-                        "status": "error",
-                        "message": f"{item.product.product_name} is unavailable or out of stock.",
-                    },
-                    status=400,
-                )
-
-            if item.variant.stock <= 0 or item.variant.stock < item.quantity:
-                return JsonResponse(
-                    {
-                        "status": "error",
-                        "message": f"Not enough stock for {item.product.product_name}.",
-                    },
-                    status=400,
-                )
-
-        for cart_item in cart_items:
-            original_price = cart_item.variant.price
-            item_discount = Decimal("0.00")
-
-            # if cart_item.product.offer and cart_item.product.offer.is_active:
-            #     item_discount = (cart_item.variant.price - original_price) * cart_item.quantity
-
-            OrderItem.objects.create(
-                order=order,
-                product=cart_item.product,
-                variant=cart_item.variant,
-                product_name=cart_item.product.product_name,
-                variant_colour=cart_item.variant.colour,
-                price=cart_item.price,
-                original_price=original_price,
-                discount_amount=item_discount,
-                quantity=cart_item.quantity,
-                status="pending",
-            )
-
-            # Reduce stock
-            cart_item.variant.stock -= cart_item.quantity
-            cart_item.variant.save()
+    create_order_items(order, order_items)
+    complete_idempotency_key(idempotency, order=order)
 
+    if mode != "buy_now":
         # Clear cart
+        cart = get_or_create_cart(user)
         cart.items.all().delete()
         cart.total = Decimal("0.00")
         cart.save()
+        set_cart_item_count(cart.user_id, 0)
 
     # wallet debit (after order created)
     if wallet_used > 0:
@@ -486,6 +390,7 @@ def verify_payment(request):
 
     if "pending_payment" in request.session:
         del request.session["pending_payment"]
+    request.session.pop("checkout_quote", None)
 
     # for existing order_success view
     request.session["last_order_id"] = order.id
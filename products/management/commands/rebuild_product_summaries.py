@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from products.models import Product
+from products.utils import refresh_product_summaries
+
+
+class Command(BaseCommand):
+    help = "Rebuild the ProductSummary row of every product"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            default=500,
+            help="Number of products recomputed per batch",
+        )
+
+    def handle(self, *args, **options):
+        chunk_size = options["chunk_size"]
+        product_ids = list(Product.objects.order_by("id").values_list("id", flat=True))
+
+        total = 0
+        for start in range(0, len(product_ids), chunk_size):
+            total += refresh_product_summaries(product_ids[start : start + chunk_size])
+
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {total} product summaries"))
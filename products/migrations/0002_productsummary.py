@@ -0,0 +1,100 @@
+# Generated by Django 5.2.4 on 2026-10-17 03:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def build_summaries(apps, schema_editor):
+    """Fill ProductSummary for the existing catalog (historical models)"""
+    Product = apps.get_model("products", "Product")
+    Product_varients = apps.get_model("products", "Product_varients")
+    VariantImage = apps.get_model("products", "VariantImage")
+    ProductSummary = apps.get_model("products", "ProductSummary")
+
+    stats = {}
+    for variant in (
+        Product_varients.objects.filter(is_listed=True)
+        .order_by("product_id", "price", "colour")
+        .values("id", "product_id", "stock")
+    ):
+        row = stats.setdefault(
+            variant["product_id"], {"cheapest": variant["id"], "count": 0, "stock": 0}
+        )
+        row["count"] += 1
+        row["stock"] += max(variant["stock"], 0)
+
+    images = {}
+    for image in (
+        VariantImage.objects.filter(is_listed=True)
+        .order_by("variant_id", "-is_primary", "created_at", "id")
+        .values("variant_id", "image")
+    ):
+        if image["image"]:
+            images.setdefault(image["variant_id"], image["image"])
+
+    summaries = []
+    for product in Product.objects.select_related("category"):
+        row = stats.get(product.id, {"cheapest": None, "count": 0, "stock": 0})
+        category_listed = product.category is None or product.category.is_listed
+        summaries.append(
+            ProductSummary(
+                product=product,
+                is_visible=product.is_listed and category_listed and row["count"] > 0,
+                in_stock=row["stock"] > 0,
+                total_stock=row["stock"],
+                cheapest_variant_id=row["cheapest"],
+                primary_image=images.get(row["cheapest"], ""),
+                variant_count=row["count"],
+            )
+        )
+    ProductSummary.objects.bulk_create(summaries, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ProductSummary",
+            fields=[
+                (
+                    "product",
+                    models.OneToOneField(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="summary",
+                        serialize=False,
+                        to="products.product",
+                    ),
+                ),
+                ("is_visible", models.BooleanField(default=False)),
+                ("in_stock", models.BooleanField(default=False)),
+                ("total_stock", models.IntegerField(default=0)),
+                ("primary_image", models.CharField(blank=True, max_length=255)),
+                ("variant_count", models.PositiveIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                (
+                    "cheapest_variant",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="+",
+                        to="products.product_varients",
+                    ),
+                ),
+            ],
+            options={
+                "indexes": [
+                    models.Index(
+                        fields=["is_visible", "in_stock"],
+                        name="products_pr_is_visi_ac0619_idx",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(build_summaries, migrations.RunPython.noop),
+    ]
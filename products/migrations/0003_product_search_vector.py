@@ -0,0 +1,46 @@
+# Generated by Django 5.2.4 on 2026-10-17 04:02
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+def add_search_index(apps, schema_editor):
+    # GIN index and backfill only make sense on PostgreSQL,
+    # other databases fall back to icontains search
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute(
+        "CREATE INDEX IF NOT EXISTS products_product_search_vector_gin "
+        "ON products_product USING gin (search_vector)"
+    )
+    schema_editor.execute(
+        "UPDATE products_product AS p SET search_vector = "
+        "setweight(to_tsvector('english', coalesce(p.product_name, '')), 'A') || "
+        "setweight(to_tsvector('english', coalesce((SELECT c.category_name "
+        "FROM category_category AS c WHERE c.id = p.category_id), '')), 'B') || "
+        "setweight(to_tsvector('english', coalesce(p.description, '')), 'C')"
+    )
+
+
+def remove_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+    schema_editor.execute("DROP INDEX IF EXISTS products_product_search_vector_gin")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("products", "0002_productsummary"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="product",
+            name="search_vector",
+            field=django.contrib.postgres.search.SearchVectorField(
+                blank=True, editable=False, null=True
+            ),
+        ),
+        migrations.RunPython(add_search_index, remove_search_index),
+    ]
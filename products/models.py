@@ -1,10 +1,123 @@
-from django.db import models
+from django.db import models, connection
+from django.contrib.postgres.search import SearchQuery, SearchRank, SearchVectorField
 from category.models import Category
-from django.db.models import Avg, Count
+from django.db.models import Avg, Count, Min, OuterRef, Subquery, Value, F, Q, Case, When
+from django.db.models.functions import Coalesce, Greatest, Round
+from django.utils import timezone
 
 # Create your models here.
 
 
+class ProductQuerySet(models.QuerySet):
+    def with_effective_price(self):
+        """Annotate the real selling price so listings can filter/sort in SQL.
+
+        Adds:
+        - listed_min_price: cheapest listed variant price
+        - best_discount: discount % of the best running offer (0 if none)
+        - effective_price: listed_min_price after best_discount
+
+        Follows the same rules as offers.utils.get_best_offer_for_product:
+        the oldest running offer with status "active" per product / category
+        counts, and the larger discount wins. The offer scheduler keeps
+        status in step with the dates, the date filter is only a guard.
+        """
+        # local import to avoid circular import (offers.models imports Product)
+        from offers.models import ProductOffer, CategoryOffer
+
+        today = timezone.now().date()
+
+        product_discount = (
+            ProductOffer.objects.filter(
+                product=OuterRef("pk"),
+                status="active",
+                start_date__lte=today,
+                end_date__gte=today,
+            )
+            .order_by("created_at", "id")
+            .values("discount")[:1]
+        )
+
+        category_discount = (
+            CategoryOffer.objects.filter(
+                category=OuterRef("category_id"),
+                status="active",
+                start_date__lte=today,
+                end_date__gte=today,
+            )
+            .order_by("created_at", "id")
+            .values("discount")[:1]
+        )
+
+        listed_min_price = (
+            Product_varients.objects.filter(product=OuterRef("pk"), is_listed=True)
+            .order_by()
+            .values("product")
+            .annotate(min_price=Min("price"))
+            .values("min_price")
+        )
+
+        price_field = models.DecimalField(max_digits=10, decimal_places=2)
+        discount_field = models.DecimalField(max_digits=5, decimal_places=2)
+
+        # the discount is per product, so the cheapest variant stays cheapest
+        return self.annotate(
+            listed_min_price=Subquery(listed_min_price, output_field=price_field),
+            best_discount=Greatest(
+                Coalesce(
+                    Subquery(product_discount, output_field=discount_field),
+                    Value(0, output_field=discount_field),
+                ),
+                Coalesce(
+                    Subquery(category_discount, output_field=discount_field),
+                    Value(0, output_field=discount_field),
+                ),
+            ),
+            effective_price=Round(
+                F("listed_min_price") * (Value(100) - F("best_discount")) / Value(100),
+                2,
+                output_field=price_field,
+            ),
+        )
+
+    def search(self, query):
+        """Full-text search, best match first (annotates search_rank).
+
+        On PostgreSQL this uses the stored search_vector (GIN indexed,
+        name weighted A, category B, description C, see
+        products.utils.refresh_search_vectors). Other databases (SQLite for
+        local runs) fall back to icontains, name matches ranked first.
+        """
+        query = (query or "").strip()
+        if not query:
+            return self
+
+        if connection.vendor == "postgresql":
+            search_query = SearchQuery(query, config="english", search_type="websearch")
+            return (
+                self.filter(search_vector=search_query)
+                .annotate(search_rank=SearchRank(F("search_vector"), search_query))
+                .order_by("-search_rank", "-created_at")
+            )
+
+        return (
+            self.filter(
+                Q(product_name__icontains=query)
+                | Q(category__category_name__icontains=query)
+                | Q(description__icontains=query)
+            )
+            .annotate(
+                search_rank=Case(
+                    When(product_name__icontains=query, then=Value(1.0)),
+                    When(category__category_name__icontains=query, then=Value(0.4)),
+                    default=Value(0.2),
+                    output_field=models.FloatField(),
+                )
+            )
+            .order_by("-search_rank", "-created_at")
+        )
+
+
 class Product(models.Model):
     product_name = models.CharField(max_length=200, unique=True)
     slug = models.SlugField(max_length=200, unique=True)
@@ -19,6 +132,12 @@ class Product(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # name/category/description tsvector, PostgreSQL only (null elsewhere).
+    # The GIN index is created in migration 0003 on PostgreSQL only.
+    search_vector = SearchVectorField(null=True, blank=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
     def __str__(self):
         return self.product_name
 
@@ -91,3 +210,37 @@ class VariantImage(models.Model):
 
     def __str__(self):
         return f"{self.variant.product.product_name} - {self.variant.colour} Image"
+
+
+class ProductSummary(models.Model):
+    """Denormalized storefront row per product (one narrow, indexed table).
+
+    Kept up to date by products/signals.py, rebuild with:
+    python manage.py rebuild_product_summaries
+    """
+
+    product = models.OneToOneField(
+        Product, on_delete=models.CASCADE, primary_key=True, related_name="summary"
+    )
+    # product listed + category listed + at least one listed variant
+    is_visible = models.BooleanField(default=False)
+    in_stock = models.BooleanField(default=False)
+    total_stock = models.IntegerField(default=0)
+    cheapest_variant = models.ForeignKey(
+        Product_varients,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="+",
+    )
+    primary_image = models.CharField(max_length=255, blank=True)
+    variant_count = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["is_visible", "in_stock"]),
+        ]
+
+    def __str__(self):
+        return f"Summary for product {self.product_id}"
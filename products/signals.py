@@ -0,0 +1,65 @@
+from django.db.models.signals import post_save, post_delete, pre_delete
+from django.dispatch import receiver
+
+from category.models import Category
+from .models import Product, Product_varients, VariantImage
+from .utils import refresh_product_summaries, refresh_search_vectors
+
+
+# keep ProductSummary in sync with the rows it is built from
+
+
+def _deleting_product(origin):
+    """True when a delete cascades from a Product (its summary goes with it)"""
+    return isinstance(origin, Product) or getattr(origin, "model", None) is Product
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    refresh_product_summaries([instance.id])
+    refresh_search_vectors([instance.id])
+
+
+@receiver(post_save, sender=Product_varients)
+@receiver(post_delete, sender=Product_varients)
+def variant_changed(sender, instance, origin=None, **kwargs):
+    if _deleting_product(origin):
+        return
+    refresh_product_summaries([instance.product_id])
+
+
+@receiver(post_save, sender=VariantImage)
+@receiver(post_delete, sender=VariantImage)
+def variant_image_changed(sender, instance, origin=None, **kwargs):
+    if _deleting_product(origin):
+        return
+    product_id = (
+        Product_varients.objects.filter(id=instance.variant_id)
+        .values_list("product_id", flat=True)
+        .first()
+    )
+    if product_id:
+        refresh_product_summaries([product_id])
+
+
+@receiver(post_save, sender=Category)
+def category_saved(sender, instance, **kwargs):
+    product_ids = list(
+        Product.objects.filter(category=instance).values_list("id", flat=True)
+    )
+    refresh_product_summaries(product_ids)
+    # category name is part of the search vector
+    refresh_search_vectors(product_ids)
+
+
+@receiver(pre_delete, sender=Category)
+def category_deleting(sender, instance, **kwargs):
+    # products are SET_NULL before post_delete runs, remember them now
+    instance._summary_product_ids = list(
+        Product.objects.filter(category=instance).values_list("id", flat=True)
+    )
+
+
+@receiver(post_delete, sender=Category)
+def category_deleted(sender, instance, **kwargs):
+    refresh_product_summaries(getattr(instance, "_summary_product_ids", []))
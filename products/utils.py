@@ -0,0 +1,176 @@
+from django.contrib.postgres.search import SearchVector
+from django.db import connection
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from category.models import Category
+from products.models import Product, Product_varients, VariantImage, ProductSummary
+from offers.utils import apply_offers_to_variants
+
+
+def load_product_cards(products, in_stock_only=False):
+    """Attach listing card data to a page of products in a fixed number of queries.
+
+    Sets on every product:
+    - min_variant: cheapest listed variant (in stock only if in_stock_only)
+    - image_url: primary (or first) listed image of min_variant, or None
+    - pricing: apply_offer_to_variant style dict for min_variant, or None
+    - is_available: True if any listed variant has stock
+
+    Queries: 1 for variants, 1 for images, 2 for offers (same for 4 or 40 products).
+    Returns the products as a list so the attached attributes are kept.
+    """
+
+    products = list(products)
+    if not products:
+        return products
+
+    product_ids = [product.id for product in products]
+
+    # 1 query: all listed variants of the page, cheapest first (same tie-break
+    # on colour as product.varients.filter(...).first())
+    variants = (
+        Product_varients.objects.filter(product_id__in=product_ids, is_listed=True)
+        .select_related("product")
+        .order_by("product_id", "price", "colour")
+    )
+
+    min_variants = {}
+    available = set()
+    for variant in variants:
+        if variant.stock > 0:
+            available.add(variant.product_id)
+        elif in_stock_only:
+            continue
+        min_variants.setdefault(variant.product_id, variant)
+
+    # 1 query: only the images of the chosen variants, primary image first
+    image_urls = {}
+    for image in VariantImage.objects.filter(
+        variant_id__in=[variant.id for variant in min_variants.values()],
+        is_listed=True,
+    ).order_by("variant_id", "-is_primary", "created_at", "id"):
+        if image.variant_id not in image_urls and image.image:
+            image_urls[image.variant_id] = image.image.url
+
+    # 2 queries: offers for the whole page
+    pricing = apply_offers_to_variants(min_variants.values())
+
+    for product in products:
+        min_variant = min_variants.get(product.id)
+        product.min_variant = min_variant  # temporary attribute, not a model field
+        product.image_url = image_urls.get(min_variant.id) if min_variant else None
+        product.pricing = pricing.get(min_variant.id) if min_variant else None
+        product.is_available = product.id in available
+
+    return products
+
+
+def refresh_product_summaries(product_ids=None):
+    """Recompute ProductSummary rows for the given products (all if None).
+
+    Fixed number of queries for any number of products: products, listed
+    variants, images of the cheapest variants and one bulk upsert.
+    Returns the number of summaries written.
+    """
+    products = Product.objects.select_related("category").order_by()
+    variants = Product_varients.objects.filter(is_listed=True)
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(id__in=product_ids)
+        variants = variants.filter(product_id__in=product_ids)
+
+    products = list(products)
+    if not products:
+        return 0
+
+    # cheapest listed variant first (same tie-break as load_product_cards)
+    stats = {}
+    for variant in variants.order_by("product_id", "price", "colour").values(
+        "id", "product_id", "stock"
+    ):
+        row = stats.setdefault(
+            variant["product_id"],
+            {"cheapest": variant["id"], "count": 0, "stock": 0},
+        )
+        row["count"] += 1
+        row["stock"] += max(variant["stock"], 0)
+
+    images = {}
+    for image in (
+        VariantImage.objects.filter(
+            variant_id__in=[row["cheapest"] for row in stats.values()],
+            is_listed=True,
+        )
+        .order_by("variant_id", "-is_primary", "created_at", "id")
+        .values("variant_id", "image")
+    ):
+        if image["image"]:
+            images.setdefault(image["variant_id"], image["image"])
+
+    now = timezone.now()
+    summaries = []
+    for product in products:
+        row = stats.get(product.id, {"cheapest": None, "count": 0, "stock": 0})
+        category_listed = product.category is None or product.category.is_listed
+        summaries.append(
+            ProductSummary(
+                product=product,
+                is_visible=product.is_listed and category_listed and row["count"] > 0,
+                in_stock=row["stock"] > 0,
+                total_stock=row["stock"],
+                cheapest_variant_id=row["cheapest"],
+                primary_image=images.get(row["cheapest"], ""),
+                variant_count=row["count"],
+                updated_at=now,
+            )
+        )
+
+    ProductSummary.objects.bulk_create(
+        summaries,
+        update_conflicts=True,
+        unique_fields=["product"],
+        update_fields=[
+            "is_visible",
+            "in_stock",
+            "total_stock",
+            "cheapest_variant",
+            "primary_image",
+            "variant_count",
+            "updated_at",
+        ],
+    )
+    return len(summaries)
+
+
+def refresh_search_vectors(product_ids=None):
+    """Rebuild Product.search_vector for the given products (all if None).
+
+    Name is weighted A, category name B and description C. Only runs on
+    PostgreSQL, other databases search with icontains (ProductQuerySet.search).
+    Returns the number of products updated.
+    """
+    if connection.vendor != "postgresql":
+        return 0
+
+    products = Product.objects.order_by()
+    if product_ids is not None:
+        product_ids = set(product_ids)
+        if not product_ids:
+            return 0
+        products = products.filter(id__in=product_ids)
+
+    # one UPDATE, the category name comes from a correlated subquery since
+    # update() cannot join. update() does not send post_save, so no signal loop
+    category_name = Subquery(
+        Category.objects.filter(id=OuterRef("category_id"))
+        .order_by()
+        .values("category_name")[:1]
+    )
+    return products.update(
+        search_vector=SearchVector("product_name", weight="A", config="english")
+        + SearchVector(Coalesce(category_name, Value("")), weight="B", config="english")
+        + SearchVector("description", weight="C", config="english")
+    )
@@ -2,12 +2,12 @@ from django.shortcuts import render, redirect, get_object_or_404
 from accounts.models import Account
 from django.contrib import messages
 from django.contrib.auth import authenticate, login, logout
-from django.core.paginator import Paginator
-from django.db.models import Q
+from ecommerce.pagination import paginate
 from django.db import transaction
 from django.contrib.auth.decorators import login_required
-from category.models import Category
+from category.utils import get_category_tree
 from products.models import Product, Product_varients, VariantImage
+from products.utils import refresh_product_summaries
 from django.utils.text import slugify
 
 # Create your views here.
@@ -31,13 +31,9 @@ def product_list(request):
         .prefetch_related("varients__images")
         .order_by("-created_at")
     )
-    # search filter
+    # full-text search on name, category and description, best match first
     if search_query:
-        products = products.filter(
-            Q(product_name__icontains=search_query)
-            | Q(description__icontains=search_query)
-            | Q(category__category_name__icontains=search_query)
-        )
+        products = products.search(search_query)
 
     # apply main category filter(male/female)
     if main_category_filter:
@@ -58,19 +54,17 @@ def product_list(request):
     elif sort == "price_high":
         products = products.order_by("-base_price")
 
-    paginator = Paginator(products, 3)
-    page_number = request.GET.get("page")
-    products_page = paginator.get_page(page_number)
+    products_page = paginate(request, products, 3)
+
+    tree = get_category_tree()
 
     # get all main categories(parent=None) for filter
-    main_categories = Category.objects.filter(is_listed=True, parent=None).order_by(
-        "category_name"
-    )
+    main_categories = tree.main_categories()
 
     # get all sub categories for filter dropdown
-    subcategories = Category.objects.filter(
-        is_listed=True, parent__isnull=False
-    ).order_by("category_name")
+    subcategories = sorted(
+        tree.subcategories(), key=lambda category: category.category_name
+    )
 
     context = {
         "products": products_page,
@@ -92,11 +86,10 @@ def add_product(request):
         messages.error(request, "You do not have permission to access this page.")
         return redirect("admin_login")
 
-    # Get only subcategories(with parent)
-    categories = (
-        Category.objects.filter(is_listed=True, parent__isnull=False)
-        .select_related("parent")
-        .order_by("parent__category_name", "category_name")
+    # Get only subcategories(with parent), parent already attached by the tree
+    categories = sorted(
+        get_category_tree().subcategories(),
+        key=lambda category: (category.parent.category_name, category.category_name),
     )
 
     if request.method == "POST":
@@ -303,14 +296,11 @@ def edit_product(request, product_id):
         return redirect("admin_login")
 
     product = get_object_or_404(Product, id=product_id)
-    categories = (
-        Category.objects.filter(is_listed=True, parent__isnull=False)
-        .select_related("parent")
-        .order_by("parent__category_name", "category_name")
-    )
-    main_categories = Category.objects.filter(is_listed=True, parent=None).order_by(
-        "category_name"
+    categories = sorted(
+        get_category_tree().subcategories(),
+        key=lambda category: (category.parent.category_name, category.category_name),
     )
+    main_categories = get_category_tree().main_categories()
 
     if request.method == "POST":
         product_name = request.POST.get("product_name", "").strip()
@@ -501,6 +491,9 @@ def edit_product(request, product_id):
                             f"Variant {idx} ({variant.colour}) must have at least 3 images (currently has {image_count})"
                         )
 
+                # primary image .update() above does not send signals
+                refresh_product_summaries([product.id])
+
                 messages.success(
                     request, f'Product "{product_name}" updated successfully.'
                 )
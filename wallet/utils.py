@@ -1,5 +1,6 @@
 from decimal import Decimal
 from django.db import transaction
+from django.utils import timezone
 
 from accounts.models import Account
 from .models import Wallet, WalletTransaction
@@ -30,7 +31,8 @@ def credit_wallet(
     order=None,
     order_item=None,
 ):
-    """Add money to wallet and create a transaction record."""
+    """Add money to wallet and create a transaction record.
+    Returns the WalletTransaction (None for a non-positive amount)."""
 
     amount = Decimal(str(amount))
     if amount <= 0:
@@ -44,7 +46,7 @@ def credit_wallet(
     wallet.balance = new_balance
     wallet.save()
 
-    WalletTransaction.objects.create(
+    return WalletTransaction.objects.create(
         wallet=wallet,
         tx_type=tx_type,
         amount=amount,
@@ -55,7 +57,55 @@ def credit_wallet(
         order_item=order_item,
     )
 
-    return wallet
+
+@transaction.atomic
+def credit_wallets(credits, tx_type="credit"):
+    """credit_wallet for many users at once, in a fixed number of queries.
+    credits: [{"user_id", "amount", "description", "order", "order_item"}],
+    a user may appear more than once. Returns the WalletTransactions.
+    """
+    credits = [
+        {**credit, "amount": Decimal(str(credit["amount"])).quantize(Decimal("0.01"))}
+        for credit in credits
+    ]
+    credits = [credit for credit in credits if credit["amount"] > 0]
+    if not credits:
+        return []
+
+    user_ids = {credit["user_id"] for credit in credits}
+    Wallet.objects.bulk_create(
+        [Wallet(user_id=user_id, balance=Decimal("0.00")) for user_id in user_ids],
+        ignore_conflicts=True,
+    )
+    wallets = {
+        wallet.user_id: wallet
+        for wallet in Wallet.objects.select_for_update()
+        .filter(user_id__in=user_ids)
+        .order_by("id")
+    }
+
+    now = timezone.now()
+    transactions = []
+    for credit in credits:
+        wallet = wallets[credit["user_id"]]
+        old_balance = wallet.balance
+        wallet.balance = old_balance + credit["amount"]
+        wallet.updated_at = now
+        transactions.append(
+            WalletTransaction(
+                wallet=wallet,
+                tx_type=tx_type,
+                amount=credit["amount"],
+                old_balance=old_balance,
+                new_balance=wallet.balance,
+                description=credit.get("description", ""),
+                order=credit.get("order"),
+                order_item=credit.get("order_item"),
+            )
+        )
+
+    Wallet.objects.bulk_update(wallets.values(), ["balance", "updated_at"])
+    return WalletTransaction.objects.bulk_create(transactions)
 
 
 @transaction.atomic
@@ -9,6 +9,7 @@ from django.utils import timezone
 from django.db import transaction
 from django.contrib import messages
 from django.core.paginator import Paginator
+from ecommerce.pagination import paginate
 from django.db.models import Q
 from django.http import HttpResponse
 import csv
@@ -20,7 +21,12 @@ from wallet.models import Wallet
 from .utils import get_or_create_wallet, credit_wallet
 
 # imorting razorpay client
-from payments.utils import razorpay_client
+from payments.utils import (
+    claim_idempotency_key,
+    complete_idempotency_key,
+    idempotency_failed,
+    razorpay_client,
+)
 
 import logging
 
@@ -162,13 +168,28 @@ def add_money_verify_payment(request):
             {"status": "error", "message": "Payment verification failed."}, status=400
         )
 
+    # a retried callback for the same payment must not credit twice
+    idempotency, first = claim_idempotency_key(
+        request.user, "wallet_recharge", razorpay_payment_id
+    )
+    if not first:
+        return JsonResponse(
+            {
+                "status": "success",
+                "message": "Payment already added to your wallet.",
+                "new_balance": str(get_or_create_wallet(request.user).balance),
+            }
+        )
+
     # get pending recharge from session
     pending = request.session.get("pending_wallet_recharge")
 
     if not pending or pending.get("razorpay_order_id") != razorpay_order_id:
-        return JsonResponse(
-            {"status": "error", "message": "No matching pending recharge found."},
-            status=400,
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "No matching pending recharge found."},
+                status=400,
+            )
         )
 
     amount = Decimal(pending["amount"])
@@ -180,20 +201,24 @@ def add_money_verify_payment(request):
         rp_amount = Decimal(rp_order["amount"]) / 100  # convert to INR to check
     except Exception as e:
         logger.error(f"Failed to ferch razorpay order: {e}")
-        return JsonResponse(
-            {"status": "error", "message": "Failed to verify payment amount"},
-            status=400,
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "Failed to verify payment amount"},
+                status=400,
+            )
         )
 
     if rp_amount != amount:
         logger.error(f"Amount mismatch! Expected{amount},  but got {rp_amount}")
-        return JsonResponse(
-            {"status": "error", "message": "Payment amount mismatch."}, status=400
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "Payment amount mismatch."}, status=400
+            )
         )
 
     # credit-wallet for automatic balance update , transaction record and error handling
     description = f"Wallet recharged via Razorpay (Payment ID: {razorpay_payment_id})"
-    wallet = credit_wallet(
+    wallet_transaction = credit_wallet(
         user=user,
         amount=amount,
         tx_type="credit",
@@ -202,12 +227,16 @@ def add_money_verify_payment(request):
         order_item=None,
     )
 
-    if not wallet:
+    if not wallet_transaction:
         logger.error(f"Wallet credit failed for user {user.id}")
-        return JsonResponse(
-            {"status": "error", "message": "Failed to credit wallet."}, status=500
+        return idempotency_failed(
+            JsonResponse(
+                {"status": "error", "message": "Failed to credit wallet."}, status=500
+            )
         )
 
+    complete_idempotency_key(idempotency, wallet_transaction=wallet_transaction)
+
     if "pending_wallet_recharge" in request.session:
         del request.session["pending_wallet_recharge"]
 
@@ -217,7 +246,7 @@ def add_money_verify_payment(request):
         {
             "status": "success",
             "message": f"₹{amount} added to your wallet successfully!",
-            "new_balance": str(wallet.balance),
+            "new_balance": str(wallet_transaction.new_balance),
         }
     )
 
@@ -257,9 +286,7 @@ def admin_wallet_view(request):
     # if request.GET.get("export") == "csv":
     #     return export_wallet_csv(wallets)
 
-    paginator = Paginator(wallets, 10)
-    page_number = request.GET.get("page")
-    wallets = paginator.get_page(page_number)
+    wallets = paginate(request, wallets, 10)
 
     context = {
         "wallets": wallets,
@@ -1,15 +1,11 @@
-from .models import Wishlist
+from .utils import get_wishlist_item_count
 
 
 def wishlist_count(request):
-    """Add wishlist count to all templates"""
+    """Add wishlist count to all templates (from the cache, db only on a miss)"""
     wishlist_item_count = 0
 
     if request.user.is_authenticated:
-        try:
-            wishlist = Wishlist.objects.get(user=request.user)
-            wishlist_item_count = wishlist.get_item_count()
-        except Wishlist.DoesNotExist:
-            wishlist_item_count = 0
+        wishlist_item_count = get_wishlist_item_count(request.user)
 
     return {"wishlist_item_count": wishlist_item_count}
@@ -2,7 +2,11 @@ from django.db import models
 from decimal import Decimal
 from accounts.models import Account
 from products.models import Product, Product_varients
-from offers.utils import get_best_offer_for_product, calculate_discounted_price
+from offers.utils import (
+    get_best_offer_for_product,
+    calculate_discounted_price,
+    apply_offers_to_variants,
+)
 
 # Create your models here.
 
@@ -69,7 +73,17 @@ class WishlistItem(models.Model):
         return False
 
     def get_price(self):
-        """Get current price (with discount if applicable)"""
+        """Get current price (with discount if applicable)
+        wishlist_view attaches item.pricing from apply_offers_to_variants,
+        so the page prices all items in one batch.
+        """
+        if self.variant:
+            pricing = getattr(self, "pricing", None)
+            if pricing is None:
+                pricing = apply_offers_to_variants([self.variant])[self.variant_id]
+                self.pricing = pricing
+            return pricing["final_price"]
+
         base_price = self.variant.price if self.variant else self.product.base_price
 
         offer_info = get_best_offer_for_product(self.product)
@@ -1,5 +1,45 @@
+from django.core.cache import cache
+from django.db import transaction
+
 from .models import Wishlist, WishlistItem
 
+# navbar badge: wishlist item count per user in the cache, adjusted by the
+# wishlist views and recomputed from the database only on a miss
+WISHLIST_COUNT_TIMEOUT = 60 * 60
+
+
+def _wishlist_count_key(user_id):
+    return f"wishlist_count:{user_id}"
+
+
+def get_wishlist_item_count(user):
+    """Number of items in the user's wishlist (cached)"""
+    key = _wishlist_count_key(user.id)
+    count = cache.get(key)
+    if count is None:
+        count = WishlistItem.objects.filter(wishlist__user=user).count()
+        cache.set(key, count, WISHLIST_COUNT_TIMEOUT)
+    return count
+
+
+def set_wishlist_count(user_id, count):
+    """Store the badge count once the current transaction commits"""
+    transaction.on_commit(
+        lambda: cache.set(_wishlist_count_key(user_id), count, WISHLIST_COUNT_TIMEOUT)
+    )
+
+
+def change_wishlist_count(user_id, delta):
+    """Add delta to the cached count (a missing key is recomputed on read)"""
+
+    def apply():
+        try:
+            cache.incr(_wishlist_count_key(user_id), delta)
+        except ValueError:
+            pass
+
+    transaction.on_commit(apply)
+
 
 def get_or_create_wishlist(user):
     """Get or create wishlist for a user"""
@@ -41,6 +81,9 @@ def clean_wishlist_invalid_items(wishlist):
             removed_items.append(str(item))
             item.delete()
 
+    if removed_items:
+        change_wishlist_count(wishlist.user_id, -len(removed_items))
+
     return removed_items
 
 
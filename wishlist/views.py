@@ -9,11 +9,15 @@ from django.urls import reverse
 
 from .models import Wishlist, WishlistItem
 from products.models import Product, Product_varients
+from offers.utils import apply_offers_to_variants
 from .utils import (
     get_or_create_wishlist,
     is_product_addable_to_wishlist,
     clean_wishlist_invalid_items,
     is_in_wishlist,
+    get_wishlist_item_count,
+    set_wishlist_count,
+    change_wishlist_count,
 )
 
 
@@ -31,12 +35,20 @@ def wishlist_view(request):
             f"Some items were removed from your wishlist: {', '.join(removed_items)}",
         )
 
-    wishlist_items = (
+    wishlist_items = list(
         wishlist.items.select_related("product", "variant", "product__category")
         .prefetch_related("variant__images")
         .all()
     )
 
+    # price all items in one batch, item.get_price() reads it back
+    pricing = apply_offers_to_variants(
+        item.variant for item in wishlist_items if item.variant
+    )
+    for item in wishlist_items:
+        if item.variant_id in pricing:
+            item.pricing = pricing[item.variant_id]
+
     breadcrumbs = [
         {"label": "Home", "url": reverse("home")},
         {"label": "All Products", "url": reverse("user_product_list")},
@@ -46,7 +58,7 @@ def wishlist_view(request):
     context = {
         "wishlist": wishlist,
         "wishlist_items": wishlist_items,
-        "wishlist_count": wishlist.get_item_count(),
+        "wishlist_count": get_wishlist_item_count(request.user),
         "breadcrumbs": breadcrumbs,
     }
 
@@ -89,6 +101,7 @@ def add_to_wishlist(request):
         )
 
         if created:
+            change_wishlist_count(request.user.id, 1)
             messages.success(request, f"{product.product_name} added to your wishlist.")
         else:
             messages.info(
@@ -111,6 +124,7 @@ def remove_from_wishlist(request):
 
     product_name = wishlist_item.product.product_name
     wishlist_item.delete()
+    change_wishlist_count(request.user.id, -1)
 
     messages.success(request, f"{product_name} removed from your wishlist.")
     return redirect("wishlist_view")
@@ -149,6 +163,7 @@ def toggle_wishlist(request):
         if existing_item:
             # Remove from wishlist
             existing_item.delete()
+            change_wishlist_count(request.user.id, -1)
             return JsonResponse(
                 {
                     "success": True,
@@ -167,6 +182,7 @@ def toggle_wishlist(request):
             WishlistItem.objects.create(
                 wishlist=wishlist, product=product, variant=variant
             )
+            change_wishlist_count(request.user.id, 1)
             return JsonResponse(
                 {
                     "success": True,
@@ -196,6 +212,7 @@ def move_to_cart(request):
     if not wishlist_item.is_product_available():
         messages.error(request, "This product is no longer available.")
         wishlist_item.delete()
+        change_wishlist_count(request.user.id, -1)
         return redirect("wishlist_view")
 
     # Check if in stock
@@ -244,8 +261,9 @@ def move_to_cart(request):
 
         # Remove from wishlist
         wishlist_item.delete()
+        change_wishlist_count(request.user.id, -1)
 
-        # Recalculate cart total
+        # Recalculate cart total, this also stores the navbar cart count
         cart.calculate_total()
 
     return redirect("wishlist_view")
@@ -296,8 +314,9 @@ def move_all_to_cart(request):
             item.delete()
             moved_count += 1
 
-        # Recalculate cart total
+        # Recalculate cart total, this also stores the navbar cart count
         cart.calculate_total()
+        change_wishlist_count(request.user.id, -moved_count)
 
     if moved_count > 0:
         messages.success(request, f"{moved_count} item(s) moved to cart.")
@@ -315,6 +334,7 @@ def clear_wishlist(request):
     """Clear all items from wishlist"""
     wishlist = get_or_create_wishlist(request.user)
     wishlist.items.all().delete()
+    set_wishlist_count(request.user.id, 0)
 
     messages.success(request, "Your wishlist has been cleared.")
     return redirect("wishlist_view")
@@ -324,8 +344,7 @@ def clear_wishlist(request):
 @login_required(login_url="login")
 def get_wishlist_count(request):
     """Get wishlist item count for AJAX requests"""
-    wishlist = get_or_create_wishlist(request.user)
-    return JsonResponse({"count": wishlist.get_item_count()})
+    return JsonResponse({"count": get_wishlist_item_count(request.user)})
 
 
 # Check if product is in wishlist (AJAX)